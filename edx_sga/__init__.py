@@ -1 +1,3 @@
 from .sga import StaffGradedAssignmentXBlock
+
+default_app_config = 'edx_sga.apps.EdxSgaConfig'
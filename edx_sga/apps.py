@@ -0,0 +1,12 @@
+"""
+Django application configuration for the Staff Graded Assignment XBlock.
+"""
+from django.apps import AppConfig
+
+
+class EdxSgaConfig(AppConfig):
+    name = 'edx_sga'
+    verbose_name = 'Staff Graded Assignment'
+
+    def ready(self):
+        from edx_sga import signals  # pylint: disable=unused-variable
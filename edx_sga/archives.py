@@ -0,0 +1,194 @@
+"""
+Zip archives of submissions that are built in the background and kept in
+storage, so they can be handed out again while the submissions they contain
+don't change.
+
+Each stored archive remembers its members and the selection of students it
+was built for.  When a new archive is built, members that the latest archive
+of the same selection already holds are copied from it still compressed, and
+only new or changed submissions are read from storage and compressed.  This
+saves compressing the same files again, not I/O: the previous archive is
+still read in full and the whole new archive is written to storage.  Once
+saved, the new archive supersedes the earlier ones of its selection, which
+are deleted.  Archives of other selections are left alone.
+"""
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+import zipfile
+
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db import IntegrityError
+
+from edx_sga.models import SubmissionArchive
+from edx_sga.zipstream import ZipStream, iter_file, iter_raw_member
+
+log = logging.getLogger(__name__)
+
+ZIP_SUBDIR = 'student_submissions'
+# Don't write progress to the database more often than this, in seconds
+PROGRESS_INTERVAL = 1
+
+
+def archive_key(members):
+    """
+    Returns a key identifying the set of (student, sha1) members of an
+    archive, whatever order they come in.
+    """
+    sha1 = hashlib.sha1()
+    for member in sorted(members, key=_member_id):
+        sha1.update(u'{}\t{}\t{}\n'.format(*_member_id(member)).encode('utf-8'))
+    return sha1.hexdigest()
+
+
+def selection_key(student_ids):
+    """
+    Returns a key identifying the students an archive is asked for, whatever
+    order they come in, or '' for all of them.
+    """
+    if student_ids is None:
+        return ''
+    return hashlib.sha1(
+        u'\n'.join(sorted(set(student_ids))).encode('utf-8')).hexdigest()
+
+
+def find_archive(item_id, key):
+    """
+    Returns the stored archive of a block with the given key, if any.
+    """
+    return SubmissionArchive.objects.filter(
+        item_id=unicode(item_id), key=key).first()
+
+
+def build_submission_archive(job, key, path, members, selection=''):
+    """
+    Job function that zips `members`, dicts with the storage 'path' and
+    archive 'name' of each file plus the 'student_id' and 'sha1' of its
+    submission, and saves the archive to storage under `path`.  `selection`
+    is the `selection_key` of the students it was asked for.
+    """
+    total = len(members)
+    job.report_progress(0, total)
+    base_file, reusable = _open_base_archive(job.item_id, selection, members)
+    stream = ZipStream()
+    copied = 0
+    try:
+        with tempfile.TemporaryFile() as archive_file:
+            reported = time.time()
+            for done, member in enumerate(members, 1):
+                info = reusable.get(_member_id(member))
+                if info is not None:
+                    output = stream.write_raw(
+                        info, iter_raw_member(base_file, info))
+                    copied += 1
+                else:
+                    output = stream.write(
+                        _arcname(member),
+                        iter_file(default_storage.open(member['path'])))
+                for data in output:
+                    archive_file.write(data)
+                if time.time() - reported > PROGRESS_INTERVAL:
+                    job.report_progress(done)
+                    reported = time.time()
+            for data in stream.close():
+                archive_file.write(data)
+            archive_file.seek(0)
+            path = default_storage.save(path, File(archive_file))
+    finally:
+        if base_file is not None:
+            base_file.close()
+    job.report_progress(total)
+
+    archive = _save_archive(job, key, path, members, selection)
+    return {
+        'archive_id': archive.id,
+        'path': archive.path,
+        'copied': copied,
+        'added': total - copied,
+    }
+
+
+def _open_base_archive(item_id, selection, members):
+    """
+    Opens the latest archive of the selection when it holds some of
+    `members`.  Returns the open file, or None, and a dict mapping the ids of
+    the members it holds to their ZipInfo.
+    """
+    base = SubmissionArchive.objects.filter(
+        item_id=item_id, selection=selection).order_by('-id').first()
+    if base is None:
+        return None, {}
+    wanted = set(_member_id(member) for member in members)
+    shared = [
+        member for member in json.loads(base.members)
+        if _member_id(member) in wanted
+    ]
+    if not shared:
+        return None, {}
+
+    try:
+        base_file = default_storage.open(base.path)
+        base_zip = zipfile.ZipFile(base_file)
+    except (IOError, OSError, zipfile.BadZipfile):
+        log.warning(
+            'Could not read SGA archive %s, building from scratch', base.path,
+            exc_info=True)
+        return None, {}
+    reusable = {}
+    for member in shared:
+        try:
+            reusable[_member_id(member)] = base_zip.getinfo(_arcname(member))
+        except KeyError:
+            pass
+    return base_file, reusable
+
+
+def _save_archive(job, key, path, members, selection):
+    try:
+        archive, _ = SubmissionArchive.objects.get_or_create(
+            item_id=job.item_id,
+            key=key,
+            defaults={
+                'course_id': job.course_id,
+                'selection': selection,
+                'path': path,
+                'members': json.dumps(members),
+            },
+        )
+    except IntegrityError:
+        archive = SubmissionArchive.objects.get(item_id=job.item_id, key=key)
+    if archive.path != path:
+        # Someone else stored the same archive in the meantime
+        default_storage.delete(path)
+    else:
+        _delete_superseded(archive)
+    return archive
+
+
+def _delete_superseded(archive):
+    """
+    Deletes the archives of the same selection that were saved before
+    `archive`, and their files.
+    """
+    superseded = SubmissionArchive.objects.filter(
+        item_id=archive.item_id, selection=archive.selection,
+        id__lt=archive.id)
+    paths = list(superseded.values_list('path', flat=True))
+    superseded.delete()
+    for path in paths:
+        try:
+            default_storage.delete(path)
+        except (IOError, OSError):
+            log.warning('Could not delete SGA archive %s', path, exc_info=True)
+
+
+def _member_id(member):
+    return member['student_id'], member['sha1'], member['name']
+
+
+def _arcname(member):
+    return os.path.join(ZIP_SUBDIR, member['name'])
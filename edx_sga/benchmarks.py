@@ -0,0 +1,287 @@
+"""
+Benchmarks of the hot paths of SGA against synthetic courses.
+
+A synthetic course has one SGA block, a staff member and as many enrolled
+learners as asked for, some of which submitted a file and some of which
+were graded.  Files are written to a temporary directory that replaces the
+default storage for as long as the course exists, and everything written to
+the database is rolled back afterwards, see `synthetic_course`.  Enrolling
+learners has side effects a rollback doesn't undo, such as tasks, tracking
+events and writes to other databases, so synthetic courses are only built in
+test databases, see `is_test_database`.
+"""
+import contextlib
+import datetime
+import hashlib
+import os
+import pytz
+import random
+import shutil
+import tempfile
+import time
+import uuid
+
+from courseware.models import StudentModule
+from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection, connections, transaction
+from django.db.backends.base.creation import TEST_DATABASE_PREFIX
+from django.test.utils import CaptureQueriesContext
+from opaque_keys.edx.locator import CourseLocator
+from student.models import CourseEnrollment, UserProfile, anonymous_id_for_user
+from submissions import api as submissions_api
+from xblock.field_data import DictFieldData
+from xblock.fields import ScopeIds
+
+from edx_sga.sga import StaffGradedAssignmentXBlock
+from edx_sga.uploads import TEMP_DIR_SUFFIX
+
+# Sizes in bytes of the submitted files, with the share of files that have
+# each size.
+DEFAULT_FILE_SIZES = ((2**12, 0.5), (2**16, 0.4), (2**20, 0.1))
+
+
+class BenchmarkRuntime(object):
+    """
+    The parts of the LMS runtime SGA uses, for a course staff member.
+    """
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.user_is_staff = True
+        self.anonymous_student_id = None
+
+    def get_user_role(self):
+        return 'instructor'
+
+    def handler_url(self, block, handler_name, suffix='', query=''):
+        return '/handler/{}'.format(handler_name)
+
+    def local_resource_url(self, block, uri):
+        return '/resource/{}'.format(uri)
+
+
+class BenchmarkRequest(object):
+    def __init__(self, params=None, headers=None):
+        self.params = params or {}
+        self.headers = headers or {}
+
+
+class BenchmarkUpload(object):
+    def __init__(self, name, data):
+        self.file = SimpleUploadedFile(name, data)
+
+
+class SyntheticCourse(object):
+    """
+    A course with an SGA block and `learners` enrolled learners, a share
+    `submitted` of which uploaded a file with a size drawn from
+    `file_sizes`, and a share `graded` of those were graded.
+    """
+    def __init__(self, learners, submitted=0.8, graded=0.5,
+                 file_sizes=DEFAULT_FILE_SIZES, seed=0):
+        self.random = random.Random(seed)
+        self.course_key = CourseLocator('SGA', 'Benchmark', uuid.uuid4().hex)
+        self.staff = User.objects.create(
+            username='sga-staff-' + self.course_key.run[:8], is_staff=True)
+        self.runtime = BenchmarkRuntime(self.staff.id)
+        self.block = self.make_block()
+        self.learners = []
+        self.file_sizes = file_sizes
+        self._contents = os.urandom(max(size for size, _ in file_sizes))
+        max_score = self.block.max_score()
+        for index in range(learners):
+            learner = self.add_learner(index)
+            if self.random.random() < submitted:
+                learner['submission'] = self.submit(learner)
+                if self.random.random() < graded:
+                    learner['graded'] = True
+                    submissions_api.set_score(
+                        learner['submission']['uuid'],
+                        self.random.randint(0, max_score),
+                        max_score)
+            self.learners.append(learner)
+
+    def make_block(self):
+        """
+        Returns the course's block as it is at the start of a request, with
+        nothing memoized.
+        """
+        location = self.course_key.make_usage_key('edx_sga', 'benchmark')
+        block = StaffGradedAssignmentXBlock(
+            self.runtime,
+            DictFieldData({'weight': 100.0}),
+            ScopeIds(self.staff.id, 'edx_sga', location, location),
+        )
+        block.location = location
+        block.xmodule_runtime = self.runtime
+        block.course_id = self.course_key
+        block.category = 'edx_sga'
+        block.start = datetime.datetime(2000, 1, 1, tzinfo=pytz.utc)
+        return block
+
+    def add_learner(self, index):
+        user = User.objects.create(
+            username='sga-{}-{}'.format(self.course_key.run[:8], index))
+        UserProfile.objects.create(user=user, name='Learner {}'.format(index))
+        CourseEnrollment.enroll(user, self.course_key)
+        module = StudentModule.objects.create(
+            module_state_key=self.block.location,
+            student=user,
+            course_id=self.course_key,
+            state='{}')
+        return {
+            'user': user,
+            'module': module,
+            'student_id': anonymous_id_for_user(user, self.course_key),
+            'submission': None,
+            'graded': False,
+        }
+
+    def file_size(self):
+        value = self.random.random()
+        for size, share in self.file_sizes:
+            value -= share
+            if value < 0:
+                return size
+        return self.file_sizes[-1][0]
+
+    def file_contents(self, size):
+        # Files differ in their first bytes so every one gets a path of its
+        # own, without generating random data for each.
+        prefix = uuid.uuid4().bytes
+        return prefix + self._contents[:max(size - len(prefix), 0)]
+
+    def submit(self, learner):
+        data = self.file_contents(self.file_size())
+        sha1 = hashlib.sha1(data).hexdigest()
+        default_storage.save(
+            self.block._file_storage_path(sha1, 'submission.bin'),  # pylint: disable=protected-access
+            ContentFile(data))
+        return submissions_api.create_submission(
+            self.block.student_submission_id(learner['student_id']),
+            {'sha1': sha1, 'filename': 'submission.bin', 'mimetype': None})
+
+
+def is_test_database(alias='default'):
+    """
+    Whether the database `alias` is SQLite or a test database, which a
+    synthetic course can be built in.
+    """
+    database = connections[alias]
+    name = database.settings_dict['NAME'] or ''
+    return (
+        database.vendor == 'sqlite' or
+        name.startswith(TEST_DATABASE_PREFIX) or
+        name == database.settings_dict.get('TEST', {}).get('NAME')
+    )
+
+
+@contextlib.contextmanager
+def synthetic_course(**kwargs):
+    """
+    Builds a `SyntheticCourse` on a temporary local storage and rolls back
+    everything it wrote to the database once done.
+    """
+    storage = default_storage._wrapped  # pylint: disable=protected-access
+    directory = tempfile.mkdtemp()
+    default_storage._wrapped = FileSystemStorage(directory)  # pylint: disable=protected-access
+    try:
+        with transaction.atomic():
+            yield SyntheticCourse(**kwargs)
+            transaction.set_rollback(True)
+    finally:
+        default_storage._wrapped = storage  # pylint: disable=protected-access
+        shutil.rmtree(directory, ignore_errors=True)
+        shutil.rmtree(directory + TEMP_DIR_SUFFIX, ignore_errors=True)
+
+
+def bench_staff_grading_data(course):
+    course.make_block().staff_grading_data()
+
+
+def bench_download_all(course):
+    block = course.make_block()
+    response = block.download_zip(
+        block.get_files(block.get_submissions()), stream=True)
+    for _ in response.app_iter:
+        pass
+
+
+def bench_upload_assignment(course):
+    block = course.make_block()
+    learner = course.random.choice([
+        learner for learner in course.learners if not learner['graded']])
+    course.runtime.anonymous_student_id = learner['student_id']
+    try:
+        block.upload_assignment(BenchmarkRequest({'assignment': BenchmarkUpload(
+            'upload.bin', course.file_contents(course.file_sizes[-1][0]))}))
+    finally:
+        course.runtime.anonymous_student_id = None
+
+
+def bench_student_view(course):
+    learner = course.random.choice(course.learners)
+    course.runtime.anonymous_student_id = learner['student_id']
+    try:
+        course.make_block().student_view()
+    finally:
+        course.runtime.anonymous_student_id = None
+
+
+def bench_enter_grade(course):
+    learner = course.random.choice([
+        learner for learner in course.learners if learner['submission']])
+    learner['graded'] = True
+    block = course.make_block()
+    block.enter_grade(BenchmarkRequest({
+        'module_id': learner['module'].id,
+        'submission_id': learner['submission']['uuid'],
+        'grade': str(course.random.randint(0, int(block.max_score()))),
+        'comment': 'Benchmark',
+    }))
+
+
+BENCHMARKS = (
+    ('staff_grading_data', bench_staff_grading_data),
+    ('download_all', bench_download_all),
+    ('upload_assignment', bench_upload_assignment),
+    ('student_view', bench_student_view),
+    ('enter_grade', bench_enter_grade),
+)
+
+
+def run_benchmarks(course, repeat=5, names=None):
+    """
+    Runs each benchmark `repeat` times against `course` and returns the
+    wall times in seconds and the number of queries of the runs.
+    """
+    results = {}
+    for name, benchmark in BENCHMARKS:
+        if names and name not in names:
+            continue
+        if name == 'enter_grade' and not any(
+                learner['submission'] for learner in course.learners):
+            continue
+        if name == 'upload_assignment' and all(
+                learner['graded'] for learner in course.learners):
+            continue
+        times = []
+        queries = []
+        for _ in range(repeat):
+            with CaptureQueriesContext(connection) as captured:
+                started = time.time()
+                benchmark(course)
+                times.append(time.time() - started)
+            queries.append(len(captured))
+        times.sort()
+        results[name] = {
+            'runs': repeat,
+            'min': times[0],
+            'median': times[len(times) // 2],
+            'mean': sum(times) / len(times),
+            'max': times[-1],
+            'queries': max(queries),
+        }
+    return results
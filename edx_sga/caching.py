@@ -0,0 +1,78 @@
+"""
+Cached snapshots of staff grading tables.
+
+A snapshot is cached under a key that includes the version of its block and
+the version of its course.  Anything that changes what a table shows bumps
+one of them, which leaves the stale snapshots to expire from the cache
+unused.  Versions start from the time they were first needed, so a version
+evicted from the cache never comes back with a value it already had.
+
+The SGA_CACHE setting names the Django cache to use, 'default' by default.
+"""
+import hashlib
+import json
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+
+SNAPSHOT_TIMEOUT = 60 * 60  # seconds
+
+
+def get_cache():
+    return caches[getattr(settings, 'SGA_CACHE', 'default')]
+
+
+def block_version_key(item_id):
+    return 'edx_sga.grading.block.' + _digest(item_id)
+
+
+def course_version_key(course_id):
+    return 'edx_sga.grading.course.' + _digest(course_id)
+
+
+def get_version(key):
+    """
+    Returns the current value of a version, starting it if needed.
+    """
+    cache = get_cache()
+    version = cache.get(key)
+    if version is None:
+        version = _new_version()
+        if not cache.add(key, version, None):
+            version = cache.get(key, version)
+    return version
+
+
+def bump_version(key):
+    """
+    Moves a version on, so everything cached under the previous one is
+    ignored.
+    """
+    cache = get_cache()
+    try:
+        cache.incr(key)
+    except ValueError:
+        # Not started yet, or evicted
+        cache.add(key, _new_version(), None)
+
+
+def snapshot_key(item_id, course_id, params):
+    """
+    Returns the cache key of the snapshot of a block's grading table built
+    with `params`, at the current versions of the block and its course.
+    """
+    return 'edx_sga.grading.snapshot.' + _digest(json.dumps([
+        unicode(item_id),
+        get_version(block_version_key(item_id)),
+        get_version(course_version_key(course_id)),
+        params,
+    ], sort_keys=True))
+
+
+def _digest(value):
+    return hashlib.sha1(unicode(value).encode('utf-8')).hexdigest()
+
+
+def _new_version():
+    return int(time.time() * 1000)
@@ -0,0 +1,109 @@
+"""
+The work still to grade in a whole course, across its SGA blocks.
+
+Everything is read from the submissions tables with one aggregate query for
+the course, plus one to find the usernames of the learners on the page, so
+the cost doesn't depend on how many SGA blocks the course has.  Like the
+staff grading tables of the blocks, only learners who are enrolled and
+aren't staff are counted.
+"""
+from django.db.models import Max, Q
+from django.utils.timezone import now
+from student.models import AnonymousUserId, CourseEnrollment
+from submissions.models import StudentItem
+
+ITEM_TYPE = 'sga'
+
+
+def ungraded_student_items(course_id):
+    """
+    Returns the student items of a course's SGA blocks whose learner
+    submitted something that has no score, with the time of their latest
+    submission as `submitted_at`.
+    """
+    learners = CourseEnrollment.objects.users_enrolled_in(course_id).exclude(
+        Q(is_staff=True) | Q(is_superuser=True))
+    return StudentItem.objects.filter(
+        course_id=unicode(course_id),
+        item_type=ITEM_TYPE,
+        submission__isnull=False,
+        student_id__in=AnonymousUserId.objects.filter(
+            course_id=course_id,
+            user__in=learners,
+        ).values('anonymous_user_id'),
+    ).exclude(
+        # Reset scores are hidden and have nothing possible
+        scoresummary__latest__points_possible__gt=0,
+    ).values('item_id', 'student_id').annotate(
+        submitted_at=Max('submission__submitted_at'),
+    )
+
+
+def course_ungraded_work(course_id, blocks, cursor=0, page_size=50):
+    """
+    Returns how many learners are waiting for a grade in each of `blocks`,
+    the SGA blocks of the course, and since when, along with one page of the
+    learners waiting for a grade, those who waited longest first.
+    """
+    current_time = now()
+    by_block = {}
+    by_learner = {}
+    for item in ungraded_student_items(course_id):
+        block = by_block.setdefault(item['item_id'], [])
+        block.append(item['submitted_at'])
+        learner = by_learner.setdefault(item['student_id'], [])
+        learner.append((item['submitted_at'], item['item_id']))
+
+    def age(submitted_at):
+        return int((current_time - submitted_at).total_seconds())
+
+    block_rows = []
+    for block in blocks:
+        item_id = unicode(block.scope_ids.usage_id)
+        waiting = by_block.pop(item_id, [])
+        block_rows.append({
+            'item_id': item_id,
+            'display_name': block.display_name,
+            'url': '/courses/{}/jump_to/{}'.format(course_id, block.location),
+            'ungraded': len(waiting),
+            'oldest_ungraded_age': age(min(waiting)) if waiting else None,
+        })
+    # Blocks that were removed from the course but still have submissions
+    for item_id, waiting in sorted(by_block.items()):
+        block_rows.append({
+            'item_id': item_id,
+            'display_name': None,
+            'url': None,
+            'ungraded': len(waiting),
+            'oldest_ungraded_age': age(min(waiting)),
+        })
+
+    learners = sorted(
+        by_learner.items(), key=lambda learner: (min(learner[1]), learner[0]))
+    window = learners[cursor:cursor + page_size]
+    usernames = dict(AnonymousUserId.objects.filter(
+        course_id=course_id,
+        anonymous_user_id__in=[student_id for student_id, _ in window],
+    ).values_list('anonymous_user_id', 'user__username'))
+    learner_rows = [
+        {
+            'student_id': student_id,
+            'username': usernames.get(student_id),
+            'ungraded': len(items),
+            'oldest_ungraded_age': age(min(items)[0]),
+            'item_ids': [item_id for _, item_id in sorted(items)],
+        }
+        for student_id, items in window
+    ]
+
+    total = len(learners)
+    next_cursor = cursor + page_size
+    return {
+        'blocks': block_rows,
+        'learners': learner_rows,
+        'total': total,
+        'cursor': cursor,
+        'page_size': page_size,
+        'next_cursor': next_cursor if next_cursor < total else None,
+        'previous_cursor': max(cursor - page_size, 0) if cursor else None,
+    }
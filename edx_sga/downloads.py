@@ -0,0 +1,237 @@
+"""
+Responses that send a stored file, with the validators and byte ranges that
+let clients cache and resume downloads.
+
+Files are stored under the SHA-1 of their contents, so a file never changes
+once stored and its SHA-1 makes a strong ETag.  The URLs of the handlers
+don't include it though, and keep pointing at the latest file, so clients
+must revalidate every time and are answered with a 304 when their copy is
+current.
+
+The SGA_DOWNLOAD_OFFLOAD setting lets the bytes move outside of the LMS
+worker once the handler has checked permissions: 'x-accel-redirect' hands
+the file to nginx (SGA_DOWNLOAD_OFFLOAD_PREFIX names the internal location
+serving the storage root), 'x-sendfile' to Apache or lighttpd, and
+'redirect' sends the client to a short lived storage URL, which is signed on
+storages like S3 and asks the storage to send the file under its original
+name.  Storages that can't are streamed to.  By default the file is streamed
+by the worker.
+"""
+import uuid
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.storage import default_storage
+from webob.response import Response
+
+from edx_sga.instrumentation import counted_reads
+from edx_sga.zipstream import iter_file
+
+BLOCK_SIZE = 2**10 * 8  # 8kb
+CACHE_CONTROL = 'private, no-cache'
+MAX_RANGES = 20
+OFFLOAD_URL_EXPIRE = 60  # seconds
+
+
+def file_response(request, path, mimetype, filename, sha1=None):
+    """
+    Returns a response sending the file stored at `path`.  With the `sha1`
+    of the file the response can be cached and answers conditional and
+    range requests.
+    """
+    headers = request.headers if request is not None else {}
+    etag = '"{}"'.format(sha1) if sha1 else None
+    response = Response(
+        content_type=mimetype,
+        content_disposition="attachment; filename=" + filename)
+    response.headers['Accept-Ranges'] = 'bytes'
+    if etag:
+        response.headers['ETag'] = etag
+        response.headers['Cache-Control'] = CACHE_CONTROL
+        if etag_matches(headers.get('If-None-Match'), etag):
+            response.status = 304
+            del response.content_type
+            return response
+
+    offload = getattr(settings, 'SGA_DOWNLOAD_OFFLOAD', None)
+    if offload:
+        offloaded = offload_response(response, path, offload)
+        if offloaded is not None:
+            return offloaded
+
+    size = default_storage.size(path)
+    ranges = None
+    if_range = headers.get('If-Range')
+    if not if_range or (etag and if_range == etag):
+        ranges = parse_range(headers.get('Range'), size)
+    if ranges == []:
+        response.status = 416
+        response.headers['Content-Range'] = 'bytes */{}'.format(size)
+        del response.content_type
+        return response
+
+    student_file = default_storage.open(path)
+    if not ranges:
+        response.app_iter = counted_reads(iter_file(student_file, BLOCK_SIZE))
+        response.content_length = size
+    elif len(ranges) == 1:
+        start, end = ranges[0]
+        response.status = 206
+        response.app_iter = iter_file_range(student_file, start, end)
+        response.content_length = end - start
+        response.headers['Content-Range'] = 'bytes {}-{}/{}'.format(
+            start, end - 1, size)
+    else:
+        boundary = uuid.uuid4().hex
+        parts = [
+            (start, end, _part_header(boundary, mimetype, start, end, size))
+            for start, end in ranges
+        ]
+        trailer = '\r\n--{}--\r\n'.format(boundary)
+        response.status = 206
+        response.content_type = 'multipart/byteranges; boundary=' + boundary
+        response.app_iter = _iter_multipart(student_file, parts, trailer)
+        response.content_length = sum(
+            len(header) + end - start for start, end, header in parts
+        ) + len(trailer)
+    return response
+
+
+def offload_response(response, path, mode):
+    """
+    Turns `response` into one that has the web server or the storage send
+    the file stored at `path`.  Returns None when the storage can't send it
+    under the name of the response's Content-Disposition.
+    """
+    if mode == 'x-accel-redirect':
+        prefix = getattr(settings, 'SGA_DOWNLOAD_OFFLOAD_PREFIX', '/protected/')
+        response.headers['X-Accel-Redirect'] = (
+            prefix.rstrip('/') + '/' + path.lstrip('/'))
+    elif mode == 'x-sendfile':
+        response.headers['X-Sendfile'] = default_storage.path(path)
+    elif mode == 'redirect':
+        expire = getattr(
+            settings, 'SGA_DOWNLOAD_OFFLOAD_EXPIRE', OFFLOAD_URL_EXPIRE)
+        url = _signed_url(path, expire, response.content_disposition)
+        if url is None:
+            return None
+        response.status = 302
+        response.location = url
+        # a signed URL must not outlive its signature in a cache
+        response.headers['Cache-Control'] = 'private, no-cache'
+        del response.content_type
+        del response.content_disposition
+    else:
+        raise ImproperlyConfigured(
+            'Unknown SGA_DOWNLOAD_OFFLOAD: {}'.format(mode))
+    return response
+
+
+def _signed_url(path, expire, content_disposition):
+    """
+    Returns a URL of the file stored at `path` that expires and has the
+    storage answer with `content_disposition`, or None if the storage
+    doesn't make such URLs.
+    """
+    try:
+        # S3BotoStorage
+        return default_storage.url(path, expire=expire, response_headers={
+            'response-content-disposition': content_disposition})
+    except TypeError:
+        pass
+    try:
+        # S3Boto3Storage
+        return default_storage.url(path, expire=expire, parameters={
+            'ResponseContentDisposition': content_disposition})
+    except TypeError:
+        return None
+
+
+def etag_matches(if_none_match, etag):
+    """
+    Whether the value of an If-None-Match header matches `etag`.
+    """
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(',')]
+    return '*' in tags or etag in tags or 'W/' + etag in tags
+
+
+def parse_range(header, size):
+    """
+    Parses a Range header into a list of (start, end) offsets, with `end`
+    exclusive, for a file of `size` bytes.  Returns None if the header is
+    missing or can't be parsed, in which case the whole file is sent, and an
+    empty list if none of the ranges can be satisfied.
+    """
+    if not header or not header.startswith('bytes='):
+        return None
+    ranges = []
+    for spec in header[len('bytes='):].split(','):
+        start, sep, end = spec.strip().partition('-')
+        try:
+            if not sep:
+                return None
+            if not start:
+                # suffix range: the last `end` bytes
+                length = int(end)
+                if length > 0 and size > 0:
+                    ranges.append((max(size - length, 0), size))
+                continue
+            start = int(start)
+            end = int(end) + 1 if end else None
+        except ValueError:
+            return None
+        if end is None:
+            end = size
+        elif start >= end:
+            return None
+        if start < size:
+            ranges.append((start, min(end, size)))
+    if len(ranges) > MAX_RANGES:
+        return None
+    return ranges
+
+
+def iter_file_range(fileobj, start, end, chunk_size=BLOCK_SIZE):
+    """
+    Yields the bytes of `fileobj` from offset `start` up to `end` and closes
+    it.
+    """
+    try:
+        for chunk in counted_reads(_read_range(fileobj, start, end, chunk_size)):
+            yield chunk
+    finally:
+        fileobj.close()
+
+
+def _read_range(fileobj, start, end, chunk_size=BLOCK_SIZE):
+    fileobj.seek(start)
+    remaining = end - start
+    while remaining > 0:
+        chunk = fileobj.read(min(chunk_size, remaining))
+        if not chunk:
+            break
+        remaining -= len(chunk)
+        yield chunk
+
+
+def _part_header(boundary, mimetype, start, end, size):
+    return (
+        '\r\n--{}\r\n'
+        'Content-Type: {}\r\n'
+        'Content-Range: bytes {}-{}/{}\r\n'
+        '\r\n'
+    ).format(boundary, mimetype or 'application/octet-stream',
+             start, end - 1, size)
+
+
+def _iter_multipart(fileobj, parts, trailer):
+    try:
+        for start, end, header in parts:
+            yield header
+            for chunk in counted_reads(_read_range(fileobj, start, end)):
+                yield chunk
+        yield trailer
+    finally:
+        fileobj.close()
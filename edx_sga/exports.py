@@ -0,0 +1,114 @@
+"""
+Streaming exports of the grades of an SGA block.
+
+The roster is read in chunks of users ordered by primary key, each chunk
+joined with its submissions, scores and comments in a fixed number of
+queries, so memory stays flat whatever the size of the course and the first
+records are produced as soon as the first chunk has been read.
+"""
+import csv
+import json
+import StringIO
+
+from courseware.models import StudentModule
+
+EXPORT_FIELDS = (
+    'username', 'student_id', 'timestamp', 'sha1', 'score', 'comment')
+EXPORT_FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+CHUNK_SIZE = 500
+
+
+def iter_chunks(queryset, chunk_size=CHUNK_SIZE):
+    """
+    Yields lists of the objects of `queryset`, `chunk_size` at a time, using
+    keyset pagination on the primary key so no chunk is more expensive to
+    fetch than the first.
+    """
+    last_pk = None
+    queryset = queryset.order_by('pk')
+    while True:
+        chunk = queryset
+        if last_pk is not None:
+            chunk = chunk.filter(pk__gt=last_pk)
+        chunk = list(chunk[:chunk_size])
+        if not chunk:
+            return
+        yield chunk
+        last_pk = chunk[-1].pk
+
+
+def iter_grade_records(block, chunk_size=CHUNK_SIZE):
+    """
+    Yields a dict with the `EXPORT_FIELDS` of every enrolled learner of the
+    block.
+    """
+    users = block.get_enrolled_students().only('id', 'username')
+    for chunk in iter_chunks(users, chunk_size):
+        anonymous_ids = block.get_anonymous_ids(user.id for user in chunk)
+        student_ids = [anonymous_ids[user.id] for user in chunk]
+        submissions = block.get_latest_submissions(student_ids)
+        scores = block.get_scores(student_ids)
+        states = dict(StudentModule.objects.filter(
+            course_id=block.course_id,
+            module_state_key=block.location,
+            student__in=chunk,
+        ).values_list('student_id', 'state'))
+        for user in chunk:
+            student_id = anonymous_ids[user.id]
+            submission = submissions.get(student_id)
+            state = json.loads(states.get(user.id) or '{}')
+            yield {
+                'username': user.username,
+                'student_id': student_id,
+                'timestamp': str(submission['created_at']) if submission else None,
+                'sha1': submission['answer'].get('sha1') if submission else None,
+                'score': scores.get(student_id),
+                'comment': state.get('comment', ''),
+            }
+
+
+def iter_csv(records):
+    """
+    Yields `records` as lines of CSV, starting with a header row.
+    """
+    buf = StringIO.StringIO()
+    writer = csv.writer(buf)
+
+    def line(values):
+        writer.writerow([_csv_value(value) for value in values])
+        data = buf.getvalue()
+        buf.seek(0)
+        buf.truncate()
+        return data
+
+    yield line(EXPORT_FIELDS)
+    for record in records:
+        yield line(record[field] for field in EXPORT_FIELDS)
+
+
+def iter_ndjson(records):
+    """
+    Yields `records` as newline delimited JSON.
+    """
+    for record in records:
+        yield json.dumps(record, sort_keys=True) + '\n'
+
+
+def iter_export(records, export_format):
+    """
+    Yields `records` in `export_format`, one of `EXPORT_FORMATS`.
+    """
+    if export_format == 'ndjson':
+        return iter_ndjson(records)
+    return iter_csv(records)
+
+
+def _csv_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return value
@@ -0,0 +1,296 @@
+"""
+Measuring what the handlers of a block cost.
+
+`instrument_block` wraps the handlers and views of an XBlock class.  While
+the SGA_INSTRUMENTATION setting is empty the wrappers call straight through.
+Otherwise every call is measured: wall time, number and time of database
+queries, bytes read from and written to the storage, and the size of what
+it returned.  A response whose body is streamed is measured until the last
+of it was sent.  Measurements go to a sink named by the setting:
+
+    'logging'   logs a line per call to the edx_sga.instrumentation logger
+    'statsd'    sends timers and counters to SGA_STATSD_HOST, SGA_STATSD_PORT
+                (localhost:8125 by default), prefixed with SGA_STATSD_PREFIX
+    'memory'    keeps them in a list, for tests
+
+or the dotted path of a class whose instances have a `record` method taking
+a `Measurement`.
+
+Queries are counted as the connection logs them, by a log that keeps
+running totals, since the log itself only holds the latest ones.
+"""
+import collections
+import importlib
+import logging
+import socket
+import threading
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.db import connection
+from xblock.fragment import Fragment
+
+log = logging.getLogger(__name__)
+
+_SINKS = {}
+_local = threading.local()
+
+
+class Measurement(object):
+    """
+    What a call to a handler or view cost.
+    """
+    def __init__(self, name, block):
+        self.name = name
+        self.block = block
+        self.status = None
+        self.wall_time = 0.0
+        self.queries = 0
+        self.query_time = 0.0
+        self.storage_read = 0
+        self.storage_written = 0
+        self.payload = 0
+
+    def start(self):
+        self.started = time.time()
+        self.force_debug_cursor = connection.force_debug_cursor
+        connection.force_debug_cursor = True
+        self.queries_log = _counting_queries_log()
+        self.first_query = self.queries_log.count
+        self.first_query_time = self.queries_log.time
+        _active().append(self)
+
+    def stop(self):
+        _active().remove(self)
+        connection.force_debug_cursor = self.force_debug_cursor
+        self.queries = self.queries_log.count - self.first_query
+        self.query_time = self.queries_log.time - self.first_query_time
+        self.wall_time = time.time() - self.started
+
+    def as_dict(self):
+        return {
+            'name': self.name,
+            'block': self.block,
+            'status': self.status,
+            'wall_time': self.wall_time,
+            'queries': self.queries,
+            'query_time': self.query_time,
+            'storage_read': self.storage_read,
+            'storage_written': self.storage_written,
+            'payload': self.payload,
+        }
+
+
+class CountingQueriesLog(collections.deque):
+    """
+    A connection's query log that counts the queries appended to it and
+    adds up their time, even once the oldest ones were dropped.
+    """
+    def __init__(self, iterable=(), maxlen=None):
+        super(CountingQueriesLog, self).__init__(iterable, maxlen)
+        self.count = 0
+        self.time = 0.0
+
+    def append(self, query):
+        self.count += 1
+        self.time += float(query['time'])
+        super(CountingQueriesLog, self).append(query)
+
+
+class MeasuredBody(object):
+    """
+    A streamed response body that finishes its measurement once it was sent
+    or closed, which WSGI servers always do.
+    """
+    def __init__(self, app_iter, measurement, sink):
+        self.app_iter = app_iter
+        self.measurement = measurement
+        self.sink = sink
+        self.finished = False
+
+    def __iter__(self):
+        for chunk in self.app_iter:
+            self.measurement.payload += len(chunk)
+            yield chunk
+        self.close()
+
+    def close(self):
+        if self.finished:
+            return
+        self.finished = True
+        close = getattr(self.app_iter, 'close', None)
+        if close:
+            close()
+        self.measurement.stop()
+        self.sink.record(self.measurement)
+
+
+class LoggingSink(object):
+    def record(self, measurement):
+        log.info(
+            '%(name)s %(block)s status=%(status)s wall_time=%(wall_time).4f '
+            'queries=%(queries)d query_time=%(query_time).4f '
+            'storage_read=%(storage_read)d '
+            'storage_written=%(storage_written)d payload=%(payload)d',
+            measurement.as_dict())
+
+
+class StatsdSink(object):
+    """
+    Sends measurements as statsd metrics over UDP, which never waits for
+    the statsd server.
+    """
+    def __init__(self):
+        self.address = (
+            getattr(settings, 'SGA_STATSD_HOST', 'localhost'),
+            getattr(settings, 'SGA_STATSD_PORT', 8125),
+        )
+        self.prefix = getattr(settings, 'SGA_STATSD_PREFIX', 'edx_sga')
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def record(self, measurement):
+        name = '{}.{}'.format(self.prefix, measurement.name)
+        metrics = [
+            '{}.wall_time:{:.3f}|ms'.format(name, measurement.wall_time * 1000),
+            '{}.query_time:{:.3f}|ms'.format(name, measurement.query_time * 1000),
+            '{}.queries:{}|c'.format(name, measurement.queries),
+            '{}.storage_read:{}|c'.format(name, measurement.storage_read),
+            '{}.storage_written:{}|c'.format(name, measurement.storage_written),
+            '{}.payload:{}|c'.format(name, measurement.payload),
+        ]
+        try:
+            self.socket.sendto('\n'.join(metrics), self.address)
+        except socket.error:
+            log.warning('Could not send metrics to statsd', exc_info=True)
+
+
+class MemorySink(object):
+    def __init__(self):
+        self.records = []
+
+    def record(self, measurement):
+        self.records.append(measurement)
+
+
+SINKS = {
+    'logging': LoggingSink,
+    'statsd': StatsdSink,
+    'memory': MemorySink,
+}
+
+
+def get_sink():
+    """
+    Returns the sink named by the SGA_INSTRUMENTATION setting, or None when
+    instrumentation is disabled.
+    """
+    name = getattr(settings, 'SGA_INSTRUMENTATION', None)
+    if not name:
+        return None
+    sink = _SINKS.get(name)
+    if sink is None:
+        if name in SINKS:
+            sink_class = SINKS[name]
+        else:
+            module, _, attr = name.rpartition('.')
+            sink_class = getattr(importlib.import_module(module), attr)
+        sink = _SINKS[name] = sink_class()
+    return sink
+
+
+def instrument_block(cls, views=('student_view',)):
+    """
+    Class decorator measuring the handlers of an XBlock and its `views`.
+    """
+    for name, attr in vars(cls).items():
+        if callable(attr) and (
+                getattr(attr, '_is_xblock_handler', False) or name in views):
+            setattr(cls, name, instrumented(attr))
+    return cls
+
+
+def instrumented(func):
+    """
+    Measures the calls to a handler or view while instrumentation is
+    enabled.
+    """
+    @wraps(func)
+    def wrapper(block, *args, **kwargs):
+        sink = get_sink()
+        if sink is None:
+            return func(block, *args, **kwargs)
+        measurement = Measurement(func.__name__, unicode(block.location))
+        measurement.start()
+        try:
+            result = func(block, *args, **kwargs)
+        except:
+            measurement.status = 'error'
+            measurement.stop()
+            sink.record(measurement)
+            raise
+        app_iter = getattr(result, 'app_iter', None)
+        if app_iter is not None and not isinstance(app_iter, (list, tuple)):
+            # Replacing the body of a webob response drops its length
+            content_length = result.content_length
+            result.app_iter = MeasuredBody(app_iter, measurement, sink)
+            result.content_length = content_length
+            measurement.status = result.status_code
+            return result
+        measurement.stop()
+        measurement.status = getattr(result, 'status_code', None)
+        measurement.payload = _payload_size(result)
+        sink.record(measurement)
+        return result
+    return wrapper
+
+
+def record_storage(read=0, written=0):
+    """
+    Adds bytes read from or written to the storage to the calls being
+    measured.
+    """
+    for measurement in getattr(_local, 'active', ()):
+        measurement.storage_read += read
+        measurement.storage_written += written
+
+
+def counted_reads(chunks):
+    """
+    Counts the chunks read from the storage by the calls being measured as
+    they are yielded.
+    """
+    if not getattr(_local, 'active', None):
+        return chunks
+    return _count_reads(chunks)
+
+
+def _count_reads(chunks):
+    for chunk in chunks:
+        record_storage(read=len(chunk))
+        yield chunk
+
+
+def _counting_queries_log():
+    """
+    Returns the query log of the current connection, made a
+    `CountingQueriesLog` if it isn't one yet.
+    """
+    queries_log = connection.queries_log
+    if not isinstance(queries_log, CountingQueriesLog):
+        queries_log = CountingQueriesLog(queries_log, queries_log.maxlen)
+        connection.queries_log = queries_log
+    return queries_log
+
+
+def _payload_size(result):
+    if isinstance(result, Fragment):
+        return len((result.content or u'').encode('utf-8'))
+    body = getattr(result, 'body', None)
+    return len(body) if body else 0
+
+
+def _active():
+    if not hasattr(_local, 'active'):
+        _local.active = []
+    return _local.active
@@ -0,0 +1,117 @@
+"""
+Runs long tasks, like building archives of submissions, outside of the
+request that asked for them.
+
+The SGA_JOB_BACKEND setting picks how jobs run: 'celery' (the default) hands
+them to a celery worker and 'sync' runs them in process before the request
+returns, which is what tests and local installs want.
+
+Running jobs report their progress as they go.  A job that didn't for
+SGA_JOB_TIMEOUT seconds was lost, to a worker that crashed or a task that
+was dropped, and is failed when the same work is asked for again.
+"""
+import datetime
+import json
+import logging
+from importlib import import_module
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+from django.utils.timezone import now
+
+from edx_sga.models import Job
+
+log = logging.getLogger(__name__)
+
+JOB_TIMEOUT = 10 * 60  # seconds
+
+# Job kinds and the functions that do the work.  They are called with the
+# Job and its params as keyword arguments and return a JSON serializable
+# result.
+JOB_FUNCTIONS = {
+    'assemble_upload': 'edx_sga.uploads.assemble_upload',
+    'rescore': 'edx_sga.rescoring.rescore_block',
+    'submission_archive': 'edx_sga.archives.build_submission_archive',
+}
+
+
+def start_job(kind, course_id, item_id, params, key=''):
+    """
+    Creates a job and hands it to the configured backend.  If `key` is given
+    and a job of the same kind and key is already pending or running for the
+    block, that job is returned instead, unless it timed out.
+    """
+    if key:
+        jobs = Job.objects.filter(
+            kind=kind,
+            item_id=unicode(item_id),
+            key=key,
+            status__in=(Job.PENDING, Job.RUNNING),
+        )
+        timeout = getattr(settings, 'SGA_JOB_TIMEOUT', JOB_TIMEOUT)
+        jobs.filter(
+            modified__lte=now() - datetime.timedelta(seconds=timeout),
+        ).update(status=Job.FAILED, modified=now())
+        job = jobs.first()
+        if job:
+            return job
+
+    job = Job.objects.create(
+        kind=kind,
+        key=key,
+        course_id=unicode(course_id),
+        item_id=unicode(item_id),
+        params=json.dumps(params),
+    )
+    backend = getattr(settings, 'SGA_JOB_BACKEND', 'celery')
+    if backend == 'sync':
+        run_job(job.job_id)
+        job.refresh_from_db()
+    elif backend == 'celery':
+        from edx_sga.tasks import run_job_task
+        job_id = unicode(job.job_id)
+        # The worker must not look for the job before it is committed, which
+        # Django < 1.9 can't wait for
+        on_commit = getattr(transaction, 'on_commit', lambda func: func())
+        on_commit(lambda: run_job_task.delay(job_id))
+    else:
+        raise ImproperlyConfigured(
+            'Unknown SGA_JOB_BACKEND: {}'.format(backend))
+    return job
+
+
+def run_job(job_id):
+    """
+    Runs a pending job and records its outcome.
+    """
+    claimed = Job.objects.filter(
+        job_id=job_id, status=Job.PENDING,
+    ).update(status=Job.RUNNING, modified=now())
+    if not claimed:
+        # Already run, or being run by someone else
+        return
+    job = Job.objects.get(job_id=job_id)
+    module_name, function_name = JOB_FUNCTIONS[job.kind].rsplit('.', 1)
+    function = getattr(import_module(module_name), function_name)
+    try:
+        result = function(job, **json.loads(job.params))
+    except Exception:  # pylint: disable=broad-except
+        log.exception('SGA job %s (%s) failed', job.job_id, job.kind)
+        Job.objects.filter(pk=job.pk).update(status=Job.FAILED, modified=now())
+    else:
+        Job.objects.filter(pk=job.pk).update(
+            status=Job.DONE, result=json.dumps(result), modified=now())
+
+
+def job_status(job):
+    """
+    Returns a JSON serializable summary of a job for clients polling it.
+    """
+    return {
+        'job_id': unicode(job.job_id),
+        'status': job.status,
+        'progress': job.progress,
+        'total': job.total,
+        'result': json.loads(job.result),
+    }
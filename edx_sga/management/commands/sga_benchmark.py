@@ -0,0 +1,101 @@
+import datetime
+import json
+
+import pkg_resources
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import setup_databases, teardown_databases
+
+from edx_sga.benchmarks import (
+    BENCHMARKS, is_test_database, run_benchmarks, synthetic_course)
+
+
+class Command(BaseCommand):
+    """
+    Times the hot paths of SGA against a synthetic course and writes the
+    results as JSON, to compare releases.  Nothing the benchmarks write to
+    the database or the storage is kept.  Unless the configured database is
+    SQLite or a test database, the benchmarks run in test databases created
+    for the purpose, like the test runner does.
+    """
+    help = __doc__
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--learners', type=int, default=200,
+            help='Number of enrolled learners')
+        parser.add_argument(
+            '--submitted', type=float, default=0.8,
+            help='Share of the learners who submitted a file')
+        parser.add_argument(
+            '--graded', type=float, default=0.5,
+            help='Share of the submissions that were graded')
+        parser.add_argument(
+            '--file-sizes', default='4096:0.5,65536:0.4,1048576:0.1',
+            help='Sizes of the submitted files in bytes, with their share, '
+                 'as size:share,size:share,...')
+        parser.add_argument(
+            '--repeat', type=int, default=5,
+            help='Number of runs of each benchmark')
+        parser.add_argument(
+            '--benchmark', action='append', dest='benchmarks',
+            choices=[name for name, _ in BENCHMARKS],
+            help='Benchmark to run, all of them by default')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument(
+            '--keepdb', action='store_true',
+            help='Keep the test databases between runs')
+        parser.add_argument(
+            '--force', action='store_true',
+            help='Run in the configured database even though it is not a '
+                 'test database')
+        parser.add_argument(
+            '--output', help='File to write to, standard output by default')
+
+    def handle(self, *args, **options):
+        if options['learners'] < 1 or options['repeat'] < 1:
+            raise CommandError('Learners and repeat must be positive.')
+        try:
+            file_sizes = tuple(
+                (int(size), float(share))
+                for size, share in (
+                    item.split(':') for item in options['file_sizes'].split(','))
+            )
+        except ValueError:
+            raise CommandError('Invalid file sizes.')
+
+        old_config = None
+        if not (options['force'] or is_test_database()):
+            old_config = setup_databases(
+                options['verbosity'], False, keepdb=options['keepdb'])
+        try:
+            with synthetic_course(
+                    learners=options['learners'],
+                    submitted=options['submitted'],
+                    graded=options['graded'],
+                    file_sizes=file_sizes,
+                    seed=options['seed']) as course:
+                results = run_benchmarks(
+                    course, options['repeat'], options['benchmarks'])
+        finally:
+            if old_config is not None:
+                teardown_databases(
+                    old_config, options['verbosity'], keepdb=options['keepdb'])
+
+        report = json.dumps({
+            'version': pkg_resources.get_distribution('edx-sga').version,
+            'date': datetime.datetime.utcnow().isoformat(),
+            'parameters': {
+                'learners': options['learners'],
+                'submitted': options['submitted'],
+                'graded': options['graded'],
+                'file_sizes': file_sizes,
+                'repeat': options['repeat'],
+                'seed': options['seed'],
+            },
+            'results': results,
+        }, indent=2, sort_keys=True)
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                output.write(report)
+        else:
+            self.stdout.write(report)
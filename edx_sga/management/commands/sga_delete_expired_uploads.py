@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from edx_sga.uploads import delete_expired_uploads
+
+
+class Command(BaseCommand):
+    """
+    Deletes the chunked uploads that weren't touched for
+    SGA_UPLOAD_SESSION_EXPIRE seconds, along with the chunks they stored.
+    Meant to be run periodically, from cron for instance.
+    """
+    help = __doc__
+
+    def handle(self, *args, **options):
+        deleted = delete_expired_uploads()
+        self.stdout.write('Deleted {} expired uploads'.format(deleted))
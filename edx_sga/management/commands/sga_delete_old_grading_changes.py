@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from edx_sga.sga import delete_old_grading_changes
+
+
+class Command(BaseCommand):
+    """
+    Deletes the changes to staff grading tables older than
+    SGA_GRADING_CHANGE_RETENTION seconds, which clients that fell that far
+    behind reload the table instead of catching up with.  Meant to be run
+    periodically, from cron for instance.
+    """
+    help = __doc__
+
+    def handle(self, *args, **options):
+        deleted = delete_old_grading_changes()
+        self.stdout.write('Deleted {} old grading changes'.format(deleted))
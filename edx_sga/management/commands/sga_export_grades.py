@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand, CommandError
+from opaque_keys import InvalidKeyError
+from opaque_keys.edx.keys import UsageKey
+from xmodule.modulestore.django import modulestore
+from xmodule.modulestore.exceptions import ItemNotFoundError
+
+from edx_sga.exports import EXPORT_FORMATS, iter_export, iter_grade_records
+
+
+class Command(BaseCommand):
+    """
+    Exports the grades of an SGA block as CSV or newline delimited JSON.
+    """
+    help = __doc__
+
+    def add_arguments(self, parser):
+        parser.add_argument('usage_key', help='Usage key of the SGA block')
+        parser.add_argument(
+            '--format', choices=sorted(EXPORT_FORMATS), default='csv',
+            help='Output format')
+        parser.add_argument(
+            '--output', help='File to write to, standard output by default')
+
+    def handle(self, *args, **options):
+        try:
+            usage_key = UsageKey.from_string(options['usage_key'])
+            block = modulestore().get_item(usage_key)
+        except InvalidKeyError:
+            raise CommandError('Invalid usage key.')
+        except ItemNotFoundError:
+            raise CommandError('No block found for this usage key.')
+        if block.location.block_type != 'edx_sga':
+            raise CommandError('This block is not an SGA block.')
+
+        records = iter_export(iter_grade_records(block), options['format'])
+        if options['output']:
+            with open(options['output'], 'wb') as output:
+                for data in records:
+                    output.write(data)
+        else:
+            for data in records:
+                self.stdout.write(data, ending='')
@@ -1,58 +1,229 @@
 import json
+import multiprocessing
+import time
 
 from django.core.management.base import BaseCommand, CommandError
-from courseware.courses import get_course_by_id
+from django.db import connections, transaction
 from courseware.models import StudentModule
-from opaque_keys.edx.keys import CourseKey
-from student.models import anonymous_id_for_user
+from opaque_keys import InvalidKeyError
+from opaque_keys.edx.keys import CourseKey, UsageKey
 from submissions import api as submissions_api
+from submissions.models import Submission
 from xmodule.modulestore.django import modulestore
+from xmodule.modulestore.exceptions import ItemNotFoundError
+
+from edx_sga.exports import iter_chunks
+from edx_sga.models import SubmissionMigration
+
+REPORT_INTERVAL = 10  # seconds
 
 
 class Command(BaseCommand):
     """
     Migrates existing SGA submissions for a course from old SGA implementation
     to newer version that uses the 'submissions' application.
+
+    StudentModules are read in batches of primary keys, block by block, and
+    each batch is migrated in a transaction that also records how far the
+    migration got, so running the command again resumes where it stopped.
+    Learners who already have a submission are skipped.
+
+    With several workers, each process opens its own connections to the
+    database and the modulestore, which can't be shared across a fork: the
+    blocks to migrate are found from the StudentModules, without opening the
+    modulestore before the workers are started.
     """
-    args = "<course_id>"
     help = __doc__
 
+    def add_arguments(self, parser):
+        parser.add_argument('course_id')
+        parser.add_argument(
+            '--batch-size', type=int, default=500,
+            help='Number of StudentModules migrated per transaction')
+        parser.add_argument(
+            '--workers', type=int, default=1,
+            help='Number of processes migrating blocks in parallel')
+        parser.add_argument(
+            '--restart', action='store_true',
+            help='Ignore the progress of previous runs')
+
     def handle(self, *args, **options):
-        if not args:
-            raise CommandError('Please specify the course id.')
-        if len(args) > 1:
-            raise CommandError('Too many arguments.')
-        course_id = args[0]
-        course_key = CourseKey.from_string(course_id)
-        course = get_course_by_id(course_key)
-
-        student_modules = StudentModule.objects.filter(
-            course_id=course.id).filter(
-            module_state_key__contains='edx_sga')
-
-        blocks = {}
-        for student_module in student_modules:
-            block_id = student_module.module_state_key
-            if block_id.block_type != 'edx_sga':
-                continue
-            block = blocks.get(block_id)
-            if not block:
-                blocks[block_id] = block = modulestore().get_item(block_id)
-            state = json.loads(student_module.state)
-            sha1 = state.get('uploaded_sha1')
-            if not sha1:
-                continue
-            student = student_module.student
-            submission_id = block.student_submission_id(
-                anonymous_id_for_user(student, course.id))
-            answer = {
-                "sha1": sha1,
-                "filename": state.get('uploaded_filename'),
-                "mimetype": state.get('uploaded_mimetype'),
-            }
-            submission = submissions_api.create_submission(
-                submission_id, answer)
-            score = state.get('score')  # float
-            if score:
-                submissions_api.set_score(
-                    submission['uuid'], int(score), block.max_score())
+        try:
+            course_key = CourseKey.from_string(options['course_id'])
+        except InvalidKeyError:
+            raise CommandError('Invalid course id.')
+        if options['batch_size'] < 1 or options['workers'] < 1:
+            raise CommandError('Batch size and workers must be positive.')
+
+        # Blocks without StudentModules have nothing to migrate
+        locations = set(
+            location.map_into_course(course_key)
+            for location in StudentModule.objects.filter(
+                course_id=course_key,
+                module_type='edx_sga',
+            ).values_list('module_state_key', flat=True).distinct()
+        )
+        usage_keys = sorted(unicode(location) for location in locations)
+        if options['restart']:
+            SubmissionMigration.objects.filter(
+                item_id__in=usage_keys,
+            ).delete()
+        checkpoints = dict(SubmissionMigration.objects.filter(
+            item_id__in=usage_keys,
+        ).values_list('item_id', 'last_module_id'))
+        total = sum(
+            StudentModule.objects.filter(
+                course_id=course_key,
+                module_state_key=location,
+                id__gt=checkpoints.get(unicode(location), 0),
+            ).count()
+            for location in locations
+        )
+        self.stdout.write('Migrating {} rows of {} blocks'.format(
+            total, len(usage_keys)))
+
+        progress = Progress(self.stdout, total)
+        if options['workers'] == 1:
+            for usage_key in usage_keys:
+                migrate_block(usage_key, options['batch_size'], progress.add)
+        else:
+            progress.start_processed = _processed(usage_keys)
+            # Workers must not share the parent's database connections
+            connections.close_all()
+            pool = multiprocessing.Pool(
+                options['workers'], initializer=_init_worker)
+            try:
+                results = pool.map_async(
+                    _migrate_block_in_worker,
+                    [(usage_key, options['batch_size']) for usage_key in usage_keys])
+                while not results.ready():
+                    results.wait(REPORT_INTERVAL)
+                    progress.update(_processed(usage_keys) - progress.start_processed)
+                results.get()
+            finally:
+                pool.close()
+                pool.join()
+        progress.report(final=True)
+
+
+class Progress(object):
+    """
+    Prints how many rows were migrated, how fast and when the rest will be.
+    """
+    def __init__(self, stdout, total):
+        self.stdout = stdout
+        self.total = total
+        self.done = 0
+        self.started = self.reported = time.time()
+        self.start_processed = 0
+
+    def add(self, rows):
+        self.update(self.done + rows)
+
+    def update(self, done):
+        self.done = done
+        if time.time() - self.reported >= REPORT_INTERVAL:
+            self.report()
+
+    def report(self, final=False):
+        self.reported = now = time.time()
+        rate = self.done / (now - self.started) if now > self.started else 0
+        if final:
+            eta = 'done'
+        elif rate:
+            eta = 'ETA {:.0f}s'.format(max(self.total - self.done, 0) / rate)
+        else:
+            eta = 'ETA unknown'
+        self.stdout.write('{}/{} rows, {:.1f} rows/s, {}'.format(
+            self.done, self.total, rate, eta))
+
+
+def migrate_block(usage_key, batch_size, on_batch=None):
+    """
+    Migrates the StudentModules of a block, one batch per transaction,
+    starting after the last batch a previous run finished.  Calls `on_batch`
+    with the number of rows of each batch.
+    """
+    try:
+        block = modulestore().get_item(UsageKey.from_string(usage_key))
+    except ItemNotFoundError:
+        # The block was removed from the course since
+        return
+    checkpoint, _ = SubmissionMigration.objects.get_or_create(
+        item_id=unicode(block.location),
+        defaults={'course_id': unicode(block.location.course_key)},
+    )
+    if checkpoint.finished:
+        return
+    student_modules = StudentModule.objects.filter(
+        course_id=block.location.course_key,
+        module_state_key=block.location,
+        id__gt=checkpoint.last_module_id,
+    ).only('id', 'student_id', 'state')
+    for batch in iter_chunks(student_modules, batch_size):
+        with transaction.atomic():
+            migrated = migrate_batch(block, batch)
+            SubmissionMigration.objects.filter(pk=checkpoint.pk).update(
+                last_module_id=batch[-1].id,
+                processed=checkpoint.processed + len(batch),
+                migrated=checkpoint.migrated + migrated,
+            )
+        checkpoint.processed += len(batch)
+        checkpoint.migrated += migrated
+        if on_batch:
+            on_batch(len(batch))
+    SubmissionMigration.objects.filter(pk=checkpoint.pk).update(finished=True)
+
+
+def migrate_batch(block, student_modules):
+    """
+    Creates submissions and scores from the old state of StudentModules,
+    skipping learners who already have a submission.  Returns how many were
+    created.
+    """
+    anonymous_ids = block.get_anonymous_ids(
+        module.student_id for module in student_modules)
+    submitted = set(Submission.objects.filter(
+        student_item__in=block.student_items(),
+        student_item__student_id__in=[
+            anonymous_ids[module.student_id] for module in student_modules],
+    ).values_list('student_item__student_id', flat=True))
+
+    migrated = 0
+    for student_module in student_modules:
+        state = json.loads(student_module.state)
+        sha1 = state.get('uploaded_sha1')
+        student_id = anonymous_ids[student_module.student_id]
+        if not sha1 or student_id in submitted:
+            continue
+        answer = {
+            "sha1": sha1,
+            "filename": state.get('uploaded_filename'),
+            "mimetype": state.get('uploaded_mimetype'),
+        }
+        submission = submissions_api.create_submission(
+            block.student_submission_id(student_id), answer)
+        score = state.get('score')  # float
+        if score:
+            submissions_api.set_score(
+                submission['uuid'], int(score), block.max_score())
+        submitted.add(student_id)
+        migrated += 1
+    return migrated
+
+
+def _init_worker():
+    """
+    Opens the worker process's own connection to the modulestore.
+    """
+    modulestore()
+
+
+def _migrate_block_in_worker(args):
+    migrate_block(*args)
+
+
+def _processed(usage_keys):
+    return sum(SubmissionMigration.objects.filter(
+        item_id__in=usage_keys,
+    ).values_list('processed', flat=True))
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand, CommandError
+from opaque_keys import InvalidKeyError
+from opaque_keys.edx.keys import CourseKey
+from xmodule.modulestore.django import modulestore
+
+
+class Command(BaseCommand):
+    """
+    Rebuilds the grading summaries and grading queues of the SGA blocks of
+    courses from their submissions, in case the counters drifted.
+    """
+    help = __doc__
+
+    def add_arguments(self, parser):
+        parser.add_argument('course_ids', nargs='+', metavar='course_id')
+
+    def handle(self, *args, **options):
+        for course_id in options['course_ids']:
+            try:
+                course_key = CourseKey.from_string(course_id)
+            except InvalidKeyError:
+                raise CommandError('Invalid course id: {}'.format(course_id))
+            blocks = modulestore().get_items(
+                course_key, qualifiers={'category': 'edx_sga'})
+            for block in blocks:
+                summary = block.rebuild_grading_summary()
+                self.stdout.write(
+                    '{}: {} submitted, {} graded, {} downloaded'.format(
+                        block.location, summary.submitted, summary.graded,
+                        summary.downloaded))
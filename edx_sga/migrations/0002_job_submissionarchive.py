@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('edx_sga', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Job',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('job_id', models.UUIDField(default=uuid.uuid4, unique=True, editable=False)),
+                ('kind', models.CharField(max_length=64)),
+                ('key', models.CharField(db_index=True, max_length=40, blank=True)),
+                ('course_id', models.CharField(max_length=255)),
+                ('item_id', models.CharField(max_length=255, db_index=True)),
+                ('status', models.CharField(default='pending', max_length=16, choices=[('pending', 'Pending'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')])),
+                ('progress', models.PositiveIntegerField(default=0)),
+                ('total', models.PositiveIntegerField(default=0)),
+                ('params', models.TextField(default='{}')),
+                ('result', models.TextField(default='{}')),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('modified', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='SubmissionArchive',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('course_id', models.CharField(max_length=255)),
+                ('item_id', models.CharField(max_length=255)),
+                ('key', models.CharField(max_length=40)),
+                ('path', models.CharField(max_length=512)),
+                ('members', models.TextField(default='[]')),
+                ('created', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='submissionarchive',
+            unique_together=set([('item_id', 'key')]),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('edx_sga', '0002_job_submissionarchive'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UploadSession',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('upload_id', models.UUIDField(default=uuid.uuid4, unique=True, editable=False)),
+                ('course_id', models.CharField(max_length=255)),
+                ('item_id', models.CharField(max_length=255)),
+                ('student_id', models.CharField(max_length=255)),
+                ('filename', models.CharField(max_length=255)),
+                ('size', models.BigIntegerField()),
+                ('offset', models.BigIntegerField(default=0)),
+                ('parts', models.TextField(default='[]')),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('modified', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AlterIndexTogether(
+            name='uploadsession',
+            index_together=set([('item_id', 'student_id')]),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('edx_sga', '0003_uploadsession'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DownloadedSubmission',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('item_id', models.CharField(max_length=255, db_index=True)),
+                ('submission_uuid', models.CharField(unique=True, max_length=36)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='GradingSummary',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('course_id', models.CharField(max_length=255)),
+                ('item_id', models.CharField(unique=True, max_length=255)),
+                ('submitted', models.IntegerField(default=0)),
+                ('graded', models.IntegerField(default=0)),
+                ('downloaded', models.IntegerField(default=0)),
+                ('modified', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
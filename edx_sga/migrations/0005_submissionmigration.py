@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('edx_sga', '0004_gradingsummary_downloadedsubmission'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SubmissionMigration',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('course_id', models.CharField(max_length=255)),
+                ('item_id', models.CharField(unique=True, max_length=255)),
+                ('last_module_id', models.IntegerField(default=0)),
+                ('processed', models.IntegerField(default=0)),
+                ('migrated', models.IntegerField(default=0)),
+                ('finished', models.BooleanField(default=False)),
+                ('modified', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
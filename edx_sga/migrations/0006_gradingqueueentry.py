@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('edx_sga', '0005_submissionmigration'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GradingQueueEntry',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('course_id', models.CharField(max_length=255)),
+                ('item_id', models.CharField(max_length=255)),
+                ('student_id', models.CharField(max_length=255)),
+                ('submission_uuid', models.CharField(max_length=36)),
+                ('submitted_at', models.DateTimeField()),
+                ('claimed_by', models.IntegerField(null=True)),
+                ('lease_expires', models.DateTimeField(null=True)),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='gradingqueueentry',
+            unique_together=set([('item_id', 'student_id')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='gradingqueueentry',
+            index_together=set([('item_id', 'submitted_at')]),
+        ),
+    ]
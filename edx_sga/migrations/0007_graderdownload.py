@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('edx_sga', '0006_gradingqueueentry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GraderDownload',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('item_id', models.CharField(max_length=255)),
+                ('submission_uuid', models.CharField(max_length=36)),
+                ('grader_id', models.IntegerField()),
+                ('created', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='graderdownload',
+            unique_together=set([('submission_uuid', 'grader_id')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='graderdownload',
+            index_together=set([('item_id', 'grader_id')]),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('edx_sga', '0007_graderdownload'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='uploadsession',
+            name='fingerprint',
+            field=models.CharField(max_length=128, blank=True, default=''),
+            preserve_default=False,
+        ),
+    ]
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('edx_sga', '0008_uploadsession_fingerprint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='submissionarchive',
+            name='selection',
+            field=models.CharField(max_length=40, blank=True, default=''),
+        ),
+    ]
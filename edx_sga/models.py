@@ -0,0 +1,208 @@
+"""
+Models for the Staff Graded Assignment XBlock.
+
+Keys are stored as plain strings, the same way the submissions app stores
+course and item ids.
+"""
+import uuid
+
+from django.db import models
+from django.utils.timezone import now
+
+
+class GradingChange(models.Model):
+    """
+    Records that a learner's row in a block's staff grading table changed.
+    The primary key doubles as the version of the table, so clients can ask
+    for everything that changed since the version they last saw.
+    """
+    course_id = models.CharField(max_length=255)
+    item_id = models.CharField(max_length=255, db_index=True)
+    student_id = models.CharField(max_length=255)
+    created = models.DateTimeField(auto_now_add=True)
+
+    def __unicode__(self):
+        return u'{} {} #{}'.format(self.item_id, self.student_id, self.id)
+
+
+class Job(models.Model):
+    """
+    A unit of background work started by a block, such as building an
+    archive of submissions.  See `edx_sga.jobs`.
+    """
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    )
+
+    job_id = models.UUIDField(default=uuid.uuid4, unique=True, editable=False)
+    kind = models.CharField(max_length=64)
+    # Identifies the work, so a request for work that is already underway
+    # can be handed the running job.
+    key = models.CharField(max_length=40, blank=True, db_index=True)
+    course_id = models.CharField(max_length=255)
+    item_id = models.CharField(max_length=255, db_index=True)
+    status = models.CharField(
+        max_length=16, choices=STATUS_CHOICES, default=PENDING)
+    progress = models.PositiveIntegerField(default=0)
+    total = models.PositiveIntegerField(default=0)
+    params = models.TextField(default='{}')
+    result = models.TextField(default='{}')
+    created = models.DateTimeField(auto_now_add=True)
+    modified = models.DateTimeField(auto_now=True)
+
+    def report_progress(self, progress, total=None):
+        """
+        Saves how far the job got, without touching the other fields.
+        """
+        self.progress = progress
+        if total is not None:
+            self.total = total
+        Job.objects.filter(pk=self.pk).update(
+            progress=self.progress, total=self.total, modified=now())
+
+    def __unicode__(self):
+        return u'{} {} ({})'.format(self.kind, self.job_id, self.status)
+
+
+class SubmissionArchive(models.Model):
+    """
+    A zip file of submissions that was saved to storage.  `key` is derived
+    from the set of submissions it contains, so an archive can be handed out
+    again for as long as that set doesn't change.  `selection` is derived
+    from the students it was asked for, empty for all of them.
+    """
+    course_id = models.CharField(max_length=255)
+    item_id = models.CharField(max_length=255)
+    key = models.CharField(max_length=40)
+    selection = models.CharField(max_length=40, blank=True, default='')
+    path = models.CharField(max_length=512)
+    members = models.TextField(default='[]')
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta(object):
+        unique_together = (('item_id', 'key'),)
+
+    def __unicode__(self):
+        return u'{} {}'.format(self.item_id, self.key)
+
+
+class UploadSession(models.Model):
+    """
+    A file being uploaded in chunks.  `offset` counts the bytes received and
+    stored so far, which is where an interrupted upload resumes, and `parts`
+    lists the storage paths of the chunks in order.  `fingerprint` is how the
+    client identifies the file, so an upload is only resumed with the same
+    file.
+    """
+    upload_id = models.UUIDField(default=uuid.uuid4, unique=True, editable=False)
+    course_id = models.CharField(max_length=255)
+    item_id = models.CharField(max_length=255)
+    student_id = models.CharField(max_length=255)
+    filename = models.CharField(max_length=255)
+    size = models.BigIntegerField()
+    fingerprint = models.CharField(max_length=128, blank=True)
+    offset = models.BigIntegerField(default=0)
+    parts = models.TextField(default='[]')
+    created = models.DateTimeField(auto_now_add=True)
+    modified = models.DateTimeField(auto_now=True)
+
+    class Meta(object):
+        index_together = (('item_id', 'student_id'),)
+
+    def __unicode__(self):
+        return u'{} {}/{}'.format(self.upload_id, self.offset, self.size)
+
+
+class GradingSummary(models.Model):
+    """
+    Counts of a block's learners who submitted a file, who were graded and
+    whose latest submission was downloaded by staff.  Kept up to date by the
+    block as it writes, and rebuilt from the submissions by the
+    `sga_rebuild_grading_summaries` command.
+    """
+    course_id = models.CharField(max_length=255)
+    item_id = models.CharField(max_length=255, unique=True)
+    submitted = models.IntegerField(default=0)
+    graded = models.IntegerField(default=0)
+    downloaded = models.IntegerField(default=0)
+    modified = models.DateTimeField(auto_now=True)
+
+    def __unicode__(self):
+        return u'{} {}/{}/{}'.format(
+            self.item_id, self.submitted, self.graded, self.downloaded)
+
+
+class DownloadedSubmission(models.Model):
+    """
+    Records that staff downloaded a submission, whoever it was.
+    """
+    item_id = models.CharField(max_length=255, db_index=True)
+    submission_uuid = models.CharField(max_length=36, unique=True)
+    created = models.DateTimeField(auto_now_add=True)
+
+    def __unicode__(self):
+        return u'{} {}'.format(self.item_id, self.submission_uuid)
+
+
+class GraderDownload(models.Model):
+    """
+    Records that a member of staff downloaded a submission, which their
+    staff grading table shows.
+    """
+    item_id = models.CharField(max_length=255)
+    submission_uuid = models.CharField(max_length=36)
+    grader_id = models.IntegerField()
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta(object):
+        unique_together = (('submission_uuid', 'grader_id'),)
+        index_together = (('item_id', 'grader_id'),)
+
+    def __unicode__(self):
+        return u'{} {}'.format(self.submission_uuid, self.grader_id)
+
+
+class SubmissionMigration(models.Model):
+    """
+    How far `sga_migrate_submissions` got through a block's StudentModules,
+    so an interrupted migration resumes after the last batch it finished.
+    """
+    course_id = models.CharField(max_length=255)
+    item_id = models.CharField(max_length=255, unique=True)
+    last_module_id = models.IntegerField(default=0)
+    processed = models.IntegerField(default=0)
+    migrated = models.IntegerField(default=0)
+    finished = models.BooleanField(default=False)
+    modified = models.DateTimeField(auto_now=True)
+
+    def __unicode__(self):
+        return u'{} {}/{}'.format(self.item_id, self.migrated, self.processed)
+
+
+class GradingQueueEntry(models.Model):
+    """
+    A learner of a block waiting for a grade.  Graders claim entries, oldest
+    submission first, and hold them until `lease_expires`, so two graders
+    don't grade the same submission.  Entries are deleted once graded.
+    """
+    course_id = models.CharField(max_length=255)
+    item_id = models.CharField(max_length=255)
+    student_id = models.CharField(max_length=255)
+    submission_uuid = models.CharField(max_length=36)
+    submitted_at = models.DateTimeField()
+    claimed_by = models.IntegerField(null=True)
+    lease_expires = models.DateTimeField(null=True)
+
+    class Meta(object):
+        unique_together = (('item_id', 'student_id'),)
+        index_together = (('item_id', 'submitted_at'),)
+
+    def __unicode__(self):
+        return u'{} {}'.format(self.item_id, self.student_id)
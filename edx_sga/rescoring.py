@@ -0,0 +1,105 @@
+"""
+Rescoring a block after its weight changed.
+
+The weight is the number of points a block is worth.  When it changes, the
+max grade of every StudentModule and the latest score of every learner are
+rewritten, batch by batch in a background job, so an author's save doesn't
+lock the whole course's rows.  Scores keep their proportion of the points:
+9 out of 10 becomes 18 out of 20.  Once done, the rescored rows of the staff
+grading table are recorded as changed and its cached pages are dropped.
+
+There is one rescoring job per block at a time.  It reads the weight from
+the modulestore rather than being told it, and reads it again once done,
+starting over if it changed in the meantime, so the scores always end up
+out of the block's current weight.
+"""
+from django.db import transaction
+from opaque_keys.edx.keys import CourseKey, UsageKey
+from courseware.models import StudentModule
+from submissions import api as submissions_api
+from submissions.models import ScoreSummary, StudentItem
+from xmodule.modulestore.django import modulestore
+
+from edx_sga.caching import block_version_key, bump_version
+from edx_sga.exports import iter_chunks
+from edx_sga.models import GradingChange
+
+BATCH_SIZE = 500
+
+
+def rescore_block(job, course_id, item_id, location, batch_size=BATCH_SIZE):
+    """
+    Rewrites the max grades and the scores of a block for its current
+    weight.  Runs as a job, see `edx_sga.jobs`.
+    """
+    rescored = set()
+    weight = None
+    while True:
+        current = block_weight(location)
+        if current == weight:
+            break
+        weight = current
+        rescored.update(_rescore(
+            job, course_id, item_id, location, weight, batch_size))
+
+    GradingChange.objects.bulk_create([
+        GradingChange(course_id=course_id, item_id=item_id, student_id=student_id)
+        for student_id in sorted(rescored)
+    ], batch_size=batch_size)
+    # Pages cached while the job ran show the old scores
+    bump_version(block_version_key(item_id))
+    return {'rescored': len(rescored)}
+
+
+def block_weight(location):
+    """
+    Returns the points the block at `location` is currently worth.
+    """
+    return modulestore().get_item(UsageKey.from_string(location)).max_score()
+
+
+def _rescore(job, course_id, item_id, location, weight, batch_size):
+    """
+    Rescores the block for `weight` and returns the ids of the learners whose
+    score changed.
+    """
+    modules = StudentModule.objects.filter(
+        course_id=CourseKey.from_string(course_id),
+        module_state_key=UsageKey.from_string(location),
+    ).only('id')
+    summaries = ScoreSummary.objects.filter(
+        student_item__in=StudentItem.objects.filter(
+            course_id=course_id,
+            item_id=item_id,
+            item_type='sga',
+        ),
+    ).select_related('latest', 'latest__submission', 'student_item')
+    progress = 0
+    job.report_progress(progress, modules.count() + summaries.count())
+
+    for batch in iter_chunks(modules, batch_size):
+        StudentModule.objects.filter(
+            pk__in=[module.pk for module in batch],
+        ).update(max_grade=weight)
+        progress += len(batch)
+        job.report_progress(progress)
+
+    rescored = []
+    for batch in iter_chunks(summaries, batch_size):
+        with transaction.atomic():
+            for summary in batch:
+                score = summary.latest
+                if (score.is_hidden() or score.submission is None or
+                        score.points_possible == weight):
+                    continue
+                submissions_api.set_score(
+                    score.submission.uuid,
+                    int(round(
+                        score.points_earned * float(weight) /
+                        score.points_possible)),
+                    weight,
+                )
+                rescored.append(summary.student_item.student_id)
+        progress += len(batch)
+        job.report_progress(progress)
+    return rescored
@@ -2,6 +2,8 @@
 This block defines a Staff Graded Assignment.  Students are shown a rubric
 and invited to upload a file which is then graded by staff.
 """
+import codecs
+import csv
 import datetime
 import hashlib
 import json
@@ -10,43 +12,111 @@ import mimetypes
 import os
 import pkg_resources
 import pytz
+import random
 import StringIO
+import uuid
 import zipfile
 
 from courseware.models import StudentModule
-from django.db.models import Q
+from django.db.models import Case, F, Max, Q, Value, When
+from django.conf import settings
 from django.contrib.auth.models import User
 from django.core.exceptions import PermissionDenied
-from django.core.files import File
 from django.core.files.storage import default_storage
+from django.db import IntegrityError, transaction
 from django.template import Context, Template
-from functools import partial
-from student.models import CourseEnrollment, anonymous_id_for_user, user_by_anonymous_id
+from functools import partial, wraps
+from student.models import (
+    AnonymousUserId, CourseEnrollment, anonymous_id_for_user, user_by_anonymous_id
+)
 from submissions import api as submissions_api
+from submissions.models import ScoreSummary, Submission
 from submissions.models import StudentItem as SubmissionsStudent
+from submissions.serializers import SubmissionSerializer
 from webob.response import Response
 from xblock.core import XBlock
 from xblock.exceptions import JsonHandlerError
 from xblock.fields import Boolean, DateTime, Float, Integer, Scope, String
 from xblock.fragment import Fragment
+from xmodule.modulestore.django import modulestore
 from xmodule.util.duedate import get_extended_due_date
 
+from edx_sga.archives import archive_key, find_archive, selection_key
+from edx_sga.caching import (
+    SNAPSHOT_TIMEOUT, block_version_key, bump_version, get_cache, snapshot_key)
+from edx_sga.dashboard import course_ungraded_work
+from edx_sga.downloads import etag_matches, file_response
+from edx_sga.exports import (
+    EXPORT_FORMATS, iter_chunks, iter_export, iter_grade_records)
+from edx_sga.instrumentation import counted_reads, instrument_block
+from edx_sga.jobs import job_status, start_job
+from edx_sga.models import (
+    DownloadedSubmission, GraderDownload, GradingChange, GradingQueueEntry,
+    GradingSummary, Job, UploadSession)
+from edx_sga.uploads import (
+    delete_expired_uploads, delete_parts, max_upload_size, store_part,
+    store_upload, upload_chunk_size, upload_sessions)
+from edx_sga.zipstream import iter_file, stream_zip
+
 log = logging.getLogger(__name__)
-BLOCK_SIZE = 2**10 * 8  # 8kb
 DATETIME_FORMAT = '%m/%d/%Y %-I:%M%p'
+# Past this many users it's cheaper to read all of a block's rows than to
+# send the ids in an IN clause.
+MAX_IN_CLAUSE = 500
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+# Windows streamed as newline delimited JSON can be larger, since their rows
+# are built and sent a chunk at a time.
+MAX_STREAM_PAGE_SIZE = 5000
+STREAM_CHUNK_SIZE = 100
+GRADING_SORT_KEYS = ('username', 'timestamp', 'score', 'downloaded')
+# How long a grader holds the submission they claimed from the grading
+# queue, in seconds, and how many of the oldest ones they race others for.
+GRADING_LEASE = 15 * 60
+CLAIM_CANDIDATES = 10
+# Grade rows imported per transaction
+GRADE_BATCH_SIZE = 100
+# How long changes to staff grading tables are kept for clients to catch up
+# with, in seconds.  See `delete_old_grading_changes`.
+GRADING_CHANGE_RETENTION = 24 * 60 * 60
+# Package resources and parsed templates, by kind and path.  See `_cached`.
+_RESOURCE_CACHE = {}
+
+
+class reify(object):
+    """
+    Property which caches value so it is only computed once.  The value is
+    stored in the instance dict, which takes precedence over this non-data
+    descriptor from then on.
+    """
+    def __init__(self, meth):
+        self.meth = meth
+        self.__doc__ = meth.__doc__
+
+    def __get__(self, inst, cls=None):
+        if inst is None:
+            return self
+        value = inst.__dict__[self.meth.__name__] = self.meth(inst)
+        return value
 
 
-def reify(meth):
+def memoize(meth):
     """
-    Property which caches value so it is only computed once.
+    Caches the results of a method by arguments on the block.  The runtime
+    builds a block for each request, so lookups are made at most once per
+    request; methods that write call `clear_memoized` afterwards.
     """
-    def getter(inst):
-        value = meth(inst)
-        inst.__dict__[meth.__name__] = value
-        return value
-    return property(getter)
+    @wraps(meth)
+    def wrapper(self, *args, **kwargs):
+        cache = self.__dict__.setdefault('_memoized', {})
+        key = (meth.__name__, args, tuple(sorted(kwargs.items())))
+        if key not in cache:
+            cache[key] = meth(self, *args, **kwargs)
+        return cache[key]
+    return wrapper
 
 
+@instrument_block
 class StaffGradedAssignmentXBlock(XBlock):
     """
     This block defines a Staff Graded Assignment.  Students are shown a rubric
@@ -138,6 +208,7 @@ class StaffGradedAssignmentXBlock(XBlock):
             "item_type": 'sga',  # ???
         }
 
+    @memoize
     def get_submission(self, id=None):
         """
         Get student's most recent submission.
@@ -149,6 +220,7 @@ class StaffGradedAssignmentXBlock(XBlock):
             # be first
             return submissions[0]
 
+    @memoize
     def get_score(self, id=None):
         """
         Get student's current score.
@@ -161,6 +233,14 @@ class StaffGradedAssignmentXBlock(XBlock):
     def score(self):
         return self.get_score()
 
+    def clear_memoized(self):
+        """
+        Forgets the submissions, scores and download statuses looked up so
+        far, after they were changed.
+        """
+        self.__dict__.pop('_memoized', None)
+        self.__dict__.pop('score', None)
+
     def get_enrolled_students(self):
         return CourseEnrollment.objects.users_enrolled_in(self.course_id).exclude(
                 Q(is_staff=True) | Q(is_superuser=True)
@@ -233,41 +313,410 @@ class StaffGradedAssignmentXBlock(XBlock):
         }
 
     def staff_grading_data(self):
-        submitted_student_data = []
-        for user in self.get_enrolled_students():
-            module = None
-            student_id = anonymous_id_for_user(user, self.course_id)
-            submission = self.get_submission(student_id)
-            if submission:
-                module, _ = StudentModule.objects.get_or_create(
-                    course_id=self.course_id,
-                    module_state_key=self.location,
-                    student=user,
-                    defaults={
-                        'state': '{}',
-                        'module_type': self.category,
-                    })
+        return {
+            'assignments': self.get_grading_rows(self.get_enrolled_students()),
+            'max_score': '{:.2f}'.format(self.max_score()),
+            'has_due': self.has_due,
+            'passed_due': self.past_due(),
+        }
+
+    def get_grading_rows(self, users, anonymous_ids=None, submissions=None,
+                         scores=None):
+        """
+        Returns the staff grading table rows for the given users.  Everything
+        is fetched with a fixed number of set based queries and joined in
+        memory, so the cost does not depend on the size of the roster.
+        Lookups the caller already made can be passed in to be reused.
+        """
+        users = list(users.select_related('profile'))
+        if anonymous_ids is None:
+            anonymous_ids = self.get_anonymous_ids(user.id for user in users)
+        if submissions is None:
+            submissions = self.get_latest_submissions()
+        if scores is None:
+            scores = self.get_scores()
+        modules = self.get_student_modules(
+            user for user in users if anonymous_ids[user.id] in submissions
+        )
+        downloaded = self.get_downloaded(
+            submissions[anonymous_ids[user.id]]['uuid'] for user in users
+            if anonymous_ids[user.id] in submissions
+        )
+
+        rows = []
+        for user in users:
+            student_id = anonymous_ids[user.id]
+            submission = submissions.get(student_id)
+            module = modules.get(user.id) if submission else None
             state = json.loads(module.state) if module else {}
-            submitted_student_data.append({
+            rows.append({
                 'module_id': module.id if module else None,
                 'student_id': student_id,
                 'submission_id': submission['uuid'] if submission else None,
                 'username': user.username,
                 'fullname': user.profile.name,
                 'filename': submission['answer']["filename"] if submission else None,
-                'downloaded': self.get_submission_download_status(student_id),
+                'downloaded': (
+                    submission is not None and submission['uuid'] in downloaded),
                 'timestamp': str(submission['created_at']) if submission else None,
-                'score': self.get_score(student_id),
+                'score': scores.get(student_id),
                 'annotated': state.get("annotated_filename"),
                 'comment': state.get("comment", ''),
             })
+        return rows
 
-        return {
-            'assignments': submitted_student_data,
+    def staff_grading_page(self, **query):
+        """
+        Returns one window of the staff grading table.  See
+        `staff_grading_window` for the arguments.
+        """
+        page, window, lookups = self.staff_grading_window(**query)
+        page['assignments'] = self.get_window_rows(window, **lookups)
+        return page
+
+    def iter_staff_grading_page(self, chunk_size=STREAM_CHUNK_SIZE, **query):
+        """
+        Yields the same window as `staff_grading_page`: first the page
+        without its rows, then the rows, built `chunk_size` learners at a
+        time so the first ones can be sent before the last are read.
+        """
+        page, window, lookups = self.staff_grading_window(**query)
+        yield page
+        for start in range(0, len(window), chunk_size):
+            for row in self.get_window_rows(
+                    window[start:start + chunk_size], **lookups):
+                yield row
+
+    def get_window_rows(self, window, anonymous_ids, scores):
+        """
+        Returns the rows of the users in `window`, in the same order.  Only
+        their submissions are read in full.
+        """
+        rows = self.get_grading_rows(
+            User.objects.filter(id__in=window),
+            anonymous_ids=anonymous_ids,
+            submissions=self.get_latest_submissions(
+                [anonymous_ids[user_id] for user_id in window]),
+            scores=scores,
+        )
+        position = {
+            anonymous_ids[user_id]: index for index, user_id in enumerate(window)
+        }
+        rows.sort(key=lambda row: position[row['student_id']])
+        return rows
+
+    def staff_grading_window(self, cursor=0, page_size=DEFAULT_PAGE_SIZE,
+                             sort='username', descending=False,
+                             submitted_only=False, ungraded_only=False,
+                             search=None):
+        """
+        Picks the users in one window of the staff grading table.  The roster
+        is filtered and sorted on cheap keys, so full rows only need to be
+        built for the window.  Returns the page without its rows, the user
+        ids of the window and the lookups to build the rows with.
+        """
+        # Read the version first so changes made while the page is built are
+        # picked up by the next resync.
+        version = self.grading_table_version()
+        users = self.get_enrolled_students()
+        if search:
+            users = users.filter(username__icontains=search)
+        roster = list(users.order_by('username').values_list('id', flat=True))
+        anonymous_ids = self.get_anonymous_ids(roster)
+        submissions = self.get_latest_submission_keys()
+        scores = self.get_scores()
+
+        if submitted_only:
+            roster = [
+                user_id for user_id in roster
+                if anonymous_ids[user_id] in submissions and
+                submissions[anonymous_ids[user_id]]['has_file']
+            ]
+        if ungraded_only:
+            roster = [
+                user_id for user_id in roster
+                if anonymous_ids[user_id] not in scores
+            ]
+
+        if sort == 'timestamp':
+            def sort_key(user_id):
+                submission = submissions.get(anonymous_ids[user_id])
+                return submission['created_at'] if submission else None
+        elif sort == 'score':
+            def sort_key(user_id):
+                return scores.get(anonymous_ids[user_id])
+        elif sort == 'downloaded':
+            downloaded = self.get_downloaded(
+                submission['uuid'] for submission in submissions.values())
+
+            def sort_key(user_id):
+                submission = submissions.get(anonymous_ids[user_id])
+                return submission['uuid'] in downloaded if submission else None
+        else:
+            sort_key = None
+        if sort_key:
+            # Learners without a value always go last, whatever the order.
+            keys = {user_id: sort_key(user_id) for user_id in roster}
+            roster = sorted(
+                (user_id for user_id in roster if keys[user_id] is not None),
+                key=keys.get,
+                reverse=descending,
+            ) + [user_id for user_id in roster if keys[user_id] is None]
+        elif descending:
+            roster.reverse()
+
+        window = roster[cursor:cursor + page_size]
+        total = len(roster)
+        next_cursor = cursor + page_size
+        page = {
             'max_score': '{:.2f}'.format(self.max_score()),
             'has_due': self.has_due,
             'passed_due': self.past_due(),
+            'total': total,
+            'cursor': cursor,
+            'page_size': page_size,
+            'next_cursor': next_cursor if next_cursor < total else None,
+            'previous_cursor': max(cursor - page_size, 0) if cursor else None,
+            'version': version,
         }
+        lookups = {
+            'anonymous_ids': anonymous_ids,
+            'scores': scores,
+        }
+        return page, window, lookups
+
+    def cached_staff_grading_page(self, **query):
+        """
+        Returns `staff_grading_page(**query)` from the cache when nothing it
+        shows changed since it was built.  Whether the current grader
+        downloaded each submission and the due date state are filled in
+        afresh, since they aren't part of the block's version.
+        """
+        key_params = dict(query)
+        if query.get('sort') == 'downloaded':
+            key_params['grader'] = self.xmodule_runtime.user_id
+        cache = get_cache()
+        key = snapshot_key(self.block_id, self.course_id, key_params)
+        page = cache.get(key)
+        if page is None:
+            page = self.staff_grading_page(**query)
+            cache.set(key, page, SNAPSHOT_TIMEOUT)
+        downloaded = self.get_downloaded(
+            row['submission_id'] for row in page['assignments']
+            if row['submission_id'])
+        for row in page['assignments']:
+            row['downloaded'] = row['submission_id'] in downloaded
+        page['has_due'] = self.has_due
+        page['passed_due'] = self.past_due()
+        return page
+
+    def grading_snapshot_changed(self):
+        """
+        Invalidates the cached pages of the staff grading table.
+        """
+        bump_version(block_version_key(self.block_id))
+
+    def get_grading_rows_for(self, student_ids):
+        """
+        Returns the staff grading table rows for the given anonymous student
+        ids.
+        """
+        student_ids = list(student_ids)
+        anonymous_ids = dict(AnonymousUserId.objects.filter(
+            course_id=self.course_id,
+            anonymous_user_id__in=student_ids,
+        ).values_list('user_id', 'anonymous_user_id'))
+        return self.get_grading_rows(
+            self.get_enrolled_students().filter(id__in=anonymous_ids.keys()),
+            anonymous_ids=anonymous_ids,
+            submissions=self.get_latest_submissions(student_ids),
+            scores=self.get_scores(student_ids),
+        )
+
+    def grading_changed(self, student_id):
+        """
+        Records a change to a learner's row in the staff grading table and
+        returns the new version of the table.
+        """
+        self.grading_snapshot_changed()
+        return GradingChange.objects.create(
+            course_id=unicode(self.course_id),
+            item_id=unicode(self.block_id),
+            student_id=student_id,
+        ).id
+
+    def grading_rows_changed(self, student_ids):
+        """
+        Records changes to several learners' rows in the staff grading table
+        with one insert.
+        """
+        student_ids = list(student_ids)
+        if not student_ids:
+            return
+        self.grading_snapshot_changed()
+        GradingChange.objects.bulk_create([
+            GradingChange(
+                course_id=unicode(self.course_id),
+                item_id=unicode(self.block_id),
+                student_id=student_id,
+            )
+            for student_id in student_ids
+        ])
+
+    def grading_table_version(self):
+        """
+        Returns the current version of the staff grading table.
+        """
+        version = GradingChange.objects.filter(
+            item_id=unicode(self.block_id),
+        ).order_by('-id').values_list('id', flat=True).first()
+        return version or 0
+
+    def grading_row_response(self, student_id):
+        """
+        Records a change to a learner's row and returns the updated row along
+        with the new table version, so clients can patch their table in place.
+        """
+        version = self.grading_changed(student_id)
+        rows = self.get_grading_rows_for([student_id])
+        return Response(json_body={
+            'row': rows[0] if rows else None,
+            'version': version,
+        })
+
+    def get_anonymous_ids(self, user_ids):
+        """
+        Returns a dict mapping user ids to their anonymous ids for this
+        course.  Ids are read in one query; only users who have never been
+        assigned one fall back to `anonymous_id_for_user`.
+        """
+        user_ids = list(user_ids)
+        anonymous_ids = AnonymousUserId.objects.filter(course_id=self.course_id)
+        if len(user_ids) <= MAX_IN_CLAUSE:
+            anonymous_ids = anonymous_ids.filter(user_id__in=user_ids)
+        anonymous_ids = dict(
+            anonymous_ids.values_list('user_id', 'anonymous_user_id'))
+        missing = [user_id for user_id in user_ids if user_id not in anonymous_ids]
+        if missing:
+            for user in User.objects.filter(id__in=missing):
+                anonymous_ids[user.id] = anonymous_id_for_user(
+                    user, self.course_id)
+        return anonymous_ids
+
+    def student_items(self):
+        """
+        Returns a queryset of the submissions app student items for this
+        block.
+        """
+        return SubmissionsStudent.objects.filter(
+            course_id=unicode(self.course_id),
+            item_id=unicode(self.block_id),
+            item_type='sga',
+        )
+
+    def get_latest_submissions(self, student_ids=None):
+        """
+        Returns a dict mapping anonymous student ids to their most recent
+        submission, serialized the same way as `get_submission`.
+        """
+        submissions = Submission.objects.filter(
+            student_item__in=self.student_items(),
+        ).select_related('student_item').order_by('-submitted_at', '-id')
+        if student_ids is not None:
+            submissions = submissions.filter(
+                student_item__student_id__in=student_ids)
+        latest = {}
+        for submission in submissions:
+            student_id = submission.student_item.student_id
+            if student_id not in latest:
+                latest[student_id] = SubmissionSerializer(submission).data
+        return latest
+
+    def get_latest_submission_keys(self):
+        """
+        Returns a dict mapping anonymous student ids to the uuid, creation
+        time and whether a file was submitted of their most recent
+        submission, which is all the staff grading table is filtered and
+        sorted on, without serializing the submissions.
+        """
+        submissions = Submission.objects.filter(
+            student_item__in=self.student_items(),
+        ).order_by('-submitted_at', '-id').values_list(
+            'student_item__student_id', 'uuid', 'created_at', 'raw_answer')
+        latest = {}
+        for student_id, submission_uuid, created_at, raw_answer in submissions:
+            if student_id not in latest:
+                latest[student_id] = {
+                    'uuid': unicode(submission_uuid),
+                    'created_at': created_at,
+                    'has_file': bool(json.loads(raw_answer).get('filename')),
+                }
+        return latest
+
+    def get_scores(self, student_ids=None):
+        """
+        Returns a dict mapping anonymous student ids to their current score,
+        with the same semantics as `get_score`.
+        """
+        summaries = ScoreSummary.objects.filter(
+            student_item__in=self.student_items(),
+        ).select_related('latest', 'student_item')
+        if student_ids is not None:
+            summaries = summaries.filter(
+                student_item__student_id__in=student_ids)
+        return {
+            summary.student_item.student_id: summary.latest.points_earned
+            for summary in summaries
+            # By convention reset scores are hidden and mean "no score"
+            if not summary.latest.is_hidden()
+        }
+
+    def get_student_modules(self, users):
+        """
+        Returns a dict mapping user ids to this block's StudentModule for
+        each of the given users, creating the missing ones in bulk.
+        """
+        users = list(users)
+        modules = StudentModule.objects.filter(
+            course_id=self.course_id,
+            module_state_key=self.location,
+        )
+        if len(users) <= MAX_IN_CLAUSE:
+            modules = modules.filter(student__in=users)
+        modules = {module.student_id: module for module in modules}
+        missing = [user for user in users if user.id not in modules]
+        if missing:
+            try:
+                with transaction.atomic():
+                    StudentModule.objects.bulk_create([
+                        StudentModule(
+                            course_id=self.course_id,
+                            module_state_key=self.location,
+                            student=user,
+                            state='{}',
+                            module_type=self.category,
+                        )
+                        for user in missing
+                    ])
+            except IntegrityError:
+                # Some of them were created by another request meanwhile
+                for user in missing:
+                    StudentModule.objects.get_or_create(
+                        course_id=self.course_id,
+                        module_state_key=self.location,
+                        student=user,
+                        defaults={'state': '{}', 'module_type': self.category},
+                    )
+            # bulk_create doesn't set primary keys on every backend
+            modules.update({
+                module.student_id: module
+                for module in StudentModule.objects.filter(
+                    course_id=self.course_id,
+                    module_state_key=self.location,
+                    student__in=missing,
+                )
+            })
+        return modules
 
     def studio_view(self, context=None):
         try:
@@ -300,12 +749,26 @@ class StaffGradedAssignmentXBlock(XBlock):
             raise
 
     def update_weight(self, weight):
-        """Set the new weight value and update all previous CSM's."""
+        """
+        Set the new weight value and start a job rescoring all previous
+        CSM's and scores for it, unless one is already waiting to run: the
+        job reads the weight when it runs.
+        """
+        if weight == self.weight:
+            return
         self.weight = weight
-        StudentModule.objects.filter(
-            course_id=self.course_id,
-            module_state_key=self.location
-        ).update(max_grade=self.weight)
+        self.grading_snapshot_changed()
+        start_job(
+            'rescore',
+            self.course_id,
+            self.block_id,
+            {
+                'course_id': unicode(self.course_id),
+                'item_id': unicode(self.block_id),
+                'location': unicode(self.location),
+            },
+            key='rescore',
+        )
 
     @XBlock.json_handler
     def save_sga(self, data, suffix=''):
@@ -330,49 +793,213 @@ class StaffGradedAssignmentXBlock(XBlock):
     @XBlock.handler
     def update_grades_published(self, request, suffix=''):
         self.grades_published = json.loads(request.params.get('grades_published'))
+        self.grading_snapshot_changed()
         return Response(status=200)
 
     @XBlock.handler
     def upload_assignment(self, request, suffix=''):
         require(self.upload_allowed())
         upload = request.params['assignment']
-        sha1 = _get_sha1(upload.file)
+        if _file_size(upload.file) > max_upload_size():
+            return Response(status=413, json_body={'error': 'File too large.'})
+        sha1 = store_upload(
+            upload.file, partial(self._file_storage_path, filename=upload.file.name))
         answer = {
             "sha1": sha1,
             "filename": upload.file.name,
             "mimetype": mimetypes.guess_type(upload.file.name)[0],
         }
-        student_id = self.student_submission_id()
-        submissions_api.create_submission(student_id, answer)
-        path = self._file_storage_path(sha1, upload.file.name)
-        if not default_storage.exists(path):
-            default_storage.save(path, File(upload.file))
+        self.submit_answer(answer)
+        return Response(json_body=self.student_state())
+
+    @XBlock.handler
+    def init_upload(self, request, suffix=''):
+        """
+        Starts uploading a file in chunks, or returns the unfinished upload
+        of the same file so it can be resumed from the offset it reached.
+        Uploads are only resumed for a client that sends the same
+        `fingerprint` of the file, such as its modification time and a hash
+        of its contents.  Files larger than SGA_MAX_UPLOAD_SIZE are refused,
+        and so are chunks past the size given here.
+        """
+        require(self.upload_allowed())
+        filename = request.params['filename']
+        fingerprint = request.params.get('fingerprint', '')
+        try:
+            size = int(request.params['size'])
+        except ValueError:
+            size = -1
+        if size < 0:
+            return Response(status=400, json_body={'error': 'Invalid file size.'})
+        if size > max_upload_size():
+            return Response(status=413, json_body={'error': 'File too large.'})
+        if len(fingerprint) > 128:
+            return Response(status=400, json_body={'error': 'Invalid fingerprint.'})
+        student_id = self.student_submission_id()['student_id']
+        delete_expired_uploads(
+            item_id=unicode(self.block_id), student_id=student_id)
+        session = upload_sessions(
+            item_id=unicode(self.block_id),
+            student_id=student_id,
+            filename=filename,
+            size=size,
+            fingerprint=fingerprint,
+        ).order_by('-modified').first() if fingerprint else None
+        if session is None:
+            session = UploadSession.objects.create(
+                course_id=unicode(self.course_id),
+                item_id=unicode(self.block_id),
+                student_id=student_id,
+                filename=filename,
+                size=size,
+                fingerprint=fingerprint,
+            )
+        return Response(json_body={
+            'upload_id': unicode(session.upload_id),
+            'offset': session.offset,
+            'chunk_size': upload_chunk_size(),
+        })
+
+    @XBlock.handler
+    def upload_chunk(self, request, suffix=''):
+        """
+        Stores the next chunk of a chunked upload.  The chunk's offset is
+        sent as the `offset` parameter or in a Content-Range header; a chunk
+        that doesn't start where the upload stopped is refused with the
+        offset to resume from.
+        """
+        require(self.upload_allowed())
+        session = self.get_upload_session(request.params.get('upload_id'))
+        if session is None:
+            return Response(status=404, json_body={'error': 'Unknown upload.'})
+        chunk = request.params['chunk']
+        offset = _chunk_offset(request)
+        length = _file_size(chunk.file)
+        if offset is None or length > upload_chunk_size() or \
+                offset + length > session.size:
+            return Response(status=400, json_body={'error': 'Invalid chunk.'})
+        if offset != session.offset:
+            return Response(status=409, json_body={'offset': session.offset})
+
+        part = store_part(self._upload_parts_path(session.upload_id), offset, chunk.file)
+        with transaction.atomic():
+            session = UploadSession.objects.select_for_update().filter(
+                pk=session.pk).first()
+            stored = session is not None and session.offset == offset
+            if stored:
+                session.offset += length
+                session.parts = json.dumps(json.loads(session.parts) + [part])
+                session.save()
+        if session is None:
+            # The upload expired and was deleted meanwhile
+            delete_parts([part])
+            return Response(status=404, json_body={'error': 'Unknown upload.'})
+        if not stored:
+            # Another request stored this chunk first
+            delete_parts([part])
+            return Response(status=409, json_body={'offset': session.offset})
+        return Response(json_body={'offset': session.offset})
+
+    @XBlock.handler
+    def finalize_upload(self, request, suffix=''):
+        """
+        Submits the file of a chunked upload once all of its chunks are in.
+        The chunks are put together by a background job, which the first
+        call starts: until it is done, calls are answered with a 202 and the
+        job's status, and the client calls again.
+        """
+        require(self.upload_allowed())
+        session = self.get_upload_session(request.params.get('upload_id'))
+        if session is None:
+            return Response(status=404, json_body={'error': 'Unknown upload.'})
+        if session.offset != session.size:
+            return Response(status=409, json_body={'offset': session.offset})
+        job = Job.objects.filter(
+            kind='assemble_upload',
+            item_id=unicode(self.block_id),
+            key=session.upload_id.hex,
+            status=Job.DONE,
+        ).first() or start_job(
+            'assemble_upload',
+            self.course_id,
+            self.block_id,
+            {
+                'upload_id': unicode(session.upload_id),
+                'path': self._file_storage_path('{sha1}', session.filename),
+            },
+            key=session.upload_id.hex,
+        )
+        if job.status == Job.FAILED:
+            return Response(
+                status=500, json_body={'error': 'The file could not be stored.'})
+        if job.status != Job.DONE:
+            return Response(status=202, json_body=job_status(job))
+        if not UploadSession.objects.filter(pk=session.pk).delete()[0]:
+            # Another request finalized this upload first
+            return Response(json_body=self.student_state())
+        delete_parts(json.loads(session.parts))
+        self.submit_answer({
+            "sha1": json.loads(job.result)['sha1'],
+            "filename": session.filename,
+            "mimetype": mimetypes.guess_type(session.filename)[0],
+        })
         return Response(json_body=self.student_state())
 
+    def submit_answer(self, answer):
+        """
+        Submits a file for the current student.
+        """
+        previous = self.get_submission()
+        student_item = self.student_submission_id()
+        submission = submissions_api.create_submission(student_item, answer)
+        self.queue_for_grading(student_item['student_id'], submission['uuid'])
+        self.clear_memoized()
+        self.grading_changed(student_item['student_id'])
+        downloaded = DownloadedSubmission.objects.filter(
+            submission_uuid=previous['uuid']).exists() if previous else False
+        self.bump_grading_summary(
+            submitted=0 if _has_file(previous) else 1,
+            downloaded=-1 if downloaded else 0)
+
+    def get_upload_session(self, upload_id):
+        """
+        Returns the current student's upload with the given id, or None.
+        """
+        try:
+            upload_id = uuid.UUID(upload_id)
+        except (TypeError, ValueError):
+            return None
+        return upload_sessions(
+            upload_id=upload_id,
+            item_id=unicode(self.block_id),
+            student_id=self.student_submission_id()['student_id'],
+        ).first()
+
     @XBlock.handler
     def staff_upload_annotated(self, request, suffix=''):
         require(self.is_course_staff())
         upload = request.params['annotated']
         module = StudentModule.objects.get(pk=request.params['module_id'])
         state = json.loads(module.state)
-        state['annotated_sha1'] = sha1 = _get_sha1(upload.file)
-        state['annotated_filename'] = filename = upload.file.name
+        state['annotated_sha1'] = store_upload(
+            upload.file, partial(self._file_storage_path, filename=upload.file.name))
+        state['annotated_filename'] = upload.file.name
         state['annotated_mimetype'] = mimetypes.guess_type(upload.file.name)[0]
         state['annotated_timestamp'] = _now().strftime(
             DateTime.DATETIME_FORMAT
         )
-        path = self._file_storage_path(sha1, filename)
-        if not default_storage.exists(path):
-            default_storage.save(path, File(upload.file))
         module.state = json.dumps(state)
         module.save()
-        return Response(json_body=self.staff_grading_data())
+        return self.grading_row_response(
+            anonymous_id_for_user(module.student, self.course_id))
 
     @XBlock.handler
     def download_assignment(self, request, suffix=''):
         answer = self.get_submission()['answer']
         path = self._file_storage_path(answer['sha1'], answer['filename'])
-        return self.download(path, answer['mimetype'], answer['filename'])
+        return self.download(
+            path, answer['mimetype'], answer['filename'], answer['sha1'],
+            request)
 
     @XBlock.handler
     def download_annotated(self, request, suffix=''):
@@ -383,7 +1010,9 @@ class StaffGradedAssignmentXBlock(XBlock):
         return self.download(
             path,
             self.annotated_mimetype,
-            self.annotated_filename
+            self.annotated_filename,
+            self.annotated_sha1,
+            request
         )
 
     @XBlock.handler
@@ -392,8 +1021,12 @@ class StaffGradedAssignmentXBlock(XBlock):
         submission = self.get_submission(request.params['student_id'])
         answer = submission['answer']
         path = self._file_storage_path(answer['sha1'], answer['filename'])
-        self.set_submission_status_to_downloaded(request.params['student_id'])
-        return self.download(path, answer['mimetype'], answer['filename'])
+        if self.set_submissions_status_to_downloaded([submission['uuid']]):
+            self.grading_changed(request.params['student_id'])
+        self.record_downloads([submission['uuid']])
+        return self.download(
+            path, answer['mimetype'], answer['filename'], answer['sha1'],
+            request)
 
     @XBlock.handler
     def staff_download_annotated(self, request, suffix=''):
@@ -407,65 +1040,125 @@ class StaffGradedAssignmentXBlock(XBlock):
         return self.download(
             path,
             state['annotated_mimetype'],
-            state['annotated_filename']
+            state['annotated_filename'],
+            state['annotated_sha1'],
+            request
         )
 
-    def download(self, path, mimetype, filename):
-        student_file = default_storage.open(path)
-        app_iter = iter(partial(student_file.read, BLOCK_SIZE), '')
-        return Response(
-            app_iter=app_iter,
-            content_type=mimetype,
-            content_disposition="attachment; filename=" + filename)
+    def download(self, path, mimetype, filename, sha1=None, request=None):
+        """
+        Sends a stored file.  Files are named after their `sha1`, which is
+        used as their ETag to answer conditional and range requests.
+        """
+        return file_response(request, path, mimetype, filename, sha1)
 
     @XBlock.handler
     def download_submissions(self, request, suffix=''):
+        """
+        Zips the submissions of the given students.  A GET with `stream=1`
+        takes the ids from repeated `student_id` parameters and streams the
+        archive back, otherwise they are read from the JSON body.
+        """
         require(self.is_course_staff())
-        student_ids = json.loads(request.body).get('student_ids', [])
+        if request.method == 'GET':
+            student_ids = request.params.getall('student_id')
+        else:
+            student_ids = json.loads(request.body).get('student_ids', [])
         files = self.get_files(self.get_submissions(student_ids))
-        return self.download_zip(files)
+        return self.download_zip(
+            files, stream=_is_true(request.params.get('stream')))
 
     @XBlock.handler
     def download_all_submissions(self, request, suffix=''):
         require(self.is_course_staff())
         files = self.get_files(self.get_submissions())
-        return self.download_zip(files)
+        return self.download_zip(
+            files, stream=_is_true(request.params.get('stream')))
 
     def get_submissions(self, student_ids=None):
-        all_students = SubmissionsStudent.objects.filter(course_id=self.course_id, item_id=self.block_id)
-        students = all_students.filter(student_id__in=student_ids) if student_ids else all_students
-        if not student_ids:
-            enrolled_students = self.get_enrolled_students()
-        submissions = []
-        for student in students:
-            user = user_by_anonymous_id(student.student_id)
-            if student_ids is None and not user in enrolled_students:
+        """
+        Returns the latest submission of the given students, or of every
+        enrolled student, with their usernames, and marks the submissions as
+        downloaded.  Students, enrollments and submissions are looked up with
+        a fixed number of queries.
+        """
+        submissions = self.get_latest_submissions(student_ids or None)
+        if not submissions:
+            return []
+        anonymous_ids = AnonymousUserId.objects.filter(
+            course_id=self.course_id,
+        ).select_related('user')
+        if len(submissions) <= MAX_IN_CLAUSE:
+            anonymous_ids = anonymous_ids.filter(
+                anonymous_user_id__in=submissions.keys())
+        users = {
+            anonymous_id.anonymous_user_id: anonymous_id.user
+            for anonymous_id in anonymous_ids
+            if anonymous_id.anonymous_user_id in submissions
+        }
+        if student_ids is None:
+            enrolled = set(
+                self.get_enrolled_students().values_list('id', flat=True))
+
+        downloaded = []
+        for student_id, submission_data in submissions.items():
+            user = users.get(student_id)
+            if user is None or user.is_staff or user.is_superuser:
                 continue
-            submission_data = self.get_submission(student.student_id)
-            if submission_data and not (user.is_staff or user.is_superuser):
-                self.set_submission_status_to_downloaded(student.student_id)
-                submissions.append({
-                    'username': user.username,
-                    'data': submission_data
-                })
-        return submissions
+            if student_ids is None and user.id not in enrolled:
+                continue
+            downloaded.append({
+                'student_id': student_id,
+                'username': user.username,
+                'data': submission_data
+            })
+        downloaded.sort(key=lambda submission: submission['username'])
+        marked = self.set_submissions_status_to_downloaded(
+            submission['data']['uuid'] for submission in downloaded)
+        self.grading_rows_changed(
+            submission['student_id'] for submission in downloaded
+            if submission['data']['uuid'] in marked)
+        self.record_downloads(
+            submission['data']['uuid'] for submission in downloaded
+            if _has_file(submission['data']))
+        return downloaded
 
     def get_files(self, submissions):
         files = []
         for submission in submissions:
             answer = submission['data']['answer']
             if answer['filename']:
-                path = self._file_storage_path(answer['sha1'], answer['filename'])
                 files.append({
-                    'path': default_storage.path(path),
-                    'name': '{}-{}'.format(submission['username'], answer['filename'])
+                    'path': self._file_storage_path(answer['sha1'], answer['filename']),
+                    'name': '{}-{}'.format(submission['username'], answer['filename']),
+                    'student_id': submission['student_id'],
+                    'sha1': answer['sha1'],
                 })
         return files
 
-    def download_zip(self, student_files):
+    def download_zip(self, student_files, stream=False):
+        """
+        Zips the given files.  By default the archive is saved to storage and
+        its URL returned as JSON.  With `stream` the archive is sent back as
+        it is built, reading each file from storage one chunk at a time.
+        """
         zip_subdir = 'student_submissions'
         zip_filename = '{}.zip'.format(zip_subdir)
 
+        if stream:
+            members = (
+                (
+                    os.path.join(zip_subdir, student_file['name']),
+                    counted_reads(
+                        iter_file(default_storage.open(student_file['path']))),
+                )
+                for student_file in student_files
+            )
+            return Response(
+                app_iter=stream_zip(members),
+                content_type='application/zip',
+                content_disposition="attachment; filename=" + zip_filename)
+
         # create StringIO object to serve as in-memory zip file
         sio = StringIO.StringIO()
 
@@ -473,21 +1166,480 @@ class StaffGradedAssignmentXBlock(XBlock):
         with zipfile.ZipFile(sio, 'w') as zf:
             for student_file in student_files:
                 zip_path = os.path.join(zip_subdir, student_file['name'])
-                zf.write(student_file['path'], zip_path)
+                zf.write(default_storage.path(student_file['path']), zip_path)
 
         # save zip file and return its URL as JSON response
         return Response(json={'zip_url': default_storage.url(default_storage.save(zip_filename, sio))})
 
-    def get_submission_download_status(self, student_id):
-        return submissions_api.get_download_status(self.student_submission_id(student_id), self.user)
+    @XBlock.handler
+    def prepare_download_submissions(self, request, suffix=''):
+        """
+        Starts building an archive of all submissions, or of the students in
+        the `student_ids` list of the JSON body, and returns the status of the
+        job doing it.  Poll `get_job_status` until it is done.  When the same
+        set of submissions was archived before, that archive is returned
+        straight away.
+        """
+        require(self.is_course_staff())
+        student_ids = None
+        if request.body:
+            student_ids = json.loads(request.body).get('student_ids')
+        files = self.get_files(self.get_submissions(student_ids))
+        key = archive_key(files)
+        archive = find_archive(self.block_id, key)
+        if archive:
+            return Response(json_body={
+                'job_id': None,
+                'status': Job.DONE,
+                'zip_url': default_storage.url(archive.path),
+            })
+        job = start_job(
+            'submission_archive',
+            self.course_id,
+            self.block_id,
+            {
+                'key': key,
+                'path': self._archive_storage_path(key),
+                'members': files,
+                'selection': selection_key(student_ids),
+            },
+            key=key,
+        )
+        return Response(json_body=self.job_summary(job))
+
+    @XBlock.handler
+    def get_job_status(self, request, suffix=''):
+        """
+        Returns the status of one of this block's background jobs.
+        """
+        require(self.is_course_staff())
+        try:
+            job_id = uuid.UUID(request.params.get('job_id'))
+        except (TypeError, ValueError):
+            job_id = None
+        job = Job.objects.filter(
+            job_id=job_id,
+            item_id=unicode(self.block_id),
+        ).first() if job_id else None
+        if job is None:
+            return Response(status=404, json_body={'error': 'Unknown job.'})
+        return Response(json_body=self.job_summary(job))
+
+    def job_summary(self, job):
+        """
+        Returns the status of a job, with the URL of the archive it built.
+        """
+        status = job_status(job)
+        if job.status == Job.DONE and 'path' in status['result']:
+            status['zip_url'] = default_storage.url(status['result']['path'])
+        return status
 
-    def set_submission_status_to_downloaded(self, student_id):
-        submissions_api.set_as_downloaded(self.student_submission_id(student_id), self.user)
+    @memoize
+    def get_submission_download_status(self, student_id, user=None):
+        """
+        Whether `user`, the current user by default, downloaded the latest
+        submission of a student.
+        """
+        submission = self.get_submission(student_id)
+        if not submission:
+            return False
+        return bool(self.get_downloaded([submission['uuid']], user))
+
+    def get_downloaded(self, submission_uuids, user=None):
+        """
+        Returns the set of the given submissions that `user`, the current
+        user by default, downloaded, read with one query.
+        """
+        submission_uuids = set(submission_uuids)
+        if not submission_uuids:
+            return set()
+        downloads = GraderDownload.objects.filter(
+            item_id=unicode(self.block_id),
+            grader_id=user.id if user else self.xmodule_runtime.user_id,
+        )
+        if len(submission_uuids) <= MAX_IN_CLAUSE:
+            downloads = downloads.filter(submission_uuid__in=submission_uuids)
+        return submission_uuids.intersection(
+            downloads.values_list('submission_uuid', flat=True))
+
+    def set_submissions_status_to_downloaded(self, submission_uuids, user=None):
+        """
+        Marks submissions as downloaded by `user`, the current user by
+        default.  The ones that weren't yet are recorded with a single
+        insert, and returned.
+        """
+        submission_uuids = set(submission_uuids)
+        grader_id = user.id if user else self.xmodule_runtime.user_id
+        new = submission_uuids - self.get_downloaded(submission_uuids, user)
+        if not new:
+            return new
+        try:
+            with transaction.atomic():
+                GraderDownload.objects.bulk_create([
+                    GraderDownload(
+                        item_id=unicode(self.block_id),
+                        submission_uuid=submission_uuid,
+                        grader_id=grader_id,
+                    )
+                    for submission_uuid in new
+                ])
+        except IntegrityError:
+            # The same grader downloaded some of them at the same time
+            for submission_uuid in new:
+                GraderDownload.objects.get_or_create(
+                    submission_uuid=submission_uuid,
+                    grader_id=grader_id,
+                    defaults={'item_id': unicode(self.block_id)},
+                )
+        self.clear_memoized()
+        return new
+
+    def record_downloads(self, submission_uuids):
+        """
+        Records that staff downloaded the given submissions and counts the
+        ones that hadn't been downloaded before.
+        """
+        submission_uuids = set(submission_uuids)
+        if not submission_uuids:
+            return
+        recorded = set(DownloadedSubmission.objects.filter(
+            submission_uuid__in=submission_uuids,
+        ).values_list('submission_uuid', flat=True))
+        new = submission_uuids - recorded
+        if not new:
+            return
+        try:
+            with transaction.atomic():
+                DownloadedSubmission.objects.bulk_create([
+                    DownloadedSubmission(
+                        item_id=unicode(self.block_id),
+                        submission_uuid=submission_uuid,
+                    )
+                    for submission_uuid in new
+                ])
+            created = len(new)
+        except IntegrityError:
+            # Someone else downloaded some of them at the same time
+            created = sum(
+                DownloadedSubmission.objects.get_or_create(
+                    submission_uuid=submission_uuid,
+                    defaults={'item_id': unicode(self.block_id)},
+                )[1]
+                for submission_uuid in new
+            )
+        self.bump_grading_summary(downloaded=created)
+        self.grading_snapshot_changed()
+
+    def bump_grading_summary(self, submitted=0, graded=0, downloaded=0):
+        """
+        Adds to the counters of the grading summary.  A block that doesn't
+        have a summary yet gets one built from its submissions, which
+        already include the change.
+        """
+        if not (submitted or graded or downloaded):
+            return
+        updated = GradingSummary.objects.filter(
+            item_id=unicode(self.block_id),
+        ).update(
+            submitted=F('submitted') + submitted,
+            graded=F('graded') + graded,
+            downloaded=F('downloaded') + downloaded,
+        )
+        if not updated:
+            self.rebuild_grading_summary()
+
+    def rebuild_grading_summary(self):
+        """
+        Counts the submitted, graded and downloaded submissions from scratch
+        and saves them as the block's grading summary.
+        """
+        submissions = self.get_latest_submissions()
+        submitted = set(
+            submission['uuid'] for submission in submissions.values()
+            if _has_file(submission)
+        )
+        downloads = DownloadedSubmission.objects.filter(
+            item_id=unicode(self.block_id))
+        if len(submitted) <= MAX_IN_CLAUSE:
+            downloads = downloads.filter(submission_uuid__in=submitted)
+        downloaded = submitted.intersection(
+            downloads.values_list('submission_uuid', flat=True))
+        scores = self.get_scores()
+        summary, _ = GradingSummary.objects.update_or_create(
+            item_id=unicode(self.block_id),
+            defaults={
+                'course_id': unicode(self.course_id),
+                'submitted': len(submitted),
+                'graded': len(scores),
+                'downloaded': len(downloaded),
+            },
+        )
+        self.rebuild_grading_queue(submissions, scores)
+        return summary
+
+    def queue_for_grading(self, student_id, submission_uuid, submitted_at=None):
+        """
+        Puts a learner's submission in the grading queue, in place of the one
+        they had there.
+        """
+        GradingQueueEntry.objects.update_or_create(
+            item_id=unicode(self.block_id),
+            student_id=student_id,
+            defaults={
+                'course_id': unicode(self.course_id),
+                'submission_uuid': submission_uuid,
+                'submitted_at': submitted_at or _now(),
+                'claimed_by': None,
+                'lease_expires': None,
+            },
+        )
+
+    def dequeue_graded(self, student_ids):
+        """
+        Takes graded learners out of the grading queue, which also ends the
+        leases on their submissions.
+        """
+        student_ids = list(student_ids)
+        for start in range(0, len(student_ids), MAX_IN_CLAUSE):
+            GradingQueueEntry.objects.filter(
+                item_id=unicode(self.block_id),
+                student_id__in=student_ids[start:start + MAX_IN_CLAUSE],
+            ).delete()
+
+    def rebuild_grading_queue(self, submissions, scores):
+        """
+        Makes the grading queue hold the latest submission of every learner
+        who submitted a file and wasn't graded, from their latest
+        `submissions` and their `scores`.  Leases on submissions still
+        waiting are kept.
+        """
+        waiting = {
+            student_id: submission
+            for student_id, submission in submissions.items()
+            if _has_file(submission) and student_id not in scores
+        }
+        queued = dict(GradingQueueEntry.objects.filter(
+            item_id=unicode(self.block_id),
+        ).values_list('student_id', 'submission_uuid'))
+        self.dequeue_graded(
+            student_id for student_id, submission_uuid in queued.items()
+            if student_id not in waiting or
+            waiting[student_id]['uuid'] != submission_uuid
+        )
+        missing = [
+            GradingQueueEntry(
+                course_id=unicode(self.course_id),
+                item_id=unicode(self.block_id),
+                student_id=student_id,
+                submission_uuid=submission['uuid'],
+                submitted_at=submission['submitted_at'],
+            )
+            for student_id, submission in waiting.items()
+            if queued.get(student_id) != submission['uuid']
+        ]
+        try:
+            with transaction.atomic():
+                GradingQueueEntry.objects.bulk_create(missing, batch_size=500)
+        except IntegrityError:
+            # Learners submitted while the queue was rebuilt, and queued
+            # their submissions themselves
+            pass
+
+    def claim_grading_queue_entry(self, grader_id):
+        """
+        Leases one of the oldest submissions in the grading queue that nobody
+        holds, or whose lease expired, to `grader_id`, and returns its entry.
+        A grader holding a lease gets the same entry back, with the lease
+        renewed.  Returns None when nothing is waiting.
+
+        Nothing is locked: an entry is claimed by an update conditional on
+        the lease it was read with, which only one grader can win.  Graders
+        pick at random among the oldest candidates, so they rarely race for
+        the same one.
+        """
+        now = _now()
+        lease_expires = now + datetime.timedelta(
+            seconds=getattr(settings, 'SGA_GRADING_LEASE', GRADING_LEASE))
+        queue = GradingQueueEntry.objects.filter(item_id=unicode(self.block_id))
+        held = queue.filter(claimed_by=grader_id, lease_expires__gt=now)
+        held_ids = list(held.values_list('id', flat=True)[:1])
+        if held_ids and queue.filter(
+                id=held_ids[0], claimed_by=grader_id).update(
+                    lease_expires=lease_expires):
+            return queue.filter(id=held_ids[0]).first()
+
+        available = queue.filter(
+            Q(lease_expires__isnull=True) | Q(lease_expires__lte=now),
+        ).order_by('submitted_at', 'id')
+        while True:
+            candidates = list(available.values_list(
+                'id', 'lease_expires')[:CLAIM_CANDIDATES])
+            if not candidates:
+                return None
+            random.shuffle(candidates)
+            for entry_id, previous_lease in candidates:
+                if queue.filter(id=entry_id, lease_expires=previous_lease).update(
+                        claimed_by=grader_id, lease_expires=lease_expires):
+                    return queue.filter(id=entry_id).first()
+
+    @XBlock.handler
+    def get_grading_summary(self, request, suffix=''):
+        """
+        Returns how many learners submitted a file, were graded and are
+        waiting for their submission to be downloaded.
+        """
+        require(self.is_course_staff())
+        summary = GradingSummary.objects.filter(
+            item_id=unicode(self.block_id)).first()
+        if summary is None:
+            summary = self.rebuild_grading_summary()
+        return Response(json_body={
+            'submitted': summary.submitted,
+            'graded': summary.graded,
+            'downloaded': summary.downloaded,
+            'not_downloaded': summary.submitted - summary.downloaded,
+        })
 
     @XBlock.handler
     def get_staff_grading_data(self, request, suffix=''):
+        """
+        Returns a window of the staff grading table.  Accepts `cursor`,
+        `page_size`, `sort` (one of GRADING_SORT_KEYS, prefixed with '-' for
+        descending order), `submitted_only`, `ungraded_only` and `search`.
+        Windows are cached and tagged with an ETag, and clients sending it
+        back in If-None-Match get a 304 while the window is unchanged.
+
+        With `format=ndjson` the window is streamed instead as newline
+        delimited JSON: the page without its rows on the first line, then
+        one row per line as they are built.
+        """
         require(self.is_course_staff())
-        return Response(json_body=self.staff_grading_data())
+        params = request.params
+        stream = params.get('format', 'json') == 'ndjson'
+        sort = params.get('sort', 'username')
+        descending = sort.startswith('-')
+        sort = sort.lstrip('-')
+        try:
+            cursor = int(params.get('cursor', 0))
+            page_size = int(params.get('page_size', DEFAULT_PAGE_SIZE))
+        except ValueError:
+            return Response(
+                status=400, json_body={'error': 'Invalid cursor or page size.'})
+        max_page_size = MAX_STREAM_PAGE_SIZE if stream else MAX_PAGE_SIZE
+        if cursor < 0 or not 0 < page_size <= max_page_size:
+            return Response(
+                status=400, json_body={'error': 'Invalid cursor or page size.'})
+        if sort not in GRADING_SORT_KEYS:
+            return Response(
+                status=400, json_body={'error': 'Invalid sort key.'})
+        query = {
+            'cursor': cursor,
+            'page_size': page_size,
+            'sort': sort,
+            'descending': descending,
+            'submitted_only': _is_true(params.get('submitted_only')),
+            'ungraded_only': _is_true(params.get('ungraded_only')),
+            'search': params.get('search', '').strip(),
+        }
+        if stream:
+            return Response(
+                app_iter=(
+                    json.dumps(item) + '\n'
+                    for item in self.iter_staff_grading_page(**query)
+                ),
+                content_type=EXPORT_FORMATS['ndjson'],
+                cache_control='private, no-cache',
+            )
+        response = Response(json_body=self.cached_staff_grading_page(**query))
+        etag = '"{}"'.format(hashlib.sha1(response.body).hexdigest())
+        response.headers['ETag'] = etag
+        response.headers['Cache-Control'] = 'private, no-cache'
+        if etag_matches(request.headers.get('If-None-Match'), etag):
+            response.status = 304
+            response.body = ''
+            del response.content_type
+        return response
+
+    @XBlock.handler
+    def get_staff_grading_changes(self, request, suffix=''):
+        """
+        Returns the rows that changed since the table version given in
+        `version`, or asks the client to reload when too much changed or
+        changes since its version were deleted.
+        """
+        require(self.is_course_staff())
+        try:
+            version = int(request.params.get('version', 0))
+        except ValueError:
+            return Response(status=400, json_body={'error': 'Invalid version.'})
+        oldest = GradingChange.objects.filter(
+            item_id=unicode(self.block_id),
+        ).order_by('id').values_list('id', 'created').first()
+        changes = list(GradingChange.objects.filter(
+            item_id=unicode(self.block_id),
+            id__gt=version,
+        ).order_by('id').values_list('id', 'student_id')[:MAX_PAGE_SIZE + 1])
+        # Versions handed out are never older than the block's oldest kept
+        # change, unless it was left behind by `delete_old_grading_changes`
+        stale = (
+            oldest is not None and version < oldest[0] and
+            oldest[1] < _grading_change_cutoff()
+        )
+        if stale or len(changes) > MAX_PAGE_SIZE:
+            return Response(json_body={
+                'reload': True,
+                'version': self.grading_table_version(),
+            })
+        return Response(json_body={
+            'reload': False,
+            'rows': self.get_grading_rows_for(
+                set(student_id for _, student_id in changes)
+            ) if changes else [],
+            'version': changes[-1][0] if changes else version,
+        })
+
+    @XBlock.handler
+    def claim_next_submission(self, request, suffix=''):
+        """
+        Leases the next ungraded submission to the current grader, until it
+        is graded or the lease expires, and returns its row of the staff
+        grading table.  Returns no row when nothing is waiting.
+        """
+        require(self.is_course_staff())
+        if not GradingSummary.objects.filter(
+                item_id=unicode(self.block_id)).exists():
+            # The queue is built along with the summary
+            self.rebuild_grading_summary()
+        entry = self.claim_grading_queue_entry(self.xmodule_runtime.user_id)
+        if entry is None:
+            return Response(json_body={'row': None})
+        rows = self.get_grading_rows_for([entry.student_id])
+        return Response(json_body={
+            'row': rows[0] if rows else None,
+            'lease_expires': entry.lease_expires.isoformat(),
+        })
+
+    @XBlock.handler
+    def get_course_ungraded_work(self, request, suffix=''):
+        """
+        Returns the learners waiting for a grade in each SGA block of the
+        course, and a window of the learners waiting for one, longest first.
+        Accepts `cursor` and `page_size`.
+        """
+        require(self.is_course_staff())
+        try:
+            cursor = int(request.params.get('cursor', 0))
+            page_size = int(request.params.get('page_size', DEFAULT_PAGE_SIZE))
+        except ValueError:
+            return Response(
+                status=400, json_body={'error': 'Invalid cursor or page size.'})
+        if cursor < 0 or not 0 < page_size <= MAX_PAGE_SIZE:
+            return Response(
+                status=400, json_body={'error': 'Invalid cursor or page size.'})
+        blocks = modulestore().get_items(
+            self.course_id, qualifiers={'category': 'edx_sga'})
+        return Response(json_body=course_ungraded_work(
+            self.course_id, blocks, cursor=cursor, page_size=page_size))
 
     def validate_score_message(self, course_id, username):
         log.error(
@@ -518,7 +1670,69 @@ class StaffGradedAssignmentXBlock(XBlock):
             "mimetype": None,
         }
         student_item_dict = self.student_submission_id(student_id)
-        return submissions_api.create_submission(student_item_dict, answer)
+        submission = submissions_api.create_submission(student_item_dict, answer)
+        self.clear_memoized()
+        return submission
+
+    def create_empty_submissions(self, student_ids):
+        """
+        Creates empty submissions, like `create_empty_submission`, for many
+        learners who have none, with one insert for their student items and
+        one for the submissions.  Returns them by student id.
+        """
+        student_ids = list(student_ids)
+        if not student_ids:
+            return {}
+        items = {
+            item.student_id: item
+            for item in self.student_items().filter(student_id__in=student_ids)
+        }
+        missing = [
+            SubmissionsStudent(
+                course_id=unicode(self.course_id),
+                item_id=unicode(self.block_id),
+                item_type='sga',
+                student_id=student_id,
+            )
+            for student_id in student_ids if student_id not in items
+        ]
+        if missing:
+            try:
+                with transaction.atomic():
+                    SubmissionsStudent.objects.bulk_create(missing)
+            except IntegrityError:
+                # Some were created concurrently
+                for item in missing:
+                    SubmissionsStudent.objects.get_or_create(
+                        course_id=item.course_id,
+                        item_id=item.item_id,
+                        item_type=item.item_type,
+                        student_id=item.student_id,
+                    )
+            items = {
+                item.student_id: item
+                for item in self.student_items().filter(
+                    student_id__in=student_ids)
+            }
+        answer = json.dumps({
+            "sha1": None,
+            "filename": None,
+            "mimetype": None,
+        })
+        submissions = [
+            Submission(
+                student_item=items[student_id],
+                attempt_number=1,
+                raw_answer=answer,
+            )
+            for student_id in student_ids
+        ]
+        Submission.objects.bulk_create(submissions)
+        self.clear_memoized()
+        return {
+            student_id: {'uuid': unicode(submission.uuid)}
+            for student_id, submission in zip(student_ids, submissions)
+        }
 
     def create_empty_student_module(self, student):
         return StudentModule.objects.create(
@@ -583,18 +1797,32 @@ class StaffGradedAssignmentXBlock(XBlock):
                     module.student.username
                 )
             )
+        student_id = anonymous_id_for_user(module.student, self.course_id)
+        graded = self.get_score(student_id) is not None
         submissions_api.set_score(uuid, score, self.max_score())
+        self.clear_memoized()
+        if not graded:
+            self.bump_grading_summary(graded=1)
+        self.dequeue_graded([student_id])
         state['comment'] = request.params.get('comment', '')
         module.state = json.dumps(state)
         module.save()
 
-        return Response(json_body=self.staff_grading_data())
+        return self.grading_row_response(student_id)
 
     @XBlock.handler
     def remove_grade(self, request, suffix=''):
         require(self.is_course_staff())
         student_id = request.params['student_id']
+        graded = self.get_score(student_id) is not None
         submissions_api.reset_score(student_id, unicode(self.course_id), unicode(self.block_id))
+        self.clear_memoized()
+        if graded:
+            self.bump_grading_summary(graded=-1)
+        submission = self.get_submission(student_id)
+        if _has_file(submission):
+            self.queue_for_grading(
+                student_id, submission['uuid'], submission['submitted_at'])
         module = StudentModule.objects.get(pk=request.params['module_id'])
         state = json.loads(module.state)
         state['comment'] = ''
@@ -604,9 +1832,161 @@ class StaffGradedAssignmentXBlock(XBlock):
         state['annotated_timestamp'] = None
         module.state = json.dumps(state)
         module.save()
-        return Response(json_body=self.staff_grading_data())
+        return self.grading_row_response(student_id)
 
-    @property
+    @XBlock.handler
+    def import_grades(self, request, suffix=''):
+        """
+        Grades many learners at once from an uploaded CSV file.  The file has
+        a header row with a `username` or `student_id` (anonymous id) column,
+        a `score` column and an optional `comment` column.  Every row is
+        validated before anything is written, and the grades are applied in
+        batches.  Returns a report with the outcome of each row.
+        """
+        require(self.is_course_staff())
+        upload = request.params['grades']
+        try:
+            rows = self.validate_grade_rows(_read_csv(upload.file))
+        except ValueError as error:
+            return Response(status=400, json_body={'error': unicode(error)})
+        if any(row['error'] for row in rows):
+            return Response(status=400, json_body={
+                'error': 'No grades were imported, please fix the rows with errors.',
+                'rows': [_grade_report(row) for row in rows],
+            })
+        self.apply_grade_rows(rows)
+        return Response(json_body={
+            'imported': len(rows),
+            'rows': [_grade_report(row) for row in rows],
+            'version': self.grading_table_version(),
+        })
+
+    @XBlock.handler
+    def export_grades(self, request, suffix=''):
+        """
+        Streams the grades of every enrolled learner as CSV, or as newline
+        delimited JSON with `format=ndjson`.
+        """
+        require(self.is_course_staff())
+        export_format = request.params.get('format', 'csv')
+        if export_format not in EXPORT_FORMATS:
+            return Response(status=400, json_body={
+                'error': 'Unknown export format: {}'.format(export_format)})
+        return Response(
+            app_iter=iter_export(iter_grade_records(self), export_format),
+            content_type=EXPORT_FORMATS[export_format],
+            content_disposition="attachment; filename=grades." + export_format)
+
+    def validate_grade_rows(self, records):
+        """
+        Resolves and validates the learners, scores and comments of imported
+        grade records.  Returns one dict per record with an 'error' message
+        for the ones that can't be applied.
+        """
+        records = list(records)
+        if not records:
+            raise ValueError('The file has no grades.')
+        columns = set(records[0])
+        if 'score' not in columns or not columns & {'username', 'student_id'}:
+            raise ValueError(
+                'The file needs a header row with a username or student_id '
+                'column and a score column.')
+
+        usernames = set(record.get('username') for record in records) - {None, ''}
+        users_by_username = {
+            user.username: user
+            for user in self.get_enrolled_students().filter(username__in=usernames)
+        }
+        anonymous_ids = self.get_anonymous_ids(
+            user.id for user in users_by_username.values())
+        users_by_student_id = {
+            anonymous_ids[user.id]: user for user in users_by_username.values()
+        }
+        student_ids = set(
+            record.get('student_id') for record in records) - {None, ''}
+        unknown_ids = student_ids - set(users_by_student_id)
+        if unknown_ids:
+            for anonymous_id in AnonymousUserId.objects.filter(
+                    course_id=self.course_id,
+                    anonymous_user_id__in=unknown_ids,
+                    user__in=self.get_enrolled_students(),
+            ).select_related('user'):
+                users_by_student_id[anonymous_id.anonymous_user_id] = anonymous_id.user
+        submissions = self.get_latest_submissions(users_by_student_id.keys())
+        ungraded_allowed = self.past_due() or not self.has_due
+        max_score = self.max_score()
+
+        rows = []
+        seen = set()
+        for line, record in enumerate(records, 2):
+            row = {'line': line, 'error': None, 'comment': record.get('comment')}
+            rows.append(row)
+            username = record.get('username')
+            if username:
+                user = users_by_username.get(username)
+                student_id = anonymous_ids[user.id] if user else None
+            else:
+                student_id = record.get('student_id')
+                user = users_by_student_id.get(student_id)
+            row.update(user=user, student_id=student_id, username=username)
+            if user is None:
+                row['error'] = 'Unknown or unenrolled learner.'
+                continue
+            row['username'] = user.username
+            if student_id in seen:
+                row['error'] = 'The learner appears more than once.'
+                continue
+            seen.add(student_id)
+            try:
+                row['score'] = score = float(record.get('score') or '')
+            except ValueError:
+                row['error'] = 'The score is not a number.'
+                continue
+            if not 0 <= score <= max_score:
+                row['error'] = 'The score must be between 0 and {}.'.format(max_score)
+                continue
+            row['submission'] = submissions.get(student_id)
+            if row['submission'] is None and not ungraded_allowed:
+                row['error'] = 'The learner has no submission to grade.'
+        return rows
+
+    def apply_grade_rows(self, rows, batch_size=GRADE_BATCH_SIZE):
+        """
+        Writes validated grade rows `batch_size` at a time, each batch in a
+        transaction of its own so no lock is held for the whole import.
+        """
+        for start in range(0, len(rows), batch_size):
+            with transaction.atomic():
+                self._apply_grade_batch(rows[start:start + batch_size])
+
+    def _apply_grade_batch(self, rows):
+        """
+        Creates the missing submissions in bulk, sets the scores and updates
+        the comments of a batch of grade rows.  Scores are set one by one
+        through the submissions API, which tells the LMS grades about them.
+        """
+        max_score = self.max_score()
+        modules = self.get_student_modules(row['user'] for row in rows)
+        scores = self.get_scores([row['student_id'] for row in rows])
+        created = self.create_empty_submissions(
+            row['student_id'] for row in rows if row['submission'] is None)
+        states = {}
+        for row in rows:
+            submission = row['submission'] or created[row['student_id']]
+            submissions_api.set_score(submission['uuid'], row['score'], max_score)
+            if row['comment'] is not None:
+                module = modules[row['user'].id]
+                state = json.loads(module.state)
+                state['comment'] = row['comment']
+                states[module.id] = json.dumps(state)
+        self.clear_memoized()
+        self.bump_grading_summary(graded=sum(
+            1 for row in rows if row['student_id'] not in scores))
+        self.dequeue_graded(row['student_id'] for row in rows)
+        _update_module_states(states)
+        self.grading_rows_changed(row['student_id'] for row in rows)
+
+    @reify
     def user(self):
         return User.objects.get(id=self.xmodule_runtime.user_id)
 
@@ -620,12 +2000,16 @@ class StaffGradedAssignmentXBlock(XBlock):
         in_studio_preview = self.scope_ids.user_id is None
         return self.is_course_staff() and not in_studio_preview
 
+    @reify
+    def extended_due_date(self):
+        return get_extended_due_date(self)
+
     @property
     def has_due(self):
-        return True if get_extended_due_date(self) else False
+        return True if self.extended_due_date else False
 
     def past_due(self):
-        due = get_extended_due_date(self)
+        due = self.extended_due_date
         if due is not None:
             return _now() > due
         return False
@@ -644,21 +2028,154 @@ class StaffGradedAssignmentXBlock(XBlock):
         )
         return path
 
+    def _upload_parts_path(self, upload_id):
+        return (
+            '{loc.org}/{loc.course}/{loc.block_type}/{loc.block_id}'
+            '/uploads/{upload_id}'.format(
+                loc=self.location, upload_id=upload_id.hex)
+        )
+
+    def _archive_storage_path(self, key):
+        return (
+            '{loc.org}/{loc.course}/{loc.block_type}/{loc.block_id}'
+            '/archives/{key}.zip'.format(loc=self.location, key=key)
+        )
+
+
+def _read_csv(file):
+    """
+    Reads the records of an uploaded CSV file as dicts of unicode strings.
+    """
+    content = file.read()
+    if content.startswith(codecs.BOM_UTF8):
+        content = content[len(codecs.BOM_UTF8):]
+    try:
+        for record in csv.DictReader(content.splitlines()):
+            yield {
+                key.strip().decode('utf-8'): (value or '').strip().decode('utf-8')
+                for key, value in record.items() if key
+            }
+    except (csv.Error, UnicodeDecodeError) as error:
+        raise ValueError('Could not read the file: {}'.format(error))
+
+
+def _grade_report(row):
+    return {
+        'line': row['line'],
+        'username': row['username'],
+        'student_id': row['student_id'],
+        'score': row.get('score'),
+        'error': row['error'],
+    }
+
+
+def _update_module_states(states, batch_size=100):
+    """
+    Writes the state of many StudentModules, given as a dict of states by
+    primary key, with one UPDATE per batch.
+    """
+    module_ids = sorted(states)
+    for start in range(0, len(module_ids), batch_size):
+        batch = module_ids[start:start + batch_size]
+        StudentModule.objects.filter(pk__in=batch).update(
+            state=Case(
+                *[When(pk=module_id, then=Value(states[module_id]))
+                  for module_id in batch]
+            ),
+            modified=_now(),
+        )
+
 
-def _get_sha1(file):
-    sha1 = hashlib.sha1()
-    for block in iter(partial(file.read, BLOCK_SIZE), ''):
-        sha1.update(block)
+def delete_old_grading_changes(batch_size=1000):
+    """
+    Deletes the changes to staff grading tables older than
+    SGA_GRADING_CHANGE_RETENTION seconds, but the newest of each block: it
+    is the version clients get, and tells those with an older version that
+    they missed changes and must reload.  Returns how many were deleted.
+    """
+    old = GradingChange.objects.filter(created__lt=_grading_change_cutoff())
+    kept = set(old.values('item_id').annotate(
+        newest=Max('id')).values_list('newest', flat=True))
+    deleted = 0
+    for batch in iter_chunks(old.only('id'), batch_size):
+        deleted += GradingChange.objects.filter(id__in=[
+            change.id for change in batch if change.id not in kept
+        ]).delete()[0]
+    return deleted
+
+
+def _grading_change_cutoff():
+    return _now() - datetime.timedelta(seconds=getattr(
+        settings, 'SGA_GRADING_CHANGE_RETENTION', GRADING_CHANGE_RETENTION))
+
+
+def _chunk_offset(request):
+    """
+    Returns the offset of an uploaded chunk, from the `offset` parameter or
+    the Content-Range header jquery.fileupload sends, or None if it is
+    invalid.  A file sent in a single request has neither and starts at 0.
+    """
+    offset = request.params.get('offset')
+    if offset is None:
+        content_range = request.headers.get('Content-Range', '')
+        if not content_range:
+            return 0
+        # bytes <start>-<end>/<size>
+        offset = content_range.partition(' ')[2].partition('-')[0]
+    try:
+        offset = int(offset)
+    except ValueError:
+        return None
+    return offset if offset >= 0 else None
+
+
+def _file_size(file):
+    file.seek(0, os.SEEK_END)
+    size = file.tell()
     file.seek(0)
-    return sha1.hexdigest()
+    return size
+
+
+def _has_file(submission):
+    """
+    Returns True if the submission has a file, as opposed to the empty
+    submissions created when grading a learner who didn't submit anything.
+    """
+    return bool(submission and submission['answer']['filename'])
+
+
+def _is_true(value):
+    return value in ('1', 'true', 'True', 'on')
 
 
 def _resource(path):  # pragma: NO COVER
     """Handy helper for getting resources from our kit."""
+    return _cached('resource', path, _read_resource)
+
+
+def _read_resource(path):
     data = pkg_resources.resource_string(__name__, path)
     return data.decode("utf8")
 
 
+def _cached(kind, path, load):
+    """
+    Returns `load(path)`, loading it once per process.  Resources only change
+    when the package is upgraded, which restarts the process, unless
+    SGA_RESOURCE_CHECK_MTIME is set for development, in which case they are
+    loaded again whenever their file changes.
+    """
+    mtime = None
+    if getattr(settings, 'SGA_RESOURCE_CHECK_MTIME', False):
+        mtime = os.path.getmtime(
+            pkg_resources.resource_filename(__name__, path))
+    key = (kind, path)
+    cached = _RESOURCE_CACHE.get(key)
+    if cached is None or cached[0] != mtime:
+        cached = _RESOURCE_CACHE[key] = (mtime, load(path))
+    return cached[1]
+
+
 def _now():
     return datetime.datetime.utcnow().replace(tzinfo=pytz.utc)
 
@@ -675,8 +2192,8 @@ def render_template(template_path, context={}):  # pragma: NO COVER
     """
     Evaluate a template by resource path, applying the provided context
     """
-    template_str = load_resource(template_path)
-    template = Template(template_str)
+    template = _cached(
+        'template', template_path, lambda path: Template(load_resource(path)))
     return template.render(Context(context))
 
 
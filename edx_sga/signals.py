@@ -0,0 +1,17 @@
+"""
+Signal handlers keeping cached grading tables in step with enrollments.
+"""
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from student.models import CourseEnrollment
+
+from edx_sga.caching import bump_version, course_version_key
+
+
+@receiver(post_save, sender=CourseEnrollment)
+def enrollment_changed(sender, instance, **kwargs):  # pylint: disable=unused-argument
+    """
+    Learners who enroll or unenroll join or leave the grading tables of all
+    of the course's blocks.
+    """
+    bump_version(course_version_key(instance.course_id))
@@ -2,19 +2,36 @@
 function StaffGradedAssignmentXBlock(runtime, element, options) {
     function xblock($, _) {
         var annotatedUrl = runtime.handlerUrl(element, 'download_annotated');
+        var claimNextSubmissionUrl = runtime.handlerUrl(element, 'claim_next_submission');
         var downloadAllSubmissionsUrl = runtime.handlerUrl(element, 'download_all_submissions');
         var downloadSubmissionsUrl = runtime.handlerUrl(element, 'download_submissions');
         var downloadUrl = runtime.handlerUrl(element, 'download_assignment');
         var enterGradeUrl = runtime.handlerUrl(element, 'enter_grade');
         var getStaffGradingUrl = runtime.handlerUrl(element, 'get_staff_grading_data');
+        var exportGradesUrl = runtime.handlerUrl(element, 'export_grades');
+        var finalizeUploadUrl = runtime.handlerUrl(element, 'finalize_upload');
+        var getCourseUngradedWorkUrl = runtime.handlerUrl(element, 'get_course_ungraded_work');
+        var getGradingSummaryUrl = runtime.handlerUrl(element, 'get_grading_summary');
+        var getJobStatusUrl = runtime.handlerUrl(element, 'get_job_status');
+        var getStaffGradingChangesUrl = runtime.handlerUrl(element, 'get_staff_grading_changes');
+        var importGradesUrl = runtime.handlerUrl(element, 'import_grades');
+        var initUploadUrl = runtime.handlerUrl(element, 'init_upload');
+        var courseUngradedTemplate;
+        var gradingQuery = {cursor: 0, sort: 'username'};
+        var gradingRequest = 0;
+        var gradingRowTemplate;
+        var gradingShowAll = false;
+        var streamPageSize = 1000;
         var gradingTemplate;
+        var gradingVersion = 0;
+        var prepareDownloadSubmissionsUrl = runtime.handlerUrl(element, 'prepare_download_submissions');
         var removeGradeUrl = runtime.handlerUrl(element, 'remove_grade');
         var staffAnnotatedUrl = runtime.handlerUrl(element, 'staff_download_annotated');
         var staffDownloadUrl = runtime.handlerUrl(element, 'staff_download');
         var staffUploadUrl = runtime.handlerUrl(element, 'staff_upload_annotated');
         var template = _.template($(element).find("#sga-tmpl").text());
         var updateGradesPublishedUrl = runtime.handlerUrl(element, 'update_grades_published');
-        var uploadUrl = runtime.handlerUrl(element, 'upload_assignment');
+        var uploadChunkUrl = runtime.handlerUrl(element, 'upload_chunk');
 
         function render(state) {
             // Add download urls to template context
@@ -36,17 +53,44 @@ function StaffGradedAssignmentXBlock(runtime, element, options) {
                 });
             });
 
-            // Set up file upload
+            // Set up file upload, in chunks so an interrupted upload can be
+            // resumed by uploading the same file again
             $(content).find(".fileupload").fileupload({
-                url: uploadUrl,
+                url: uploadChunkUrl,
+                paramName: "chunk",
                 add: function(e, data) {
                     var do_upload = $(content).find(".upload").html('');
+                    var file = data.files[0];
                     $('<button/>')
-                        .text('Upload ' + data.files[0].name)
+                        .text('Upload ' + file.name)
                         .appendTo(do_upload)
                         .click(function() {
                             do_upload.text("Uploading...");
-                            data.submit();
+                            fileFingerprint(file).done(function(fingerprint) {
+                                $.post(initUploadUrl, {
+                                    filename: file.name,
+                                    size: file.size,
+                                    fingerprint: fingerprint
+                                })
+                                    .done(function(upload) {
+                                        data.formData = {upload_id: upload.upload_id};
+                                        data.maxChunkSize = upload.chunk_size;
+                                        data.uploadedBytes = upload.offset;
+                                        if (upload.offset > 0 && upload.offset >= file.size) {
+                                            finalizeUpload(upload.upload_id);
+                                        } else {
+                                            data.submit();
+                                        }
+                                    })
+                                    .fail(function(jqXHR) {
+                                        if (jqXHR.status == 413) {
+                                            state.error = "The file you are trying to upload is too large.";
+                                        } else {
+                                            state.error = "There was an error uploading your file.";
+                                        }
+                                        render(state);
+                                    });
+                            });
                         });
                 },
                 progressall: function(e, data) {
@@ -96,108 +140,451 @@ function StaffGradedAssignmentXBlock(runtime, element, options) {
                     }
                     else {
                         // The happy path, no errors
-                        render(data.result);
+                        finalizeUpload(data.formData.upload_id);
                     }
                 }
             });
-        }
 
-        function renderStaffGrading(data) {
-            if (data.hasOwnProperty('error')) {
-              gradeFormError(data['error']);
-            } else {
-              gradeFormError('');
-              $('.grade-modal', element).hide();
+            /* Identify a file by its modification time and a hash of its
+               first and last bytes, so an upload is only resumed with the
+               same file.  Browsers that can't hash get no fingerprint, and
+               their uploads start over */
+            function fileFingerprint(file) {
+                var deferred = $.Deferred();
+                var sample = 65536;
+                var blob = file;
+                var reader;
+                if (!window.crypto || !window.crypto.subtle || !window.FileReader) {
+                    return deferred.resolve('').promise();
+                }
+                if (file.size > 2 * sample) {
+                    blob = new Blob([file.slice(0, sample), file.slice(file.size - sample)]);
+                }
+                reader = new FileReader();
+                reader.onload = function() {
+                    window.crypto.subtle.digest('SHA-256', reader.result).then(function(digest) {
+                        var hex = Array.prototype.map.call(new Uint8Array(digest), function(byte) {
+                            return ('0' + byte.toString(16)).slice(-2);
+                        }).join('');
+                        deferred.resolve((file.lastModified || '') + ':' + hex);
+                    }, function() {
+                        deferred.resolve('');
+                    });
+                };
+                reader.onerror = function() {
+                    deferred.resolve('');
+                };
+                reader.readAsArrayBuffer(blob);
+                return deferred.promise();
+            }
+
+            /* Submit a file once all of its chunks are uploaded */
+            function finalizeUpload(uploadId) {
+                $.post(finalizeUploadUrl, {upload_id: uploadId})
+                    .done(function(data, textStatus, jqXHR) {
+                        if (jqXHR.status === 202) {
+                            // The chunks are still being put together
+                            setTimeout(function() {
+                                finalizeUpload(uploadId);
+                            }, 1000);
+                        } else {
+                            render(data);
+                        }
+                    })
+                    .fail(function() {
+                        state.error = "There was an error uploading your file.";
+                        render(state);
+                    });
             }
+        }
 
+        function renderStaffGrading(data) {
             if (data.display_name !== '') {
                 $('.sga-block .display_name', element).html(data.display_name);
             }
 
-            // Add download urls to template context
+            // Add download urls and the row template to template context
             data.downloadUrl = staffDownloadUrl;
             data.annotatedUrl = staffAnnotatedUrl;
+            data.rowTemplate = gradingRowTemplate;
+            gradingVersion = data.version;
 
             // Render template
             $(element).find("#grade-info")
                 .html(gradingTemplate(data))
                 .data(data);
+            renderGradingPager(data);
 
             // Map data to table rows
             data.assignments.map(function(assignment) {
-                $(element).find("#grade-info #row-" + assignment.student_id)
-                    .data(assignment);
+                setUpGradingRow(
+                    $(element).find("#grade-info #row-" + assignment.student_id),
+                    assignment);
             });
+            updateDownloadButtons();
+        }
+
+        /* Replace a row of the staff grading table with its updated data */
+        function patchGradingRow(assignment) {
+            var $row = $(element).find("#grade-info #row-" + assignment.student_id);
+            if ($row.length === 0) {
+                // The learner isn't on the page being shown
+                return;
+            }
+            var checked = $row.find(".submission-checkbox").prop("checked");
+            var context = _.extend(
+                {}, $(element).find("#grade-info").data(), {assignment: assignment});
+            var $newRow = $($.trim(gradingRowTemplate(context)));
+            $row.replaceWith($newRow);
+            $newRow.find(".submission-checkbox").prop("checked", checked);
+            setUpGradingRow($newRow, assignment);
+            updateDownloadButtons();
+        }
+
+        /* Attach data and events to a row of the staff grading table */
+        function setUpGradingRow($row, assignment) {
+            $row.data(assignment);
 
             // Set up grade entry modal
-            $(element).find(".enter-grade-button")
+            $row.find(".enter-grade-button")
                 .leanModal({closeButton: "#enter-grade-cancel"})
                 .on("click", handleGradeEntry);
 
             // Set up annotated file upload
-            $(element).find("#grade-info .fileupload").each(function() {
-                var row = $(this).parents("tr");
-                var url = staffUploadUrl + "?module_id=" + row.data("module_id");
-                $(this).fileupload({
-                    url: url,
-                    progressall: function(e, data) {
-                        var percent = parseInt(data.loaded / data.total * 100, 10);
-                        row.find(".upload").text("Uploading... " + percent + "%");
-                    },
-                    done: function(e, data) {
-                        // Add a time delay so user will notice upload finishing
-                        // for small files
-                        setTimeout(
-                            function() { renderStaffGrading(data.result); },
-                            3000)
-                    }
-                });
+            $row.find(".fileupload").fileupload({
+                url: staffUploadUrl + "?module_id=" + assignment.module_id,
+                progressall: function(e, data) {
+                    var percent = parseInt(data.loaded / data.total * 100, 10);
+                    $row.find(".upload").text("Uploading... " + percent + "%");
+                },
+                done: function(e, data) {
+                    // Add a time delay so user will notice upload finishing
+                    // for small files
+                    setTimeout(function() { gradingChanged(data.result); }, 3000);
+                }
             });
 
-            // Submission download variables
-            var $submissionFilenames = $(".submission-filename", element);
-            var $submissionCheckboxes = $(".submission-checkbox", element);
-            var $downloadSelectedSubmissionsButton = $(".download-selected-submissions", element);
-            var $downloadAllSubmissionsButton = $(".download-all-submissions", element);
-
-            // Set up events for submission download links, checkboxes and buttons
-            $submissionFilenames.off("click").on("click", function () {
+            // Set up events for submission download links and checkboxes
+            $row.find(".submission-filename").on("click", function () {
                 showSubmissionDownloadedCheckmark($(this));
             });
-            $submissionCheckboxes.on("change", function() {
-                if ($submissionCheckboxes.filter(":checked").length > 0) {
-                    $downloadSelectedSubmissionsButton.prop("disabled", false);
-                }
-                else {
-                    $downloadSelectedSubmissionsButton.prop("disabled", true);
-                }
-            });
-            $downloadSelectedSubmissionsButton.off("click").on("click", function() {
+            $row.find(".submission-checkbox").on("change", updateDownloadButtons);
+        }
+
+        /* Enable the download buttons according to the rows being shown */
+        function updateDownloadButtons() {
+            var $submissionCheckboxes = $(".submission-checkbox", element);
+            $(".download-selected-submissions", element).prop(
+                "disabled", $submissionCheckboxes.filter(":checked").length === 0);
+            // Enable "Download all submissions" button if there are any submissions
+            if ($submissionCheckboxes.length > 0) {
+                $(".download-all-submissions", element).prop("disabled", false);
+            }
+        }
+
+        /* Set up the buttons to download submissions as a zip file */
+        function setUpDownloadButtons() {
+            $(".download-selected-submissions", element).on("click", function() {
                 var student_ids = [];
-                $submissionCheckboxes.filter(":checked").each(function() {
+                $(".submission-checkbox:checked", element).each(function() {
                     var $submissionFilename = $(this).closest("tr").find(".submission-filename");
                     showSubmissionDownloadedCheckmark($submissionFilename);
                     student_ids.push($(this).val());
                 });
-                $.post(downloadSubmissionsUrl, JSON.stringify({"student_ids": student_ids})).done(function(data) {
-                    window.location = window.location.origin + data.zip_url;
-                });
+                // Stream the archive straight to the browser
+                window.location = downloadSubmissionsUrl + "?" + $.param(
+                    {stream: 1, student_id: student_ids}, true);
             });
-            $downloadAllSubmissionsButton.off("click").on("click", function() {
-                $submissionFilenames.each(function() {
+            $(".download-all-submissions", element).on("click", function() {
+                $(".submission-filename", element).each(function() {
                     showSubmissionDownloadedCheckmark($(this));
                 });
-                $.get(downloadAllSubmissionsUrl).done(function (data) {
-                    window.location = window.location.origin + data.zip_url;
+                $(this).prop("disabled", true);
+                $.post(prepareDownloadSubmissionsUrl, "{}").done(waitForArchive);
+            });
+        }
+
+        /* Set up the export and the upload of CSV files of grades */
+        function setUpGradeImport() {
+            var $report = $(".import-grades-report", element);
+            $(".export-grades", element).attr("href", exportGradesUrl);
+            $(".import-grades .fileupload", element).fileupload({
+                url: importGradesUrl,
+                add: function(e, data) {
+                    $report.empty().append($("<li>").text("Importing..."));
+                    data.submit();
+                },
+                done: function(e, data) {
+                    $report.empty().append($("<li>").text(
+                        data.result.imported + " grades imported."));
+                    loadStaffGrading();
+                },
+                fail: function(e, data) {
+                    var result = data.jqXHR.responseJSON || {};
+                    $report.empty().append($("<li>").text(
+                        result.error || "The grades could not be imported."));
+                    _.each(result.rows || [], function(row) {
+                        if (row.error) {
+                            $report.append($("<li>").text(
+                                "Line " + row.line + ": " + row.error));
+                        }
+                    });
+                }
+            });
+        }
+
+        /* Claim the next ungraded submission, so other graders skip it, and
+           show its row */
+        function claimNextSubmission() {
+            var $info = $(".grading-queue-info", element);
+            $.post(claimNextSubmissionUrl, "{}").done(function(data) {
+                if (!data.row) {
+                    $info.text("Nothing left to grade.");
+                    return;
+                }
+                $info.text(
+                    "Grading " + data.row.username + " until " +
+                    moment.utc(data.lease_expires).local().format('hh:mma'));
+                $(".grading-search", element).val(data.row.username);
+                gradingQuery.search = data.row.username;
+                gradingQuery.cursor = 0;
+                loadStaffGrading();
+            });
+        }
+
+        /* Show the work waiting for a grade in every SGA block of the course */
+        function loadCourseUngradedWork(cursor) {
+            $.get(getCourseUngradedWorkUrl, {cursor: cursor}).done(function(data) {
+                data.formatAge = function(seconds) {
+                    return seconds === null ? "" :
+                        moment.duration(seconds, "seconds").humanize();
+                };
+                var $info = $(".course-ungraded-info", element)
+                    .html(courseUngradedTemplate(data));
+                $info.find(".course-ungraded-previous")
+                    .prop("disabled", data.previous_cursor === null)
+                    .on("click", function() {
+                        loadCourseUngradedWork(data.previous_cursor);
+                    });
+                $info.find(".course-ungraded-next")
+                    .prop("disabled", data.next_cursor === null)
+                    .on("click", function() {
+                        loadCourseUngradedWork(data.next_cursor);
+                    });
+            });
+        }
+
+        /* Poll a job building an archive until it is done, then download it */
+        function waitForArchive(job) {
+            var $progress = $(".download-progress", element);
+            if (job.status === "done") {
+                $progress.text("");
+                $(".download-all-submissions", element).prop("disabled", false);
+                downloadZip(job.zip_url);
+            } else if (job.status === "failed") {
+                $progress.text("The archive could not be prepared.");
+                $(".download-all-submissions", element).prop("disabled", false);
+            } else {
+                var percent = job.total ? parseInt(job.progress / job.total * 100, 10) : 0;
+                $progress.text("Preparing archive... " + percent + "%");
+                setTimeout(function() {
+                    $.get(getJobStatusUrl, {job_id: job.job_id}).done(waitForArchive);
+                }, 2000);
+            }
+        }
+
+        /* Send the browser to a zip file, wherever storage keeps it */
+        function downloadZip(url) {
+            window.location = /^https?:\/\//.test(url) ? url : window.location.origin + url;
+        }
+
+        /* Patch the table with a row changed by one of our requests */
+        function gradingChanged(data) {
+            if (data.row) {
+                patchGradingRow(data.row);
+                loadGradingSummary();
+            }
+        }
+
+        /* Patch the table with the rows changed since it was last synced */
+        function syncStaffGrading() {
+            $.ajax({
+                url: getStaffGradingChangesUrl,
+                data: {version: gradingVersion},
+                success: function(data) {
+                    if (data.reload) {
+                        loadStaffGrading();
+                    } else {
+                        data.rows.map(patchGradingRow);
+                        gradingVersion = data.version;
+                    }
+                }
+            });
+        }
+
+        /* Show how many submissions are waiting to be downloaded and graded */
+        function loadGradingSummary() {
+            $.get(getGradingSummaryUrl).done(function(summary) {
+                $(".grading-summary", element).text(
+                    summary.submitted + " submitted / " +
+                    summary.graded + " graded / " +
+                    summary.not_downloaded + " not downloaded");
+            });
+        }
+
+        /* Fetch the current window of the staff grading table.  Pages are
+           fetched as cached JSON, unless all of the roster was asked for */
+        function loadStaffGrading() {
+            loadGradingSummary();
+            gradingRequest += 1;
+            if (gradingShowAll && window.fetch && window.ReadableStream && window.TextDecoder) {
+                streamStaffGrading(gradingRequest);
+            } else {
+                fetchStaffGrading();
+            }
+        }
+
+        function fetchStaffGrading() {
+            $.ajax({
+                url: getStaffGradingUrl,
+                data: gradingQuery,
+                success: renderStaffGrading
+            });
+        }
+
+        /* Fetch the whole roster, or windows as large as the server allows
+           of it, as newline delimited JSON and render the rows as they
+           arrive, so the first learners show up straight away */
+        function streamStaffGrading(request) {
+            var query = _.extend(
+                {}, gradingQuery, {format: 'ndjson', page_size: streamPageSize});
+            var decoder = new TextDecoder();
+            var buffer = '';
+            var data = null;
+
+            function handleLines(done) {
+                var lines = buffer.split('\n');
+                var rows = [];
+                buffer = done ? '' : lines.pop();
+                lines.forEach(function(line) {
+                    if (!line) {
+                        return;
+                    }
+                    var item = JSON.parse(line);
+                    if (data === null) {
+                        // The page comes first, without its rows
+                        data = item;
+                        data.assignments = [];
+                        renderStaffGrading(data);
+                    } else {
+                        rows.push(item);
+                    }
+                });
+                if (rows.length) {
+                    appendGradingRows(data, rows);
+                }
+            }
+
+            fetch(getStaffGradingUrl + '?' + $.param(query), {credentials: 'same-origin'})
+                .then(function(response) {
+                    var reader = response.body.getReader();
+                    function read() {
+                        return reader.read().then(function(result) {
+                            if (request !== gradingRequest) {
+                                // The query changed while this was loading
+                                reader.cancel();
+                                return;
+                            }
+                            if (result.value) {
+                                buffer += decoder.decode(result.value, {stream: true});
+                            }
+                            handleLines(result.done);
+                            if (!result.done) {
+                                return read();
+                            }
+                        });
+                    }
+                    if (!response.ok) {
+                        gradingShowAll = false;
+                        fetchStaffGrading();
+                        return;
+                    }
+                    return read();
                 });
+        }
+
+        /* Add streamed rows to the end of the staff grading table */
+        function appendGradingRows(data, rows) {
+            var context = $(element).find("#grade-info").data();
+            var $rows = rows.map(function(assignment) {
+                return $($.trim(gradingRowTemplate(
+                    _.extend({}, context, {assignment: assignment}))));
             });
+            $(element).find("#grade-info table").append($rows);
+            rows.forEach(function(assignment, index) {
+                setUpGradingRow($rows[index], assignment);
+                data.assignments.push(assignment);
+            });
+            renderGradingPager(data);
+            updateDownloadButtons();
+        }
 
-            // Enable "Download all submissions" button if there are any submissions
-            if ($submissionCheckboxes.length > 0) {
-                $downloadAllSubmissionsButton.prop("disabled", false);
+        /* Show the position in the roster and enable the paging buttons */
+        function renderGradingPager(data) {
+            var first = data.total ? data.cursor + 1 : 0;
+            var last = data.cursor + data.assignments.length;
+            $(".grading-page-info", element).text(
+                first + "-" + last + " of " + data.total);
+            $(".grading-previous", element)
+                .prop("disabled", data.previous_cursor === null)
+                .off("click").on("click", function() {
+                    gradingQuery.cursor = data.previous_cursor;
+                    loadStaffGrading();
+                });
+            $(".grading-next", element)
+                .prop("disabled", data.next_cursor === null)
+                .off("click").on("click", function() {
+                    gradingQuery.cursor = data.next_cursor;
+                    loadStaffGrading();
+                });
+            // Only offered when the roster doesn't fit in a page
+            $(".grading-show-all", element)
+                .toggle(!gradingShowAll && data.total > data.assignments.length)
+                .off("click").on("click", function() {
+                    gradingShowAll = true;
+                    gradingQuery.cursor = 0;
+                    loadStaffGrading();
+                });
+        }
+
+        /* Wire the sort and filter controls of the staff grading modal */
+        function setUpGradingControls() {
+            var searchTimeout;
+            function update() {
+                gradingQuery.cursor = 0;
+                gradingQuery.sort = $(".grading-sort", element).val();
+                gradingQuery.search = $(".grading-search", element).val();
+                gradingQuery.submitted_only = $(".grading-submitted-only", element).prop("checked");
+                gradingQuery.ungraded_only = $(".grading-ungraded-only", element).prop("checked");
+                loadStaffGrading();
+            }
+            $(".grading-sort, .grading-submitted-only, .grading-ungraded-only", element)
+                .on("change", update);
+            $(".grading-search", element).on("input", function() {
+                clearTimeout(searchTimeout);
+                searchTimeout = setTimeout(update, 300);
+            });
+        }
+
+        /* Handle the response of a grade change from the enter grade modal */
+        function gradeSaved(data) {
+            if (data.hasOwnProperty('error')) {
+                gradeFormError(data['error']);
+            } else {
+                gradeFormError('');
+                $('.grade-modal', element).hide();
+                gradingChanged(data);
             }
-            // Fix for "Download selected submissions" button when re-rendering SGA modal content
-            $submissionCheckboxes.trigger("change");
         }
 
         function showSubmissionDownloadedCheckmark($submissionFilename) {
@@ -245,7 +632,7 @@ function StaffGradedAssignmentXBlock(runtime, element, options) {
                     $.ajax({
                         url: enterGradeUrl,
                         data: form.serialize(),
-                        success: renderStaffGrading,
+                        success: gradeSaved,
                         error: function(error) {
                             if (error.responseJSON && error.responseJSON.error) {
                                 gradeFormError(error.responseJSON.error);
@@ -264,7 +651,7 @@ function StaffGradedAssignmentXBlock(runtime, element, options) {
                 if (row.data('score')) {
                   // if there is no grade then it is pointless to call api.
                   gradeFormError('');
-                  $.get(url).success(renderStaffGrading);
+                  $.get(url).success(gradeSaved);
                 } else {
                     gradeFormError('No grade to remove.');
                 }
@@ -300,14 +687,26 @@ function StaffGradedAssignmentXBlock(runtime, element, options) {
             if (is_staff) {
                 gradingTemplate = _.template(
                     $(element).find("#sga-grading-tmpl").text());
+                gradingRowTemplate = _.template(
+                    $(element).find("#sga-grading-row-tmpl").text());
+                setUpGradingControls();
+                setUpDownloadButtons();
+                setUpGradeImport();
+                courseUngradedTemplate = _.template(
+                    $(element).find("#sga-course-ungraded-tmpl").text());
+                $(".claim-next-submission", element).on("click", claimNextSubmission);
+                $(".load-course-ungraded", element).on("click", function() {
+                    loadCourseUngradedWork(0);
+                });
+                // Pick up grades entered by other staff while the table is open
+                setInterval(function() {
+                    if ($(element).find("#grade-info").is(":visible")) {
+                        syncStaffGrading();
+                    }
+                }, 30000);
                 block.find("#grade-submissions-button")
                     .leanModal()
-                    .on("click", function() {
-                        $.ajax({
-                            url: getStaffGradingUrl,
-                            success: renderStaffGrading
-                        });
-                    });
+                    .on("click", loadStaffGrading);
                 block.find("#staff-debug-info-button")
                     .leanModal();
             }
@@ -0,0 +1,14 @@
+"""
+Celery tasks for the Staff Graded Assignment XBlock.
+"""
+from celery import task
+
+from edx_sga.jobs import run_job
+
+
+@task(name='edx_sga.tasks.run_job')
+def run_job_task(job_id):
+    """
+    Runs an SGA job in a celery worker.
+    """
+    run_job(job_id)
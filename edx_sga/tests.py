@@ -1,23 +1,96 @@
+import csv
 import datetime
+import hashlib
 from ddt import ddt, data
 import json
 import mock
 import os
 import pkg_resources
 import pytz
+import re
+import shutil
 import tempfile
 import unittest
+import zipfile
+from collections import Counter, deque
+from StringIO import StringIO
 
 from courseware.models import StudentModule
 from django.contrib.auth.models import User
+from django.core.cache import caches
 from django.core.exceptions import PermissionDenied
 from django.core.files.storage import FileSystemStorage
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, override_settings
 from submissions import api as submissions_api
+from webob import Request
+from webob.multidict import MultiDict
 from submissions.models import StudentItem
-from student.models import anonymous_id_for_user, UserProfile
+from student.models import CourseEnrollment, anonymous_id_for_user, UserProfile
 from xblock.field_data import DictFieldData
 from opaque_keys.edx.locations import Location, SlashSeparatedCourseKey
 
+from edx_sga.models import (
+    GraderDownload, GradingChange, GradingSummary, Job, SubmissionArchive,
+    UploadSession)
+
+# Modules that read or write files through default_storage
+STORAGE_MODULES = (
+    'edx_sga.sga', 'edx_sga.archives', 'edx_sga.downloads', 'edx_sga.uploads')
+
+# Roster sizes handlers are run against by the query budget tests
+ROSTER_SIZES = (1, 4, 12)
+
+
+def query_fingerprint(sql):
+    """
+    Reduces a query to its shape, without the values it was run with.
+    """
+    sql = re.sub(r"'(?:[^']|'')*'", '?', sql)
+    sql = re.sub(r'\b\d+(?:\.\d+)?\b', '?', sql)
+    return re.sub(r'\(\s*\?(?:\s*,\s*\?)*\s*\)', '(...)', sql)
+
+
+def grade_learner(block, learner):
+    return block.enter_grade(mock.Mock(params={
+        'module_id': learner['module'].id,
+        'submission_id': learner['submission']['uuid'],
+        'grade': 9,
+        'comment': 'Good!'}))
+
+
+def import_roster_grades(block, learner):
+    """
+    Imports a grade for every learner up to `learner`.  Scores go through the
+    submissions API one by one, so the LMS grades hear of them, and aren't
+    counted: every other query must not depend on the number of rows.
+    """
+    count = int(learner['module'].student.username[len('learner'):]) + 1
+    grades = StringIO('username,score,comment\n' + ''.join(
+        'learner%d,5,Good!\n' % index for index in range(count)))
+    with mock.patch('edx_sga.sga.submissions_api.set_score') as set_score:
+        block.import_grades(mock.Mock(params={
+            'grades': mock.Mock(file=grades)}))
+    assert set_score.call_count == count
+
+
+# Handlers whose number of queries must not depend on the size of the roster
+QUERY_BUDGET_RUNS = {
+    'staff_grading_data': lambda block, learner: block.staff_grading_data(),
+    'get_staff_grading_data': lambda block, learner: block.get_staff_grading_data(
+        mock.Mock(params={}, headers={})),
+    'get_staff_grading_changes': lambda block, learner: (
+        block.get_staff_grading_changes(mock.Mock(params={'version': 0}))),
+    'get_submissions': lambda block, learner: block.get_files(
+        block.get_submissions()),
+    'get_grading_summary': lambda block, learner: block.get_grading_summary(
+        mock.Mock(params={})),
+    'enter_grade': grade_learner,
+    'export_grades': lambda block, learner: list(
+        block.export_grades(mock.Mock(params={})).app_iter),
+    'import_grades': import_roster_grades,
+}
+
 
 class DummyResource(object):
 
@@ -52,13 +125,25 @@ class StaffGradedAssignmentXblockTests(ModuleStoreTestCase):
             'foo/bar/baz'
         )
         self.runtime = mock.Mock(anonymous_student_id='MOCK')
+        self.runtime.user_id = User.objects.create(
+            username='grader', is_staff=True).id
         self.scope_ids = mock.Mock()
         tmp = tempfile.mkdtemp()
-        patcher = mock.patch(
-            "edx_sga.sga.default_storage",
-            FileSystemStorage(tmp))
-        patcher.start()
-        self.addCleanup(patcher.stop)
+        self.storage = FileSystemStorage(tmp)
+        self.addCleanup(shutil.rmtree, tmp, ignore_errors=True)
+        self.addCleanup(
+            shutil.rmtree, tmp + '.sga-uploads', ignore_errors=True)
+        for module in STORAGE_MODULES:
+            patcher = mock.patch(module + ".default_storage", self.storage)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        cache_settings = override_settings(CACHES={'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'edx_sga_tests',
+        }})
+        cache_settings.enable()
+        self.addCleanup(cache_settings.disable)
+        caches['default'].clear()
 
     def make_one(self, **kw):
         from edx_sga.sga import StaffGradedAssignmentXBlock as cls
@@ -120,6 +205,44 @@ class StaffGradedAssignmentXblockTests(ModuleStoreTestCase):
             'submission': submission,
         }
 
+    def assertQueryBudget(self, run, sizes=ROSTER_SIZES):
+        """
+        Runs `run(block, learner)` on a fresh block with rosters of each of
+        `sizes` and fails if larger rosters take more queries, listing the
+        queries that were added.
+        """
+        self.runtime.user_id = User.objects.create(
+            username='staff', is_staff=True).id
+        learners = []
+        captured = []
+        for size in sizes:
+            while len(learners) < size:
+                learner = self.make_student(
+                    self.make_one(), 'learner%d' % len(learners),
+                    filename='foo.txt')
+                CourseEnrollment.enroll(
+                    learner['module'].student, self.course_id)
+                learners.append(learner)
+            run(self.make_one(), learners[-1])
+            caches['default'].clear()
+            with CaptureQueriesContext(connection) as queries:
+                run(self.make_one(), learners[-1])
+            captured.append(Counter(
+                query_fingerprint(query['sql']) for query in queries))
+            caches['default'].clear()
+
+        smallest, largest = captured[0], captured[-1]
+        if sum(largest.values()) > sum(smallest.values()):
+            added = [
+                '{} x{}'.format(fingerprint, count - smallest[fingerprint])
+                for fingerprint, count in sorted(largest.items())
+                if count > smallest[fingerprint]
+            ]
+            self.fail('{} queries with {} learners, {} with {}:\n{}'.format(
+                sum(largest.values()), sizes[-1],
+                sum(smallest.values()), sizes[0],
+                '\n'.join(added)))
+
     def personalize(self, block, module, item, submission):
         student_module = StudentModule.objects.get(pk=module.id)
         state = json.loads(student_module.state)
@@ -248,6 +371,22 @@ class StaffGradedAssignmentXblockTests(ModuleStoreTestCase):
         fragment.initialize_js.assert_called_once_with(
             "StaffGradedAssignmentXBlock")
 
+    @mock.patch('edx_sga.sga._RESOURCE_CACHE', {})
+    def test_render_template_cached(self):
+        from edx_sga.sga import Template, render_template
+        with mock.patch('edx_sga.sga.Template', wraps=Template) as template:
+            first = render_template(
+                'templates/staff_graded_assignment/show.html', {})
+            second = render_template(
+                'templates/staff_graded_assignment/show.html', {})
+            self.assertEqual(first, second)
+            self.assertEqual(template.call_count, 1)
+            with override_settings(SGA_RESOURCE_CHECK_MTIME=True):
+                render_template('templates/staff_graded_assignment/show.html', {})
+                render_template('templates/staff_graded_assignment/show.html', {})
+            self.assertEqual(template.call_count, 2)
+
+    @override_settings(SGA_JOB_BACKEND='sync')
     def test_save_sga(self):
         orig_score = 23
         block = self.make_one()
@@ -277,6 +416,44 @@ class StaffGradedAssignmentXblockTests(ModuleStoreTestCase):
             "weight": 11})))
         self.assertEqual(block.points, orig_score)
 
+    @override_settings(SGA_JOB_BACKEND='sync')
+    def test_update_weight_rescores(self):
+        block = self.make_one(weight=10)
+        fred = self.make_student(block, "fred", filename="foo.txt", score=9)
+        barney = self.make_student(block, "barney", filename="bar.txt")
+        with mock.patch('edx_sga.rescoring.modulestore') as store:
+            store.return_value.get_item.return_value = block
+            block.update_weight(20)
+        self.assertEqual(block.get_score(fred['item'].student_id), 18)
+        self.assertEqual(block.get_score(barney['item'].student_id), None)
+        for student in (fred, barney):
+            module = StudentModule.objects.get(pk=student['module'].id)
+            self.assertEqual(module.max_grade, 20)
+        job = Job.objects.get(kind='rescore', item_id=block.block_id)
+        self.assertEqual(job.status, Job.DONE)
+        self.assertEqual(json.loads(job.result), {'rescored': 1})
+        self.assertEqual(
+            list(GradingChange.objects.filter(
+                item_id=block.block_id).values_list('student_id', flat=True)),
+            [fred['item'].student_id])
+
+    @override_settings(SGA_JOB_BACKEND='sync')
+    def test_update_weight_rescores_current_weight(self):
+        block = self.make_one(weight=10)
+        fred = self.make_student(block, "fred", filename="foo.txt", score=9)
+        with mock.patch('edx_sga.rescoring.modulestore') as store:
+            # The weight changes again while the job runs
+            store.return_value.get_item.side_effect = [
+                mock.Mock(max_score=mock.Mock(return_value=weight))
+                for weight in (20, 30, 30)
+            ]
+            block.update_weight(20)
+        self.assertEqual(block.get_score(fred['item'].student_id), 27)
+        module = StudentModule.objects.get(pk=fred['module'].id)
+        self.assertEqual(module.max_grade, 30)
+        job = Job.objects.get(kind='rescore', item_id=block.block_id)
+        self.assertEqual(json.loads(job.result), {'rescored': 1})
+
     def test_upload_download_assignment(self):
         path = pkg_resources.resource_filename(__package__, 'tests.py')
         expected = open(path, 'rb').read()
@@ -287,6 +464,143 @@ class StaffGradedAssignmentXblockTests(ModuleStoreTestCase):
         response = block.download_assignment(None)
         self.assertEqual(response.body, expected)
 
+    @override_settings(SGA_UPLOAD_CHUNK_SIZE=1000, SGA_JOB_BACKEND='sync')
+    def test_chunked_upload(self):
+        path = pkg_resources.resource_filename(__package__, 'tests.py')
+        expected = open(path, 'rb').read()
+        block = self.make_one()
+        self.personalize(block, **self.make_student(block, "fred"))
+        upload = block.init_upload(mock.Mock(params={
+            'filename': 'test.txt', 'size': str(len(expected)),
+            'fingerprint': '1:abc'})).json_body
+        self.assertEqual(upload['offset'], 0)
+        self.assertEqual(upload['chunk_size'], 1000)
+
+        def put(offset):
+            return block.upload_chunk(mock.Mock(headers={}, params={
+                'upload_id': upload['upload_id'],
+                'offset': str(offset),
+                'chunk': mock.Mock(file=StringIO(expected[offset:offset + 1000])),
+            }))
+        self.assertEqual(put(0).json_body['offset'], 1000)
+        response = put(2000)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json_body['offset'], 1000)
+        # nothing is stored past the size an upload was started with
+        small = block.init_upload(mock.Mock(params={
+            'filename': 'small.txt', 'size': '500',
+            'fingerprint': '3:ghi'})).json_body
+        response = block.upload_chunk(mock.Mock(headers={}, params={
+            'upload_id': small['upload_id'],
+            'offset': '0',
+            'chunk': mock.Mock(file=StringIO('x' * 1000)),
+        }))
+        self.assertEqual(response.status_code, 400)
+        UploadSession.objects.filter(upload_id=small['upload_id']).delete()
+
+        # a different file with the same name and size starts over
+        other = block.init_upload(mock.Mock(params={
+            'filename': 'test.txt', 'size': str(len(expected)),
+            'fingerprint': '2:def'})).json_body
+        self.assertEqual(other['offset'], 0)
+        self.assertNotEqual(other['upload_id'], upload['upload_id'])
+        UploadSession.objects.filter(upload_id=other['upload_id']).delete()
+
+        # an interrupted upload resumes where it stopped
+        upload = block.init_upload(mock.Mock(params={
+            'filename': 'test.txt', 'size': str(len(expected)),
+            'fingerprint': '1:abc'})).json_body
+        self.assertEqual(upload['offset'], 1000)
+        for offset in range(1000, len(expected), 1000):
+            put(offset)
+        # the chunks are put together in a job, which the client waits for
+        with mock.patch('edx_sga.jobs.run_job'):
+            response = block.finalize_upload(mock.Mock(params={
+                'upload_id': upload['upload_id']}))
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.json_body['status'], Job.PENDING)
+        Job.objects.filter(kind='assemble_upload').delete()
+        response = block.finalize_upload(mock.Mock(params={
+            'upload_id': upload['upload_id']}))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(block.get_submission()['answer']['sha1'],
+                         hashlib.sha1(expected).hexdigest())
+        response = block.download_assignment(None)
+        self.assertEqual(response.body, expected)
+        self.assertEqual(UploadSession.objects.count(), 0)
+
+    @override_settings(SGA_MAX_UPLOAD_SIZE=1000)
+    def test_upload_too_large(self):
+        block = self.make_one()
+        self.personalize(block, **self.make_student(block, "fred"))
+        response = block.init_upload(mock.Mock(params={
+            'filename': 'test.txt', 'size': '1001', 'fingerprint': '1:abc'}))
+        self.assertEqual(response.status_code, 413)
+        self.assertEqual(UploadSession.objects.count(), 0)
+        response = block.upload_assignment(mock.Mock(params={
+            'assignment': mock.Mock(file=StringIO('x' * 1001))}))
+        self.assertEqual(response.status_code, 413)
+        self.assertIsNone(block.get_submission())
+
+    @override_settings(SGA_UPLOAD_CHUNK_SIZE=1000)
+    def test_expired_upload(self):
+        from django.core.management import call_command
+        block = self.make_one()
+        self.personalize(block, **self.make_student(block, "fred"))
+        upload = block.init_upload(mock.Mock(params={
+            'filename': 'test.txt', 'size': '2000',
+            'fingerprint': '1:abc'})).json_body
+        block.upload_chunk(mock.Mock(headers={}, params={
+            'upload_id': upload['upload_id'],
+            'offset': '0',
+            'chunk': mock.Mock(file=StringIO('x' * 1000)),
+        }))
+        session = UploadSession.objects.get()
+        part, = json.loads(session.parts)
+        self.assertTrue(self.storage.exists(part))
+        UploadSession.objects.update(
+            modified=datetime.datetime.now(pytz.utc) - datetime.timedelta(days=2))
+
+        # expired uploads can't be resumed
+        response = block.upload_chunk(mock.Mock(headers={}, params={
+            'upload_id': upload['upload_id'],
+            'offset': '1000',
+            'chunk': mock.Mock(file=StringIO('x' * 1000)),
+        }))
+        self.assertEqual(response.status_code, 404)
+        call_command('sga_delete_expired_uploads', stdout=StringIO())
+        self.assertEqual(UploadSession.objects.count(), 0)
+        self.assertFalse(self.storage.exists(part))
+
+    def test_store_upload(self):
+        from edx_sga.uploads import store_upload, upload_temp_dir
+        path = pkg_resources.resource_filename(__package__, 'tests.py')
+        expected = open(path, 'rb').read()
+        temp_dir = upload_temp_dir()
+        self.assertFalse(temp_dir.startswith(self.storage.location + os.sep))
+        with override_settings(SGA_UPLOAD_BLOCK_SIZE=100):
+            sha1 = store_upload(
+                DummyUpload(path, 'test.txt'), lambda sha1: 'a/%s.txt' % sha1)
+        self.assertEqual(sha1, hashlib.sha1(expected).hexdigest())
+        self.assertEqual(self.storage.open('a/%s.txt' % sha1).read(), expected)
+        self.assertEqual(os.listdir(temp_dir), [])
+        # Readable by others, like files the storage creates itself
+        umask = os.umask(0)
+        os.umask(umask)
+        self.assertEqual(
+            os.stat(self.storage.path('a/%s.txt' % sha1)).st_mode & 0o777,
+            0o666 & ~umask)
+
+    def test_store_upload_remote(self):
+        from edx_sga.uploads import store_upload
+        path = pkg_resources.resource_filename(__package__, 'tests.py')
+        storage = mock.Mock(file_overwrite=True)
+        with mock.patch('edx_sga.uploads.default_storage', storage):
+            sha1 = store_upload(
+                DummyUpload(path, 'test.txt'), lambda sha1: 'a/%s.txt' % sha1)
+        self.assertFalse(storage.exists.called)
+        storage.save.assert_called_once_with('a/%s.txt' % sha1, mock.ANY)
+
     def test_staff_upload_download_annotated(self):
         path = pkg_resources.resource_filename(__package__, 'tests.py')
         expected = open(path, 'rb').read()
@@ -297,7 +611,7 @@ class StaffGradedAssignmentXblockTests(ModuleStoreTestCase):
             'annotated': upload,
             'module_id': fred.id}))
         response = block.staff_download_annotated(mock.Mock(params={
-            'module_id': fred.id}))
+            'module_id': fred.id}, headers={}))
         self.assertEqual(response.body, expected)
 
     def test_download_annotated(self):
@@ -321,15 +635,250 @@ class StaffGradedAssignmentXblockTests(ModuleStoreTestCase):
         student = self.make_student(block, 'fred')
         self.personalize(block, **student)
         block.upload_assignment(mock.Mock(params={'assignment': upload}))
+        student_id = student['item'].student_id
+        self.assertFalse(block.get_submission_download_status(student_id))
         response = block.staff_download(mock.Mock(params={
-            'student_id': student['item'].student_id}))
+            'student_id': student_id}, headers={}))
         self.assertEqual(response.body, expected)
+        self.assertTrue(block.get_submission_download_status(student_id))
+
+    def test_handlers_instrumented(self):
+        from edx_sga.instrumentation import get_sink
+        path = pkg_resources.resource_filename(__package__, 'tests.py')
+        expected = open(path, 'rb').read()
+        upload = mock.Mock(file=DummyUpload(path, 'test.txt'))
+        block = self.make_one()
+        self.personalize(block, **self.make_student(block, "fred"))
+        block.upload_assignment(mock.Mock(params={'assignment': upload}))
+        with override_settings(SGA_INSTRUMENTATION='memory'):
+            sink = get_sink()
+            del sink.records[:]
+            response = block.download_assignment(mock.Mock(headers={}))
+            self.assertEqual(sink.records, [])
+            self.assertEqual(response.body, expected)
+        measurement, = sink.records
+        self.assertEqual(measurement.name, 'download_assignment')
+        self.assertEqual(measurement.status, 200)
+        self.assertGreater(measurement.queries, 0)
+        self.assertEqual(measurement.storage_read, len(expected))
+        self.assertEqual(measurement.payload, len(expected))
+
+        # Handlers aren't measured while instrumentation is disabled
+        block.download_assignment(mock.Mock(headers={})).body
+        self.assertEqual(len(sink.records), 1)
+
+        # Queries are still counted once the connection's log is full
+        self.addCleanup(setattr, connection, 'queries_log', connection.queries_log)
+        connection.queries_log = deque(
+            [{'sql': '', 'time': '0.000'}] * 3, maxlen=3)
+        block.clear_memoized()
+        with override_settings(SGA_INSTRUMENTATION='memory'):
+            block.download_assignment(mock.Mock(headers={})).body
+        self.assertEqual(len(sink.records), 2)
+        self.assertGreater(sink.records[-1].queries, 0)
+
+    def test_download_validators(self):
+        path = pkg_resources.resource_filename(__package__, 'tests.py')
+        expected = open(path, 'rb').read()
+        upload = mock.Mock(file=DummyUpload(path, 'test.txt'))
+        block = self.make_one()
+        self.personalize(block, **self.make_student(block, "fred"))
+        block.upload_assignment(mock.Mock(params={'assignment': upload}))
+        response = block.download_assignment(mock.Mock(headers={}))
+        etag = response.headers['ETag']
+        self.assertEqual(etag, '"%s"' % hashlib.sha1(expected).hexdigest())
+        self.assertEqual(response.headers['Cache-Control'], 'private, no-cache')
+        self.assertEqual(response.content_length, len(expected))
+        response = block.download_assignment(mock.Mock(headers={
+            'If-None-Match': etag}))
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.body, '')
+
+    def test_download_offload(self):
+        path = pkg_resources.resource_filename(__package__, 'tests.py')
+        upload = mock.Mock(file=DummyUpload(path, 'test.txt'))
+        block = self.make_one()
+        self.personalize(block, **self.make_student(block, "fred"))
+        block.upload_assignment(mock.Mock(params={'assignment': upload}))
+        answer = block.get_submission()['answer']
+        stored_path = block._file_storage_path(answer['sha1'], answer['filename'])
+        with override_settings(SGA_DOWNLOAD_OFFLOAD='x-accel-redirect',
+                               SGA_DOWNLOAD_OFFLOAD_PREFIX='/protected/'):
+            response = block.download_assignment(mock.Mock(headers={}))
+        self.assertEqual(
+            response.headers['X-Accel-Redirect'], '/protected/' + stored_path)
+        self.assertEqual(response.body, '')
+        with override_settings(SGA_DOWNLOAD_OFFLOAD='x-sendfile'):
+            response = block.download_assignment(mock.Mock(headers={}))
+        self.assertEqual(
+            response.headers['X-Sendfile'], self.storage.path(stored_path))
+        # Local storage URLs can't name the file, so it is streamed
+        with override_settings(SGA_DOWNLOAD_OFFLOAD='redirect'):
+            response = block.download_assignment(mock.Mock(headers={}))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.body, open(path, 'rb').read())
+
+        def signed_url(name, expire=None, response_headers=None):
+            return 'https://bucket/{}?disposition={}'.format(
+                name, response_headers['response-content-disposition'])
+        with override_settings(SGA_DOWNLOAD_OFFLOAD='redirect'), \
+                mock.patch.object(self.storage, 'url', signed_url):
+            response = block.download_assignment(mock.Mock(headers={}))
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(
+            response.location,
+            'https://bucket/{}?disposition=attachment; filename=test.txt'.format(
+                stored_path))
+        self.assertNotIn('Content-Disposition', response.headers)
+
+    def test_download_ranges(self):
+        path = pkg_resources.resource_filename(__package__, 'tests.py')
+        expected = open(path, 'rb').read()
+        upload = mock.Mock(file=DummyUpload(path, 'test.txt'))
+        block = self.make_one()
+        self.personalize(block, **self.make_student(block, "fred"))
+        block.upload_assignment(mock.Mock(params={'assignment': upload}))
+        response = block.download_assignment(mock.Mock(headers={
+            'Range': 'bytes=10-19'}))
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.body, expected[10:20])
+        self.assertEqual(
+            response.headers['Content-Range'], 'bytes 10-19/%d' % len(expected))
+        response = block.download_assignment(mock.Mock(headers={
+            'Range': 'bytes=0-4,-5'}))
+        self.assertEqual(response.status_code, 206)
+        self.assertTrue(response.content_type.startswith('multipart/byteranges'))
+        self.assertEqual(len(response.body), response.content_length)
+        self.assertIn(expected[:5], response.body)
+        self.assertIn(expected[-5:], response.body)
+        response = block.download_assignment(mock.Mock(headers={
+            'Range': 'bytes=%d-' % len(expected)}))
+        self.assertEqual(response.status_code, 416)
+
+    def test_download_submissions_stream(self):
+        path = pkg_resources.resource_filename(__package__, 'tests.py')
+        expected = open(path, 'rb').read()
+        block = self.make_one()
+        student = self.make_student(block, 'fred')
+        self.personalize(block, **student)
+        block.upload_assignment(mock.Mock(params={
+            'assignment': mock.Mock(file=DummyUpload(path, 'test.txt'))}))
+        response = block.download_submissions(mock.Mock(
+            method='GET',
+            params=MultiDict([
+                ('stream', '1'),
+                ('student_id', student['item'].student_id),
+            ])))
+        self.assertEqual(response.content_type, 'application/zip')
+        archive = zipfile.ZipFile(StringIO(''.join(response.app_iter)))
+        self.assertEqual(
+            archive.read('student_submissions/fred-test.txt'), expected)
+
+    @override_settings(SGA_JOB_BACKEND='sync')
+    def test_prepare_download_submissions(self):
+        path = pkg_resources.resource_filename(__package__, 'tests.py')
+        expected = open(path, 'rb').read()
+        block = self.make_one()
+        student = self.make_student(block, 'fred')
+        self.personalize(block, **student)
+        block.upload_assignment(mock.Mock(params={
+            'assignment': mock.Mock(file=DummyUpload(path, 'test.txt'))}))
+        request = mock.Mock(body=json.dumps({
+            'student_ids': [student['item'].student_id]}))
+        data = block.prepare_download_submissions(request).json_body
+        self.assertEqual(data['status'], 'done')
+        self.assertEqual(data['progress'], 1)
+        status = block.get_job_status(mock.Mock(params={
+            'job_id': data['job_id']})).json_body
+        self.assertEqual(status['zip_url'], data['zip_url'])
+        archive = SubmissionArchive.objects.get()
+        with self.storage.open(archive.path) as archive_file:
+            zipped = zipfile.ZipFile(StringIO(archive_file.read()))
+        self.assertEqual(
+            zipped.read('student_submissions/fred-test.txt'), expected)
+
+        # The same submissions are served from the stored archive
+        data = block.prepare_download_submissions(request).json_body
+        self.assertEqual(data['job_id'], None)
+        self.assertEqual(data['status'], 'done')
+
+    @override_settings(SGA_JOB_BACKEND='sync')
+    @mock.patch('edx_sga.jobs.run_job')
+    def test_start_job_replaces_lost_job(self, run_job):
+        from edx_sga.jobs import start_job
+        job = start_job('submission_archive', self.course_id, 'XXX', {}, key='k')
+        self.assertEqual(
+            start_job('submission_archive', self.course_id, 'XXX', {}, key='k'),
+            job)
+        Job.objects.filter(pk=job.pk).update(
+            modified=datetime.datetime.now(pytz.utc) - datetime.timedelta(hours=1))
+        self.assertNotEqual(
+            start_job('submission_archive', self.course_id, 'XXX', {}, key='k'),
+            job)
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.FAILED)
+        self.assertEqual(run_job.call_count, 2)
+
+    @override_settings(SGA_JOB_BACKEND='sync')
+    def test_prepare_download_submissions_incremental(self):
+        path = pkg_resources.resource_filename(__package__, 'tests.py')
+        expected = open(path, 'rb').read()
+        block = self.make_one()
+        fred = self.make_student(block, 'fred')
+        barney = self.make_student(block, 'barney')
+        for student in (fred, barney):
+            self.personalize(block, **student)
+            block.upload_assignment(mock.Mock(params={
+                'assignment': mock.Mock(file=DummyUpload(path, 'test.txt'))}))
+        selected = block.prepare_download_submissions(mock.Mock(
+            body=json.dumps({'student_ids': [fred['item'].student_id]}),
+        )).json_body
+        first = block.prepare_download_submissions(mock.Mock(body='')).json_body
+        self.personalize(block, **barney)
+        block.upload_assignment(mock.Mock(params={
+            'assignment': mock.Mock(file=DummyUpload(path, 'test2.txt'))}))
+        data = block.prepare_download_submissions(mock.Mock(body='')).json_body
+        self.assertEqual(data['result']['copied'], 1)
+        self.assertEqual(data['result']['added'], 1)
+        # The new archive supersedes the first one of all students, but not
+        # the archive of the selected students
+        self.assertEqual(
+            sorted(SubmissionArchive.objects.values_list('path', flat=True)),
+            sorted([selected['result']['path'], data['result']['path']]))
+        self.assertFalse(self.storage.exists(first['result']['path']))
+        self.assertTrue(self.storage.exists(selected['result']['path']))
+        with self.storage.open(data['result']['path']) as archive_file:
+            zipped = zipfile.ZipFile(StringIO(archive_file.read()))
+        self.assertIsNone(zipped.testzip())
+        self.assertEqual(
+            zipped.read('student_submissions/fred-test.txt'), expected)
+        self.assertEqual(
+            zipped.read('student_submissions/barney-test2.txt'), expected)
+
+    def test_get_submissions_query_count(self):
+        block = self.make_one()
+        students = [self.make_student(block, 'barney', filename='foo.txt')]
+        with CaptureQueriesContext(connection) as one_student:
+            block.get_submissions([students[0]['item'].student_id])
+        for i in range(5):
+            students.append(
+                self.make_student(block, 'fred%d' % i, filename='bar.txt'))
+        with CaptureQueriesContext(connection) as six_students:
+            submissions = block.get_submissions(
+                [student['item'].student_id for student in students])
+        self.assertEqual(len(one_student), len(six_students))
+        self.assertEqual(
+            [submission['username'] for submission in submissions],
+            ['barney', 'fred0', 'fred1', 'fred2', 'fred3', 'fred4'])
+        self.assertEqual(
+            GraderDownload.objects.filter(
+                grader_id=self.runtime.user_id).count(), 6)
 
     def test_get_staff_grading_data_not_staff(self):
         self.runtime.user_is_staff = False
         block = self.make_one()
         with self.assertRaises(PermissionDenied):
-            block.get_staff_grading_data(None)
+            block.get_staff_grading_data(Request.blank('/'))
 
     def test_get_staff_grading_data(self):
         block = self.make_one()
@@ -342,7 +891,7 @@ class StaffGradedAssignmentXblockTests(ModuleStoreTestCase):
         fred = self.make_student(
             block, "fred",
             filename="bar.txt")['module']
-        data = block.get_staff_grading_data(None).json_body
+        data = block.get_staff_grading_data(Request.blank('/')).json_body
         assignments = sorted(data['assignments'], key=lambda x: x['username'])
         self.assertEqual(assignments[0]['module_id'], barney.id)
         self.assertEqual(assignments[0]['username'], 'barney')
@@ -360,6 +909,216 @@ class StaffGradedAssignmentXblockTests(ModuleStoreTestCase):
         self.assertEqual(assignments[1]['annotated'], None)
         self.assertEqual(assignments[1]['comment'], u'')
 
+    def test_staff_grading_data_query_count(self):
+        block = self.make_one()
+        self.make_student(block, "barney", filename="foo.txt", score=10)
+        block.staff_grading_data()
+        with CaptureQueriesContext(connection) as one_student:
+            block.staff_grading_data()
+        for i in range(5):
+            self.make_student(block, "fred%d" % i, filename="bar.txt")
+        block.staff_grading_data()
+        with CaptureQueriesContext(connection) as six_students:
+            data = block.staff_grading_data()
+        self.assertEqual(len(data['assignments']), 6)
+        self.assertEqual(len(one_student), len(six_students))
+
+    def test_get_student_modules_created_concurrently(self):
+        from django.db import IntegrityError
+        block = self.make_one()
+        fred = self.make_student(block, 'fred')['module']
+        barney = User.objects.create(username='barney')
+        # Another request creates barney's module while this one does
+        with mock.patch.object(StudentModule.objects, 'bulk_create',
+                               side_effect=IntegrityError):
+            modules = block.get_student_modules([fred.student, barney])
+        self.assertEqual(modules[fred.student_id].id, fred.id)
+        self.assertEqual(modules[barney.id].student_id, barney.id)
+        self.assertEqual(StudentModule.objects.filter(
+            student=barney, module_state_key=block.location).count(), 1)
+
+    @data(*sorted(QUERY_BUDGET_RUNS))
+    def test_query_budget(self, handler):
+        self.assertQueryBudget(QUERY_BUDGET_RUNS[handler])
+
+    def test_get_staff_grading_data_paginated(self):
+        block = self.make_one()
+        self.make_student(block, "barney", filename="foo.txt", score=10)
+        self.make_student(block, "fred", filename="bar.txt")
+        self.make_student(block, "wilma")
+        data = block.get_staff_grading_data(mock.Mock(headers={}, params={
+            'page_size': '2', 'sort': '-username'})).json_body
+        self.assertEqual(data['total'], 3)
+        self.assertEqual(data['next_cursor'], 2)
+        self.assertEqual(
+            [row['username'] for row in data['assignments']],
+            ['wilma', 'fred'])
+        data = block.get_staff_grading_data(mock.Mock(headers={}, params={
+            'page_size': '2', 'cursor': '2', 'sort': '-username'})).json_body
+        self.assertEqual(data['next_cursor'], None)
+        self.assertEqual(data['previous_cursor'], 0)
+        self.assertEqual(
+            [row['username'] for row in data['assignments']], ['barney'])
+
+    def test_get_staff_grading_data_filtered(self):
+        block = self.make_one()
+        self.make_student(block, "barney", filename="foo.txt", score=10)
+        self.make_student(block, "fred", filename="bar.txt")
+        self.make_student(block, "wilma")
+        data = block.get_staff_grading_data(mock.Mock(headers={}, params={
+            'submitted_only': 'true', 'ungraded_only': 'true'})).json_body
+        self.assertEqual(
+            [row['username'] for row in data['assignments']], ['fred'])
+        data = block.get_staff_grading_data(mock.Mock(headers={}, params={
+            'search': 'arn'})).json_body
+        self.assertEqual(
+            [row['username'] for row in data['assignments']], ['barney'])
+
+    def test_get_staff_grading_data_sorted_by_downloaded(self):
+        block = self.make_one()
+        barney = self.make_student(block, "barney", filename="foo.txt")
+        fred = self.make_student(block, "fred", filename="bar.txt")
+        wilma = self.make_student(block, "wilma")
+        for student in (barney, fred, wilma):
+            CourseEnrollment.enroll(student['module'].student, self.course_id)
+        block.set_submissions_status_to_downloaded([fred['submission']['uuid']])
+        data = block.get_staff_grading_data(mock.Mock(headers={}, params={
+            'sort': '-downloaded'})).json_body
+        self.assertEqual(
+            [(row['username'], row['downloaded']) for row in data['assignments']],
+            [('fred', True), ('barney', False), ('wilma', False)])
+
+    def test_get_staff_grading_data_bad_params(self):
+        block = self.make_one()
+        response = block.get_staff_grading_data(mock.Mock(headers={}, params={
+            'sort': 'fullname'}))
+        self.assertEqual(response.status_code, 400)
+        response = block.get_staff_grading_data(mock.Mock(headers={}, params={
+            'page_size': '0'}))
+        self.assertEqual(response.status_code, 400)
+
+    def test_get_staff_grading_data_ndjson(self):
+        block = self.make_one()
+        self.make_student(block, "barney", filename="foo.txt", score=10)
+        self.make_student(block, "fred", filename="bar.txt")
+        self.make_student(block, "wilma")
+        response = block.get_staff_grading_data(mock.Mock(headers={}, params={
+            'format': 'ndjson', 'page_size': '1000', 'sort': '-username'}))
+        self.assertEqual(response.content_type, 'application/x-ndjson')
+        lines = [json.loads(line) for line in response.body.splitlines()]
+        page, rows = lines[0], lines[1:]
+        self.assertEqual(page['total'], 3)
+        self.assertNotIn('assignments', page)
+        self.assertEqual(
+            [row['username'] for row in rows], ['wilma', 'fred', 'barney'])
+        self.assertEqual(rows[-1]['score'], 10)
+
+        # Streamed windows can be larger than regular ones
+        response = block.get_staff_grading_data(mock.Mock(headers={}, params={
+            'page_size': '1000'}))
+        self.assertEqual(response.status_code, 400)
+
+    def test_claim_next_submission(self):
+        from edx_sga.models import GradingQueueEntry
+        block = self.make_one()
+        self.make_student(block, "barney", filename="foo.txt", score=10)
+        fred = self.make_student(block, "fred", filename="bar.txt")
+        self.make_student(block, "wilma", filename="baz.txt")
+        self.make_student(block, "betty")
+
+        def claim(username):
+            self.runtime.user_id = User.objects.get_or_create(
+                username=username, defaults={'is_staff': True})[0].id
+            return self.make_one().claim_next_submission(
+                mock.Mock(params={})).json_body['row']
+
+        first = claim('grader1')
+        self.assertIn(first['username'], ('fred', 'wilma'))
+        # A grader keeps their claim until they grade it
+        self.assertEqual(claim('grader1')['username'], first['username'])
+        second = claim('grader2')
+        self.assertEqual(
+            set([first['username'], second['username']]),
+            set(['fred', 'wilma']))
+        self.assertIsNone(claim('grader3'))
+
+        # Grading ends the claim, expired leases can be claimed again
+        graded, left = (first, second) if first['username'] == 'fred' else (
+            second, first)
+        self.runtime.user_id = User.objects.get(username='grader1').id
+        self.make_one().enter_grade(mock.Mock(params={
+            'module_id': fred['module'].id,
+            'submission_id': fred['submission']['uuid'],
+            'grade': 9,
+            'comment': "Good!"}))
+        self.assertFalse(GradingQueueEntry.objects.filter(
+            student_id=graded['student_id']).exists())
+        GradingQueueEntry.objects.filter(student_id=left['student_id']).update(
+            lease_expires=datetime.datetime(2010, 1, 1, tzinfo=pytz.utc))
+        self.assertEqual(claim('grader3')['username'], left['username'])
+
+    def test_get_course_ungraded_work(self):
+        block = self.make_one()
+        students = [
+            self.make_student(block, "barney", filename="foo.txt", score=10),
+            self.make_student(block, "fred", filename="bar.txt"),
+            self.make_student(block, "wilma", filename="baz.txt"),
+            self.make_student(block, "betty"),
+            self.make_student(block, "slate", filename="staff.txt"),
+        ]
+        for student in students:
+            CourseEnrollment.enroll(student['module'].student, self.course_id)
+        # Neither staff nor learners who aren't enrolled are waiting
+        User.objects.filter(username='slate').update(is_staff=True)
+        self.make_student(block, "dino", filename="unenrolled.txt")
+        with mock.patch('edx_sga.sga.modulestore') as store:
+            store.return_value.get_items.return_value = [block]
+            data = block.get_course_ungraded_work(
+                mock.Mock(params={'page_size': '1'})).json_body
+        store.return_value.get_items.assert_called_once_with(
+            block.course_id, qualifiers={'category': 'edx_sga'})
+        self.assertEqual(len(data['blocks']), 1)
+        self.assertEqual(data['blocks'][0]['item_id'], 'XXX')
+        self.assertEqual(data['blocks'][0]['ungraded'], 2)
+        self.assertGreaterEqual(data['blocks'][0]['oldest_ungraded_age'], 0)
+        # fred submitted first, so waited longest
+        self.assertEqual(data['total'], 2)
+        self.assertEqual(
+            [learner['username'] for learner in data['learners']], ['fred'])
+        self.assertEqual(data['learners'][0]['item_ids'], ['XXX'])
+        self.assertEqual(data['next_cursor'], 1)
+
+    def test_get_staff_grading_data_cached(self):
+        block = self.make_one()
+        fred = self.make_student(block, "fred", filename="foo.txt")
+        self.make_student(block, "barney", filename="bar.txt")
+        with CaptureQueriesContext(connection) as built:
+            first = block.get_staff_grading_data(
+                mock.Mock(params={}, headers={}))
+        with CaptureQueriesContext(connection) as cached:
+            second = block.get_staff_grading_data(
+                mock.Mock(params={}, headers={}))
+        self.assertEqual(second.json_body, first.json_body)
+        self.assertLess(len(cached), len(built))
+
+        etag = first.headers['ETag']
+        response = block.get_staff_grading_data(mock.Mock(
+            params={}, headers={'If-None-Match': etag}))
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.body, '')
+
+        block.enter_grade(mock.Mock(params={
+            'module_id': fred['module'].id,
+            'submission_id': fred['submission']['uuid'],
+            'grade': 9,
+            'comment': "Good!"}))
+        response = block.get_staff_grading_data(mock.Mock(
+            params={}, headers={'If-None-Match': etag}))
+        self.assertEqual(response.status_code, 200)
+        rows = {row['username']: row for row in response.json_body['assignments']}
+        self.assertEqual(rows['fred']['score'], 9)
+        self.assertNotEqual(response.headers['ETag'], etag)
+
     def test_enter_grade_instructor(self):
         block = self.make_one()
         block.is_instructor = lambda: True
@@ -388,6 +1147,85 @@ class StaffGradedAssignmentXblockTests(ModuleStoreTestCase):
         self.assertEqual(state['staff_score'], 9)
 
 
+    def test_enter_grade_returns_row(self):
+        block = self.make_one()
+        fred = self.make_student(block, "fred5", filename='foo.txt')
+        version = block.grading_table_version()
+        response = block.enter_grade(mock.Mock(params={
+            'module_id': fred['module'].id,
+            'submission_id': fred['submission']['uuid'],
+            'grade': 9,
+            'comment': "Good!"}))
+        self.assertEqual(response.json_body['row']['username'], 'fred5')
+        self.assertEqual(response.json_body['row']['score'], 9)
+        self.assertEqual(response.json_body['row']['comment'], 'Good!')
+        self.assertGreater(response.json_body['version'], version)
+        self.assertNotIn('assignments', response.json_body)
+
+    def test_get_staff_grading_changes(self):
+        block = self.make_one()
+        fred = self.make_student(block, "fred", filename='foo.txt')
+        self.make_student(block, "barney", filename='bar.txt')
+        version = block.get_staff_grading_data(Request.blank('/')).json_body['version']
+        data = block.get_staff_grading_changes(mock.Mock(params={
+            'version': version})).json_body
+        self.assertEqual(data, {'reload': False, 'rows': [], 'version': version})
+        block.enter_grade(mock.Mock(params={
+            'module_id': fred['module'].id,
+            'submission_id': fred['submission']['uuid'],
+            'grade': 9,
+            'comment': "Good!"}))
+        data = block.get_staff_grading_changes(mock.Mock(params={
+            'version': version})).json_body
+        self.assertEqual([row['username'] for row in data['rows']], ['fred'])
+        self.assertEqual(data['version'], block.grading_table_version())
+
+    def test_delete_old_grading_changes(self):
+        from django.core.management import call_command
+        block = self.make_one()
+        fred = self.make_student(block, "fred", filename='foo.txt')
+        student_id = fred['item'].student_id
+        first = block.grading_changed(student_id)
+        second = block.grading_changed(student_id)
+        third = block.grading_changed(student_id)
+        GradingChange.objects.filter(id__in=[first, second]).update(
+            created=datetime.datetime.now(pytz.utc) - datetime.timedelta(days=2))
+        output = StringIO()
+        call_command('sga_delete_old_grading_changes', stdout=output)
+        self.assertIn('Deleted 1 old grading changes', output.getvalue())
+        # The newest old change of the block is kept
+        self.assertEqual(
+            list(GradingChange.objects.filter(
+                item_id=block.block_id).values_list('id', flat=True)),
+            [second, third])
+        # A client that was at a deleted version missed changes
+        data = block.get_staff_grading_changes(mock.Mock(params={
+            'version': first})).json_body
+        self.assertEqual(data, {'reload': True, 'version': third})
+        data = block.get_staff_grading_changes(mock.Mock(params={
+            'version': second})).json_body
+        self.assertFalse(data['reload'])
+        self.assertEqual([row['username'] for row in data['rows']], ['fred'])
+
+    def test_get_staff_grading_changes_submitted_and_downloaded(self):
+        path = pkg_resources.resource_filename(__package__, 'tests.py')
+        block = self.make_one()
+        fred = self.make_student(block, "fred")
+        CourseEnrollment.enroll(fred['module'].student, self.course_id)
+        version = block.grading_table_version()
+        self.personalize(block, **fred)
+        block.upload_assignment(mock.Mock(params={
+            'assignment': mock.Mock(file=DummyUpload(path, 'test.txt'))}))
+        data = block.get_staff_grading_changes(mock.Mock(params={
+            'version': version})).json_body
+        row, = data['rows']
+        self.assertEqual((row['filename'], row['downloaded']), ('test.txt', False))
+        block.get_submissions()
+        data = block.get_staff_grading_changes(mock.Mock(params={
+            'version': data['version']})).json_body
+        row, = data['rows']
+        self.assertTrue(row['downloaded'])
+
     @data(None, "", '9.24', "second")
     def test_enter_grade_fail(self, grade):
         # pylint: disable=no-member
@@ -409,6 +1247,82 @@ class StaffGradedAssignmentXblockTests(ModuleStoreTestCase):
             "fred5"
         )
 
+    def test_import_grades(self):
+        block = self.make_one()
+        fred = self.make_student(block, "fred", filename="foo.txt")
+        barney = self.make_student(block, "barney", filename="bar.txt")
+        grades = StringIO(
+            "username,student_id,score,comment\n"
+            "fred,,9,Good!\n"
+            ",%s,7,\n" % barney['item'].student_id)
+        response = block.import_grades(mock.Mock(params={
+            'grades': mock.Mock(file=grades)}))
+        self.assertEqual(response.json_body['imported'], 2)
+        self.assertEqual(block.get_score(fred['item'].student_id), 9)
+        self.assertEqual(block.get_score(barney['item'].student_id), 7)
+        state = json.loads(StudentModule.objects.get(pk=fred['module'].id).state)
+        self.assertEqual(state['comment'], 'Good!')
+
+    def test_import_grades_batches(self):
+        block = self.make_one()
+        fred = self.make_student(block, "fred", filename="foo.txt")
+        wilma = self.make_student(block, "wilma")
+        barney = self.make_student(block, "barney", filename="bar.txt")
+        from edx_sga.sga import _read_csv
+        rows = block.validate_grade_rows(_read_csv(
+            StringIO("username,score\nfred,9\nwilma,8\nbarney,7\n")))
+        with mock.patch.object(block, '_apply_grade_batch',
+                               wraps=block._apply_grade_batch) as apply_batch:
+            block.apply_grade_rows(rows, batch_size=2)
+        self.assertEqual(
+            [len(call[0][0]) for call in apply_batch.call_args_list], [2, 1])
+        self.assertEqual(block.get_score(fred['item'].student_id), 9)
+        self.assertEqual(block.get_score(barney['item'].student_id), 7)
+        # wilma had no submission, an empty one was created to grade
+        self.assertEqual(block.get_score(wilma['item'].student_id), 8)
+        self.assertIsNone(
+            block.get_submission(wilma['item'].student_id)['answer']['filename'])
+
+    def test_import_grades_invalid(self):
+        block = self.make_one()
+        fred = self.make_student(block, "fred", filename="foo.txt")
+        grades = StringIO(
+            "username,score\n"
+            "fred,9\n"
+            "fred,8\n"
+            "nobody,5\n"
+            "fred,1000\n")
+        response = block.import_grades(mock.Mock(params={
+            'grades': mock.Mock(file=grades)}))
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(
+            [row['line'] for row in response.json_body['rows'] if row['error']],
+            [3, 4, 5])
+        self.assertEqual(block.get_score(fred['item'].student_id), None)
+
+    def test_export_grades(self):
+        block = self.make_one()
+        self.make_student(
+            block, "barney", filename="foo.txt", sha1="abc", score=10,
+            comment="Good!")
+        fred = self.make_student(block, "fred")
+        response = block.export_grades(mock.Mock(params={}))
+        lines = list(csv.reader(''.join(response.app_iter).splitlines()))
+        self.assertEqual(lines[0], [
+            'username', 'student_id', 'timestamp', 'sha1', 'score', 'comment'])
+        self.assertEqual(
+            sorted(line[0] for line in lines[1:]), ['barney', 'fred'])
+        response = block.export_grades(mock.Mock(params={'format': 'ndjson'}))
+        records = {
+            record['username']: record for record in
+            (json.loads(line) for line in ''.join(response.app_iter).splitlines())
+        }
+        self.assertEqual(records['barney']['sha1'], 'abc')
+        self.assertEqual(records['barney']['score'], 10)
+        self.assertEqual(records['barney']['comment'], 'Good!')
+        self.assertEqual(records['fred']['student_id'], fred['item'].student_id)
+        self.assertEqual(records['fred']['score'], None)
+
     def test_remove_grade(self):
         block = self.make_one()
         student = self.make_student(
@@ -424,7 +1338,153 @@ class StaffGradedAssignmentXblockTests(ModuleStoreTestCase):
         self.assertEqual(block.get_score(item.student_id), None)
         self.assertEqual(state['comment'], '')
 
+    def test_lookups_memoized(self):
+        block = self.make_one()
+        fred = self.make_student(block, "fred", filename="foo.txt")
+        self.personalize(block, **fred)
+        self.runtime.user_id = fred['module'].student_id
+        block.student_state()
+        block.user
+        with CaptureQueriesContext(connection) as queries:
+            block.student_state()
+            block.user
+            block.upload_allowed()
+        self.assertEqual(len(queries), 0)
+
+        # writes in the same request are seen by later lookups
+        block.enter_grade(mock.Mock(params={
+            'module_id': fred['module'].id,
+            'submission_id': fred['submission']['uuid'],
+            'grade': 9}))
+        self.assertEqual(block.score, 9)
+        self.assertFalse(block.upload_allowed())
+
+    def test_grading_summary(self):
+        block = self.make_one()
+        barney = self.make_student(block, "barney", filename="foo.txt", score=10)
+        fred = self.make_student(block, "fred", filename="bar.txt")
+        self.make_student(block, "wilma")
+        self.runtime.user_id = barney['module'].student_id
+        summary = block.get_grading_summary(None).json_body
+        self.assertEqual(summary, {
+            'submitted': 2, 'graded': 1, 'downloaded': 0, 'not_downloaded': 2})
+
+        block.enter_grade(mock.Mock(params={
+            'module_id': fred['module'].id,
+            'submission_id': fred['submission']['uuid'],
+            'grade': 9}))
+        block.get_submissions([barney['item'].student_id])
+        block.remove_grade(mock.Mock(params={
+            'module_id': barney['module'].id,
+            'student_id': barney['item'].student_id}))
+        summary = block.get_grading_summary(None).json_body
+        self.assertEqual(summary, {
+            'submitted': 2, 'graded': 1, 'downloaded': 1, 'not_downloaded': 1})
+
+        # a new upload is not downloaded yet
+        self.personalize(block, **barney)
+        block.clear_memoized()
+        block.submit_answer({"sha1": "abc", "filename": "new.txt", "mimetype": None})
+        self.assertEqual(block.get_grading_summary(None).json_body['downloaded'], 0)
+
+        summary = GradingSummary.objects.get(item_id=block.block_id)
+        rebuilt = block.rebuild_grading_summary()
+        self.assertEqual(
+            (summary.submitted, summary.graded, summary.downloaded),
+            (rebuilt.submitted, rebuilt.graded, rebuilt.downloaded))
+
+    def test_migrate_batch(self):
+        from edx_sga.management.commands.sga_migrate_submissions import (
+            migrate_batch)
+        block = self.make_one()
+        fred = self.make_student(
+            block, "fred", uploaded_sha1="abc", uploaded_filename="foo.txt",
+            uploaded_mimetype="text/plain")
+        fred['module'].state = json.dumps(
+            dict(json.loads(fred['module'].state), score=9.0))
+        fred['module'].save()
+        barney = self.make_student(block, "barney", filename="bar.txt")
+        modules = [fred['module'], barney['module']]
+        self.assertEqual(migrate_batch(block, modules), 1)
+        submission = block.get_submission(fred['item'].student_id)
+        self.assertEqual(submission['answer']['filename'], 'foo.txt')
+        self.assertEqual(block.get_score(fred['item'].student_id), 9)
+        # learners who have a submission are skipped on later runs
+        self.assertEqual(migrate_batch(block, modules), 0)
+
+    def test_benchmark(self):
+        from django.core.files import storage
+        from django.core.management import call_command
+        from edx_sga.benchmarks import BENCHMARKS
+        # The benchmarks swap the storage behind Django's default_storage
+        for module in STORAGE_MODULES:
+            patcher = mock.patch(
+                module + ".default_storage", storage.default_storage)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        users = User.objects.count()
+        output = os.path.join(tempfile.mkdtemp(), 'results.json')
+        # Every learner submitted and none was graded, so no benchmark is
+        # skipped for lack of learners to run it on
+        call_command(
+            'sga_benchmark', learners=4, submitted=1.0, graded=0.0, repeat=2,
+            output=output)
+        with open(output) as results:
+            results = json.load(results)
+        self.assertEqual(
+            sorted(results['results']), sorted(name for name, _ in BENCHMARKS))
+        self.assertEqual(results['results']['enter_grade']['runs'], 2)
+        self.assertEqual(results['parameters']['learners'], 4)
+        # Nothing the benchmarks created is kept
+        self.assertEqual(User.objects.count(), users)
+
+    @mock.patch('edx_sga.management.commands.sga_benchmark.teardown_databases')
+    @mock.patch('edx_sga.management.commands.sga_benchmark.setup_databases')
+    @mock.patch('edx_sga.management.commands.sga_benchmark.run_benchmarks')
+    @mock.patch('edx_sga.management.commands.sga_benchmark.synthetic_course')
+    @mock.patch('edx_sga.management.commands.sga_benchmark.is_test_database')
+    def test_benchmark_test_database(self, is_test_database, synthetic_course,
+                                     run_benchmarks, setup_databases,
+                                     teardown_databases):
+        from django.core.management import call_command
+        run_benchmarks.return_value = {}
+        is_test_database.return_value = False
+        call_command('sga_benchmark', learners=1, stdout=StringIO())
+        setup_databases.assert_called_once_with(1, False, keepdb=False)
+        teardown_databases.assert_called_once_with(
+            setup_databases.return_value, 1, keepdb=False)
+        setup_databases.reset_mock()
+        call_command('sga_benchmark', learners=1, force=True, stdout=StringIO())
+        self.assertFalse(setup_databases.called)
+
     def test_past_due(self):
         block = self.make_one()
         block.due = datetime.datetime(2010, 5, 12, 2, 42, tzinfo=pytz.utc)
         self.assertTrue(block.past_due())
+
+
+class ZipStreamTests(unittest.TestCase):
+    """
+    Tests for the streaming ZIP writer.
+    """
+    def make_archive(self, members, **kwargs):
+        from edx_sga.zipstream import stream_zip
+        return zipfile.ZipFile(StringIO(''.join(stream_zip(members, **kwargs))))
+
+    def test_stream_zip(self):
+        archive = self.make_archive([
+            ('a.txt', ['hello ', 'world'] * 100),
+            (u'\xe9t\xe9.txt', ['summer']),
+            ('empty.txt', []),
+        ])
+        self.assertIsNone(archive.testzip())
+        self.assertEqual(archive.read('a.txt'), 'hello world' * 100)
+        self.assertEqual(archive.read(u'\xe9t\xe9.txt'), 'summer')
+        self.assertEqual(archive.read('empty.txt'), '')
+
+    def test_stream_zip_stored(self):
+        archive = self.make_archive(
+            [('a.txt', ['hello'])], compress_type=zipfile.ZIP_STORED)
+        self.assertEqual(archive.getinfo('a.txt').compress_type,
+                         zipfile.ZIP_STORED)
+        self.assertEqual(archive.read('a.txt'), 'hello')
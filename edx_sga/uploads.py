@@ -0,0 +1,264 @@
+"""
+Storing uploaded files under content addressed paths.
+
+The SHA-1 of an upload names the file it is stored in, but is only known
+once the whole upload has been read.  On local storage the upload is copied
+to a temporary file in a directory next to the storage root, out of what is
+served but on the same filesystem, while it is hashed, then renamed into
+place, so it is read once.  Other storages get the upload
+hashed in one pass and saved in a second, without asking the storage first
+whether the file exists when it overwrites files anyway.
+
+Large files can also be uploaded in chunks, each stored as a part of its
+own, so an interrupted upload resumes after the last chunk that was stored.
+Once the last one is in, a background job reads the parts back one after
+the other as a single file and stores it like any other upload.  Python
+can't save the state of a SHA-1 between requests, so this is when the file
+is hashed.  Uploads that weren't touched for SGA_UPLOAD_SESSION_EXPIRE
+seconds are abandoned: they can't be resumed any more and are deleted with
+their parts.
+"""
+import datetime
+import errno
+import hashlib
+import json
+import os
+import tempfile
+import time
+import uuid
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.utils.timezone import now
+
+from edx_sga.instrumentation import record_storage
+from edx_sga.models import UploadSession
+
+UPLOAD_BLOCK_SIZE = 2**16  # 64kb
+UPLOAD_CHUNK_SIZE = 2**20 * 5  # 5mb
+MAX_UPLOAD_SIZE = 2**30  # 1gb
+UPLOAD_SESSION_EXPIRE = 24 * 60 * 60  # seconds
+TEMP_DIR_SUFFIX = '.sga-uploads'
+# Don't write progress to the database more often than this, in seconds
+PROGRESS_INTERVAL = 1
+
+
+def store_upload(fileobj, path_for_sha1):
+    """
+    Stores the contents of `fileobj` at the storage path that
+    `path_for_sha1` returns for their SHA-1.  Returns the SHA-1.
+    """
+    block_size = getattr(settings, 'SGA_UPLOAD_BLOCK_SIZE', UPLOAD_BLOCK_SIZE)
+    if isinstance(default_storage, FileSystemStorage):
+        return _store_local(fileobj, path_for_sha1, block_size)
+
+    sha1 = hashlib.sha1()
+    size = 0
+    for block in _iter_blocks(fileobj, block_size):
+        sha1.update(block)
+        size += len(block)
+    sha1 = sha1.hexdigest()
+    path = path_for_sha1(sha1)
+    if getattr(default_storage, 'file_overwrite', False) or \
+            not default_storage.exists(path):
+        fileobj.seek(0)
+        default_storage.save(path, File(fileobj))
+        record_storage(written=size)
+    return sha1
+
+
+def upload_chunk_size():
+    """
+    The largest chunk accepted from a chunked upload.
+    """
+    return getattr(settings, 'SGA_UPLOAD_CHUNK_SIZE', UPLOAD_CHUNK_SIZE)
+
+
+def max_upload_size():
+    """
+    The largest file accepted from a learner.
+    """
+    return getattr(settings, 'SGA_MAX_UPLOAD_SIZE', MAX_UPLOAD_SIZE)
+
+
+def store_part(directory, offset, fileobj):
+    """
+    Stores a chunk of an upload that starts at `offset` and returns its
+    path.  Every chunk gets a path of its own, so a chunk sent twice doesn't
+    overwrite the copy that was acknowledged.
+    """
+    path = '{}/{:015d}-{}'.format(directory, offset, uuid.uuid4().hex)
+    fileobj = File(fileobj)
+    path = default_storage.save(path, fileobj)
+    record_storage(written=fileobj.size)
+    return path
+
+
+def delete_parts(paths):
+    for path in paths:
+        default_storage.delete(path)
+
+
+def assemble_upload(job, upload_id, path):
+    """
+    Job function that stores the file of a chunked upload whose chunks are
+    all in, at `path` with its SHA-1 in place of '{sha1}'.  Parts are read
+    from storage once: storages other than the local one get them copied to
+    a temporary file first, which is hashed and saved from.
+    """
+    session = UploadSession.objects.get(upload_id=upload_id)
+    parts = PartsFile(json.loads(session.parts), session.size, session.filename)
+    block_size = getattr(settings, 'SGA_UPLOAD_BLOCK_SIZE', UPLOAD_BLOCK_SIZE)
+    path_for_sha1 = lambda sha1: path.replace('{sha1}', sha1)
+    job.report_progress(0, session.size)
+    if isinstance(default_storage, FileSystemStorage):
+        sha1 = store_upload(parts, path_for_sha1)
+    else:
+        with tempfile.TemporaryFile() as assembled:
+            copied = 0
+            reported = time.time()
+            for block in _iter_blocks(parts, block_size):
+                assembled.write(block)
+                copied += len(block)
+                if time.time() - reported > PROGRESS_INTERVAL:
+                    job.report_progress(copied)
+                    reported = time.time()
+            sha1 = store_upload(assembled, path_for_sha1)
+    job.report_progress(session.size)
+    return {'sha1': sha1}
+
+
+def upload_sessions(**filters):
+    """
+    Returns the upload sessions matching `filters` that haven't expired.
+    """
+    return UploadSession.objects.filter(
+        modified__gt=_expire_cutoff(), **filters)
+
+
+def delete_expired_uploads(**filters):
+    """
+    Deletes the expired upload sessions matching `filters` and their parts.
+    Returns how many were deleted.
+    """
+    deleted = 0
+    expired = UploadSession.objects.filter(
+        modified__lte=_expire_cutoff(), **filters)
+    for session in expired.iterator():
+        # Unless a chunk came in meanwhile
+        if UploadSession.objects.filter(
+                pk=session.pk, modified=session.modified).delete()[0]:
+            delete_parts(json.loads(session.parts))
+            deleted += 1
+    return deleted
+
+
+class PartsFile(object):
+    """
+    Reads the parts stored at `paths` one after the other, as a single file
+    of `size` bytes.  Only rewinding to the start is supported.
+    """
+    def __init__(self, paths, size, name=None):
+        self.paths = paths
+        self.size = size
+        self.name = name
+        self.part = None
+        self.remaining = []
+        self.seek(0)
+
+    def seek(self, offset):
+        if offset != 0:
+            raise ValueError('Parts can only be read from the start')
+        self.close()
+        self.remaining = list(self.paths)
+
+    def read(self, size=-1):
+        data = []
+        while size != 0:
+            if self.part is None:
+                if not self.remaining:
+                    break
+                self.part = default_storage.open(self.remaining.pop(0))
+            chunk = self.part.read(size)
+            if not chunk:
+                self.part.close()
+                self.part = None
+                continue
+            data.append(chunk)
+            record_storage(read=len(chunk))
+            if size > 0:
+                size -= len(chunk)
+        return ''.join(data)
+
+    def close(self):
+        if self.part is not None:
+            self.part.close()
+            self.part = None
+
+
+def upload_temp_dir():
+    """
+    The directory files are written to before being renamed into the local
+    storage.
+    """
+    return getattr(settings, 'SGA_UPLOAD_TEMP_DIR', None) or (
+        default_storage.location.rstrip(os.sep) + TEMP_DIR_SUFFIX)
+
+
+def _store_local(fileobj, path_for_sha1, block_size):
+    temp_dir = upload_temp_dir()
+    _makedirs(temp_dir)
+    temp_path = os.path.join(temp_dir, uuid.uuid4().hex)
+    # Created the way FileSystemStorage creates files, so they get the same
+    # permissions once the umask is applied
+    fd = os.open(
+        temp_path,
+        os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, 'O_BINARY', 0),
+        0o666)
+    sha1 = hashlib.sha1()
+    with os.fdopen(fd, 'wb') as temp:
+        try:
+            for block in _iter_blocks(fileobj, block_size):
+                sha1.update(block)
+                temp.write(block)
+                record_storage(written=len(block))
+        except:
+            os.remove(temp_path)
+            raise
+    sha1 = sha1.hexdigest()
+
+    full_path = default_storage.path(path_for_sha1(sha1))
+    try:
+        _makedirs(os.path.dirname(full_path))
+        if default_storage.file_permissions_mode is not None:
+            os.chmod(temp_path, default_storage.file_permissions_mode)
+        # Files are named after their contents, so replacing one that is
+        # already there changes nothing
+        os.rename(temp_path, full_path)
+    except:
+        os.remove(temp_path)
+        raise
+    return sha1
+
+
+def _expire_cutoff():
+    return now() - datetime.timedelta(seconds=getattr(
+        settings, 'SGA_UPLOAD_SESSION_EXPIRE', UPLOAD_SESSION_EXPIRE))
+
+
+def _iter_blocks(fileobj, block_size):
+    fileobj.seek(0)
+    while True:
+        block = fileobj.read(block_size)
+        if not block:
+            break
+        yield block
+
+
+def _makedirs(directory):
+    try:
+        os.makedirs(directory)
+    except OSError as error:
+        if error.errno != errno.EEXIST:
+            raise
@@ -0,0 +1,279 @@
+"""
+A ZIP archive writer that yields the archive as it is produced.
+
+`zipfile.ZipFile` needs a seekable file to write to, so the whole archive
+has to be built in memory or on disk before the first byte can be sent.
+`ZipStream` writes each member with a trailing data descriptor instead, so
+members can be read and compressed one chunk at a time and the archive
+bytes handed to the client straight away.
+"""
+import datetime
+import struct
+import zipfile
+import zlib
+
+CHUNK_SIZE = 2**16  # 64kb
+
+ZIP64_LIMIT = 0xFFFFFFFF
+ZIP_FILECOUNT_LIMIT = 0xFFFF
+FLAG_DATA_DESCRIPTOR = 0x08
+FLAG_UTF8 = 0x800
+VERSION_DEFAULT = 20
+VERSION_ZIP64 = 45
+CREATE_SYSTEM_UNIX = 3
+EXTERNAL_ATTR = 0o100644 << 16  # regular file, rw-r--r--
+
+LOCAL_HEADER = struct.Struct('<4s2B4HL2L2H')
+DATA_DESCRIPTOR = struct.Struct('<4sL2L')
+DATA_DESCRIPTOR64 = struct.Struct('<4sL2Q')
+CENTRAL_DIRECTORY = struct.Struct('<4s4B4HL2L5H2L')
+END_ARCHIVE = struct.Struct('<4s4H2LH')
+END_ARCHIVE64 = struct.Struct('<4sQ2H2L4Q')
+END_ARCHIVE64_LOCATOR = struct.Struct('<4sLQL')
+
+
+class ZipMember(object):
+    """
+    What the central directory needs to know about a member that was written.
+    """
+    def __init__(self, filename, flag_bits, compress_type, date_time,
+                 header_offset):
+        self.filename = filename
+        self.flag_bits = flag_bits
+        self.compress_type = compress_type
+        self.date_time = date_time
+        self.header_offset = header_offset
+        self.crc = 0
+        self.compress_size = 0
+        self.file_size = 0
+
+
+class ZipStream(object):
+    """
+    Writes a ZIP archive as a sequence of byte strings.
+
+    Use `write` for each member, then `close` for the central directory:
+
+        stream = ZipStream()
+        for name, chunks in files:
+            for data in stream.write(name, chunks):
+                send(data)
+        for data in stream.close():
+            send(data)
+    """
+    def __init__(self, compress_type=zipfile.ZIP_DEFLATED, compress_level=6):
+        if compress_type not in (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED):
+            raise ValueError('Unsupported compression type')
+        self.compress_type = compress_type
+        self.compress_level = compress_level
+        self.members = []
+        self.offset = 0
+
+    def _emit(self, data):
+        self.offset += len(data)
+        return data
+
+    def write(self, arcname, chunks, date_time=None):
+        """
+        Adds a member with the contents yielded by the `chunks` iterable and
+        yields the bytes of the archive that it produces.
+        """
+        member = self._start_member(arcname, self.compress_type, date_time)
+        yield self._emit(_local_header(member))
+
+        if member.compress_type == zipfile.ZIP_DEFLATED:
+            compressor = zlib.compressobj(
+                self.compress_level, zlib.DEFLATED, -zlib.MAX_WBITS)
+        else:
+            compressor = None
+        crc = 0
+        for chunk in chunks:
+            if not chunk:
+                continue
+            crc = zlib.crc32(chunk, crc)
+            member.file_size += len(chunk)
+            if compressor:
+                chunk = compressor.compress(chunk)
+                if not chunk:
+                    continue
+            member.compress_size += len(chunk)
+            yield self._emit(chunk)
+        if compressor:
+            chunk = compressor.flush()
+            member.compress_size += len(chunk)
+            yield self._emit(chunk)
+        member.crc = crc & 0xFFFFFFFF
+
+        yield self._emit(self._end_member(member))
+
+    def write_raw(self, info, chunks):
+        """
+        Adds a member whose data was already compressed, typically copied
+        from another archive with `iter_raw_member`.  `info` is the member's
+        `zipfile.ZipInfo` and `chunks` yields its compressed data.
+        """
+        member = self._start_member(
+            info.filename, info.compress_type, datetime.datetime(*info.date_time))
+        yield self._emit(_local_header(member))
+        for chunk in chunks:
+            member.compress_size += len(chunk)
+            yield self._emit(chunk)
+        if member.compress_size != info.compress_size:
+            raise ValueError(u'Truncated data for {}'.format(info.filename))
+        member.crc = info.CRC
+        member.file_size = info.file_size
+        yield self._emit(self._end_member(member))
+
+    def _start_member(self, arcname, compress_type, date_time):
+        if compress_type not in (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED):
+            raise ValueError('Unsupported compression type')
+        filename, flag_bits = _encode_filename(arcname)
+        return ZipMember(
+            filename,
+            flag_bits | FLAG_DATA_DESCRIPTOR,
+            compress_type,
+            date_time or datetime.datetime.now(),
+            self.offset,
+        )
+
+    def _end_member(self, member):
+        self.members.append(member)
+        if member.file_size > ZIP64_LIMIT or member.compress_size > ZIP64_LIMIT:
+            descriptor = DATA_DESCRIPTOR64
+        else:
+            descriptor = DATA_DESCRIPTOR
+        return descriptor.pack(
+            b'PK\x07\x08', member.crc, member.compress_size, member.file_size)
+
+    def close(self):
+        """
+        Yields the central directory, which ends the archive.
+        """
+        directory_offset = self.offset
+        for member in self.members:
+            yield self._emit(_central_directory_record(member))
+        directory_size = self.offset - directory_offset
+        count = len(self.members)
+
+        if (count > ZIP_FILECOUNT_LIMIT or directory_offset > ZIP64_LIMIT or
+                directory_size > ZIP64_LIMIT):
+            end64_offset = self.offset
+            yield self._emit(END_ARCHIVE64.pack(
+                b'PK\x06\x06', END_ARCHIVE64.size - 12,
+                VERSION_ZIP64, VERSION_ZIP64, 0, 0,
+                count, count, directory_size, directory_offset))
+            yield self._emit(END_ARCHIVE64_LOCATOR.pack(
+                b'PK\x06\x07', 0, end64_offset, 1))
+            count = min(count, ZIP_FILECOUNT_LIMIT)
+            directory_offset = min(directory_offset, ZIP64_LIMIT)
+            directory_size = min(directory_size, ZIP64_LIMIT)
+        yield self._emit(END_ARCHIVE.pack(
+            b'PK\x05\x06', 0, 0, count, count,
+            directory_size, directory_offset, 0))
+
+
+def iter_file(fileobj, chunk_size=CHUNK_SIZE):
+    """
+    Yields the contents of an open file `chunk_size` bytes at a time and
+    closes it once it has been read.
+    """
+    try:
+        while True:
+            chunk = fileobj.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        fileobj.close()
+
+
+def iter_raw_member(archive_file, info, chunk_size=CHUNK_SIZE):
+    """
+    Yields the compressed data of the member described by the ZipInfo `info`
+    from an archive opened as the seekable `archive_file`.
+    """
+    archive_file.seek(info.header_offset)
+    header = archive_file.read(LOCAL_HEADER.size)
+    name_length, extra_length = LOCAL_HEADER.unpack(header)[-2:]
+    archive_file.seek(
+        info.header_offset + LOCAL_HEADER.size + name_length + extra_length)
+    remaining = info.compress_size
+    while remaining > 0:
+        chunk = archive_file.read(min(chunk_size, remaining))
+        if not chunk:
+            break
+        remaining -= len(chunk)
+        yield chunk
+
+
+def stream_zip(members, **kwargs):
+    """
+    Yields a ZIP archive of `members`, an iterable of (arcname, chunks)
+    pairs.  Keyword arguments are passed on to `ZipStream`.
+    """
+    stream = ZipStream(**kwargs)
+    for arcname, chunks in members:
+        for data in stream.write(arcname, chunks):
+            yield data
+    for data in stream.close():
+        yield data
+
+
+def _encode_filename(arcname):
+    if isinstance(arcname, unicode):
+        try:
+            return arcname.encode('ascii'), 0
+        except UnicodeEncodeError:
+            return arcname.encode('utf-8'), FLAG_UTF8
+    return arcname, 0
+
+
+def _dos_date_time(date_time):
+    date_time = max(date_time, datetime.datetime(1980, 1, 1))
+    dos_date = (date_time.year - 1980) << 9 | date_time.month << 5 | date_time.day
+    dos_time = date_time.hour << 11 | date_time.minute << 5 | date_time.second // 2
+    return dos_date, dos_time
+
+
+def _local_header(member):
+    dos_date, dos_time = _dos_date_time(member.date_time)
+    # CRC and sizes follow the data in the data descriptor
+    return LOCAL_HEADER.pack(
+        b'PK\x03\x04', VERSION_DEFAULT, 0, member.flag_bits,
+        member.compress_type, dos_time, dos_date, 0, 0, 0,
+        len(member.filename), 0) + member.filename
+
+
+def _central_directory_record(member):
+    dos_date, dos_time = _dos_date_time(member.date_time)
+    file_size = member.file_size
+    compress_size = member.compress_size
+    header_offset = member.header_offset
+
+    # Values that don't fit in 32 bits go to the zip64 extra field, in this
+    # order, and are replaced by 0xFFFFFFFF in the record itself.
+    zip64_values = []
+    if file_size > ZIP64_LIMIT:
+        zip64_values.append(file_size)
+        file_size = ZIP64_LIMIT
+    if compress_size > ZIP64_LIMIT:
+        zip64_values.append(compress_size)
+        compress_size = ZIP64_LIMIT
+    if header_offset > ZIP64_LIMIT:
+        zip64_values.append(header_offset)
+        header_offset = ZIP64_LIMIT
+    if zip64_values:
+        extra = struct.pack(
+            '<2H%dQ' % len(zip64_values),
+            1, 8 * len(zip64_values), *zip64_values)
+        version = VERSION_ZIP64
+    else:
+        extra = b''
+        version = VERSION_DEFAULT
+
+    return CENTRAL_DIRECTORY.pack(
+        b'PK\x01\x02', version, CREATE_SYSTEM_UNIX, version, 0,
+        member.flag_bits, member.compress_type, dos_time, dos_date,
+        member.crc, compress_size, file_size,
+        len(member.filename), len(extra), 0, 0, 0, EXTERNAL_ATTR,
+        header_offset) + member.filename + extra